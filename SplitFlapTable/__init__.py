@@ -7,7 +7,8 @@
 import bpy.utils
 
 from .structures import SplitFlapSettings, SplitFlapKeySettings
-from .control import SplitFlapPanel, SplitFlapAnimationPanel, SplitFlapApplyFrames, SplitFlapAnimationListItem, SplitFlapAnimationList, SplitFlapController, SplitFlapAnimationController
+from .board import updateBoards, resetBoardCache
+from .control import SplitFlapPanel, SplitFlapAnimationPanel, SplitFlapApplyFrames, SplitFlapAnimationListItem, SplitFlapAnimationList, SplitFlapController, SplitFlapAnimationController, SplitFlapImportSchedule, SplitFlapRetimeTimeline, SplitFlapEditTimeline, SplitFlapOptimizeCharacters, SplitFlapBoardDetail, SplitFlapPreviewTimeline
 
 bl_info = {
     "name": "Split Flap Table Generator",
@@ -23,17 +24,12 @@ bl_info = {
 }
 
 classes = (SplitFlapSettings, SplitFlapKeySettings, SplitFlapPanel, SplitFlapAnimationPanel, SplitFlapApplyFrames,
-            SplitFlapAnimationListItem, SplitFlapAnimationList, SplitFlapController, SplitFlapAnimationController)
+            SplitFlapAnimationListItem, SplitFlapAnimationList, SplitFlapController, SplitFlapAnimationController, SplitFlapImportSchedule, SplitFlapRetimeTimeline, SplitFlapEditTimeline,
+            SplitFlapOptimizeCharacters, SplitFlapBoardDetail, SplitFlapPreviewTimeline)
 
 def register():
-    try:
-        import PIL
-    except ModuleNotFoundError as e:
-        self.report({'ERROR'}, "Please install the python module pillow in your Blender python beforehand.")
-        return
-    
+    # pillow is checked and imported when the first board is created
     for cls in classes:
-        print("register %s" % str(cls))
         bpy.utils.register_class(cls)
     bpy.types.Collection.splitFlapSettings = SplitFlapSettings
     bpy.types.Scene.splitFlapTemplate = bpy.props.StringProperty(name = "ID of the last loaded template flap item", default="")
@@ -43,8 +39,14 @@ def register():
     bpy.types.Scene.splitFlapKeySetting = bpy.props.PointerProperty(type=SplitFlapKeySettings)
     bpy.types.Scene.splitFlapAnimations = bpy.props.PointerProperty(type=SplitFlapAnimationList)
     bpy.types.Scene.splitFlapAnimationIndex = bpy.props.IntProperty(name = "Index for SplitFlapAnimationList", default = -1, update=structures.flapAnimation_updateDisplay)
+    bpy.app.handlers.frame_change_pre.append(updateBoards)
+    bpy.app.handlers.load_post.append(resetBoardCache)
 
 def unregister():
+    if updateBoards in bpy.app.handlers.frame_change_pre:
+        bpy.app.handlers.frame_change_pre.remove(updateBoards)
+    if resetBoardCache in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(resetBoardCache)
     del bpy.types.Scene.splitFlapTemplate
     del bpy.types.Scene.cardTemplate
     del bpy.types.Scene.textStatusMessage
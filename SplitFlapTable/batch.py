@@ -0,0 +1,178 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Command line entry point to build and animate split flap boards without the UI:
+#
+#   blender -b --python SplitFlapTable/batch.py -- board.json [board2.json ...] [--workers N]
+#
+# Every spec file describes one board and is saved as its own blend file. Several spec files are
+# distributed over worker processes running their own Blender instance. The distribution also works
+# from a plain Python interpreter (python batch.py --blender <path to blender> *.json).
+#
+# Spec file (relative paths are relative to the spec file):
+# {
+#     "output": "boards/departures.blend",      blend file to save the result to
+#     "scene": "base.blend",                    optional blend file to start from
+#     "board": {"rowCount": 4, "colCount": 20, "characters": " ABC", "fontName": "DejaVuSans", ...},
+#     "timeline": [{"time": 0, "text": "HELLO"}, {"time": 5, "text": "WORLD", "center": true}],
+#     "schedule": "departures.csv",             optional CSV/JSON schedule, added after "timeline"
+#     "apply": "KEYFRAMES",                     KEYFRAMES or ANGLE_TRACK
+#     "frameEnd": "auto"                        optional scene end frame, "auto" for the end of the last flap
+# }
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import importlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import bpy
+except ImportError: # only distributing spec files to Blender processes
+    bpy = None
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_FILE = "splitFlapTemplate.blend"
+
+
+class SpecError(ValueError):
+    pass
+
+
+def parseArguments(argv):
+    # Blender passes the script arguments after "--"
+    argv = argv[argv.index("--") + 1:] if "--" in argv else argv[1:]
+    parser = argparse.ArgumentParser(prog="batch.py", description="Build and animate split flap boards from spec files.")
+    parser.add_argument("specs", nargs="+", help="JSON spec files, one per board")
+    parser.add_argument("--workers", type=int, default=1, help="number of parallel Blender processes, 0 for one per CPU core")
+    parser.add_argument("--blender", default=None, help="Blender binary for the worker processes")
+    return parser.parse_args(argv)
+
+
+def loadAddon():
+    # import and register the addon package unless Blender has already enabled it
+    packageName = os.path.basename(PACKAGE_DIR)
+    if packageName not in sys.modules:
+        sys.path.insert(0, os.path.dirname(PACKAGE_DIR))
+    addon = importlib.import_module(packageName)
+    if not hasattr(bpy.types.Scene, "splitFlapTool"):
+        addon.register()
+    return addon
+
+
+def runSpec(specPath):
+    # build, animate and save the board of a single spec file in the running Blender instance
+    addon = loadAddon()
+    control = importlib.import_module(addon.__name__ + ".control")
+    schedule = importlib.import_module(addon.__name__ + ".schedule")
+    texture = importlib.import_module(addon.__name__ + ".texture")
+    startTime = time.perf_counter()
+    specPath = os.path.abspath(specPath)
+    with open(specPath, encoding="utf-8") as f:
+        spec = json.load(f)
+    specDir = os.path.dirname(specPath)
+    if "output" not in spec:
+        raise SpecError("%s: missing output file" % specPath)
+
+    if "scene" in spec:
+        bpy.ops.wm.open_mainfile(filepath=os.path.join(specDir, spec["scene"]))
+    # the character texture is stored next to the blend file
+    output = os.path.join(specDir, spec["output"])
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    bpy.ops.wm.save_as_mainfile(filepath=output)
+
+    # board settings
+    scene = bpy.context.scene
+    sfTool = scene.splitFlapTool
+    for key, value in spec.get("board", {}).items():
+        if key not in sfTool.bl_rna.properties:
+            raise SpecError("%s: unknown board setting %s" % (specPath, key))
+        if key == "fontName":
+            fontPath = texture.findFont(value)
+            if fontPath is None:
+                raise SpecError("%s: font %s not found" % (specPath, value))
+            value = fontPath
+        setattr(sfTool, key, value)
+    collectionsBefore = set(bpy.data.collections.keys())
+    bpy.ops.object.splitflapcontroller(templatePath=os.path.join(PACKAGE_DIR, TEMPLATE_FILE))
+    newCollections = [coll for coll in bpy.data.collections if coll.name not in collectionsBefore and "SplitFlap" in coll]
+    if len(newCollections) == 0:
+        raise SpecError("%s: the board could not be created" % specPath)
+    collection = newCollections[0]
+    scene.splitFlapKeySetting.collection = collection
+
+    # timeline
+    lines = spec.get("timeline", [])
+    rows = [schedule.parseRecord(i, record) for i, record in enumerate(lines, 1)]
+    if "schedule" in spec:
+        rows.extend(schedule.readSchedule(os.path.join(specDir, spec["schedule"])))
+    rowCount, conflicts = control.addScheduleRows(scene, rows, defaultCollection=collection.name)
+    for index, kind, value in conflicts.get(collection.name, []):
+        item = scene.splitFlapAnimations.items[index]
+        print("%s: conflict (%s %.2f) at t %.2f '%s'" % (specPath, kind, value, item.keyTime, item.text))
+
+    # animation
+    bpy.ops.object.splitflapapplyframes(output=spec.get("apply", 'KEYFRAMES'), incremental=False)
+    frameEnd = spec.get("frameEnd")
+    if frameEnd == "auto":
+        scene.frame_end = max(collection.get("SplitFlapApplied.lastFrame", 0), scene.frame_start)
+    elif frameEnd is not None:
+        scene.frame_end = int(frameEnd)
+    bpy.ops.wm.save_as_mainfile(filepath=output)
+    print("%s: saved %s with %d timeline entries in %.2f s" % (specPath, output, rowCount, time.perf_counter() - startTime))
+    return output
+
+
+def findBlender(blender=None):
+    if blender is not None:
+        return blender
+    if bpy is not None:
+        return bpy.app.binary_path
+    return shutil.which("blender")
+
+
+def runWorker(blender, specPath):
+    # one Blender process per spec file, the output is written to <spec>.log
+    startTime = time.perf_counter()
+    command = [blender, "-b", "--python-exit-code", "1", "--python", os.path.abspath(__file__), "--", specPath]
+    with open("%s.log" % specPath, "w") as log:
+        returnCode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+    return specPath, returnCode, time.perf_counter() - startTime
+
+
+def runSpecs(specs, workers=1, blender=None):
+    # returns the number of failed spec files
+    if bpy is not None and len(specs) == 1:
+        runSpec(specs[0])
+        return 0
+    blender = findBlender(blender)
+    if blender is None:
+        raise SpecError("Blender binary not found, please pass --blender")
+    workers = min(len(specs), workers if workers > 0 else os.cpu_count())
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for specPath, returnCode, duration in executor.map(lambda specPath: runWorker(blender, specPath), specs):
+            print("%s: %s after %.1f s" % (specPath, "done" if returnCode == 0 else "FAILED (exit code %d, see log)" % returnCode, duration))
+            failed += returnCode != 0
+    return failed
+
+
+def main(argv):
+    args = parseArguments(argv)
+    try:
+        failed = runSpecs(args.specs, workers=args.workers, blender=args.blender)
+    except (OSError, ValueError) as e:
+        print("Error: %s" % e)
+        return 1
+    return 1 if failed > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,145 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Instanced board: a single object whose points carry the drum angle of every
+# split flap item, the drum itself is instanced by Geometry Nodes.
+
+import math
+import bpy
+import numpy as np
+from bpy.app.handlers import persistent
+
+from .nodes import getBoardNodeGroup, getFlapGroup, flapCount, setModifierInput, ANGLE_ATTRIBUTE, BOARD_GROUP_NAME
+from .planner import frameLookup, lookupAngles, bakeAngleTrack
+from .lod import updateLODObject, resetLODCache, getLODObject, setLODPlan, hasLODPlan
+
+MAX_TRACK_SIZE = 16384 # maximum image width/height of the angle track
+
+_lookups = {} # board object name -> FrameLookup of the plan
+_lastFrames = {} # board object name -> last frame written to the angle attribute
+
+
+def createBoardObject(name, collection, drum, offsets):
+    # one vertex per split flap item, ordered row by row like the split flap item objects
+    offsets = np.asarray(offsets, dtype=np.float32)
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(offsets))
+    mesh.vertices.foreach_set("co", offsets.ravel())
+    mesh.attributes.new(ANGLE_ATTRIBUTE, 'FLOAT', 'POINT')
+    mesh.update()
+    boardObj = bpy.data.objects.new(name, mesh)
+    boardObj["SplitFlapBoard"] = True
+    collection.objects.link(boardObj)
+    modifier = boardObj.modifiers.new(BOARD_GROUP_NAME, 'NODES')
+    modifier.node_group = getBoardNodeGroup(getFlapGroup(drum))
+    # the board turns the flaps of the drum geometry at angle 0, the drum angle (Input_8) must stay 0
+    setModifierInput(modifier, "Drum", drum)
+    drumModifier = drum.modifiers["SplitFlapCircle"]
+    setModifierInput(modifier, "Ring Radius", drumModifier["Input_3"])
+    setModifierInput(modifier, "Flap Count", flapCount(drumModifier["Input_4"]))
+    return boardObj
+
+
+def getBoardObjects(collection):
+    return [obj for obj in collection.all_objects if "SplitFlapBoard" in obj and obj.type == 'MESH']
+
+
+def setBoardPlan(boardObj, plan):
+    # the plan is only kept in memory, see updateBoards for loaded files
+    _lookups[boardObj.name] = frameLookup(plan)
+    _lastFrames.pop(boardObj.name, None)
+
+
+def updateBoardAngles(boardObj, frame):
+    mesh = boardObj.data
+    attribute = mesh.attributes.get(ANGLE_ATTRIBUTE)
+    if attribute is None or _lastFrames.get(boardObj.name) == frame:
+        return
+    lookup = _lookups.get(boardObj.name)
+    if lookup is None:
+        angles = np.zeros(len(mesh.vertices), dtype=np.float32)
+    else:
+        angles = lookupAngles(lookup, len(mesh.vertices), frame).astype(np.float32)
+    attribute.data.foreach_set("value", angles)
+    mesh.update()
+    _lastFrames[boardObj.name] = frame
+
+
+def setBoardAngleTrack(boardObj, plan, frameCount):
+    # bake the angles into a float image sampled by the board node group: one column per cell,
+    # four consecutive frames in the RGBA channels of a row
+    cellCount = len(boardObj.data.vertices)
+    rows = math.ceil(frameCount / 4)
+    modifier = boardObj.modifiers.get(BOARD_GROUP_NAME)
+    if modifier is None or cellCount == 0 or rows > MAX_TRACK_SIZE or cellCount > MAX_TRACK_SIZE:
+        return None
+    track = bakeAngleTrack(plan, cellCount, 4 * rows)
+    pixels = track.reshape(rows, 4, cellCount).transpose(0, 2, 1)
+    name = "%sAngleTrack" % boardObj.name
+    image = bpy.data.images.get(name)
+    if image is not None and (image.size[0] != cellCount or image.size[1] != rows):
+        bpy.data.images.remove(image)
+        image = None
+    if image is None:
+        image = bpy.data.images.new(name, cellCount, rows, alpha=True, float_buffer=True)
+    image.colorspace_settings.name = 'Non-Color'
+    image.alpha_mode = 'CHANNEL_PACKED'
+    image.pixels.foreach_set(np.ascontiguousarray(pixels, dtype=np.float32).ravel())
+    image.file_format = 'OPEN_EXR'
+    image.pack()
+    setModifierInput(modifier, "Angle Track", image)
+    setModifierInput(modifier, "Track Frames", 4 * rows)
+    setModifierInput(modifier, "Cell Count", cellCount)
+    setModifierInput(modifier, "Use Angle Track", True)
+    boardObj["SplitFlapTrack"] = image.name
+    return image
+
+
+def clearBoardAngleTrack(boardObj):
+    modifier = boardObj.modifiers.get(BOARD_GROUP_NAME)
+    if modifier is not None:
+        setModifierInput(modifier, "Use Angle Track", False)
+    if "SplitFlapTrack" in boardObj:
+        image = bpy.data.images.get(boardObj["SplitFlapTrack"])
+        if image is not None:
+            bpy.data.images.remove(image)
+        del boardObj["SplitFlapTrack"]
+
+
+@persistent
+def updateBoards(scene, depsgraph=None):
+    frame = scene.frame_current + scene.frame_subframe
+    boards = []
+    # only the split flap collections of the scene are searched, not every object
+    for coll in scene.collection.children_recursive:
+        if "SplitFlap" not in coll:
+            continue
+        lodObj = getLODObject(coll)
+        # boards with an angle track are animated by their node group alone
+        collBoards = [obj for obj in getBoardObjects(coll) if "SplitFlapTrack" not in obj]
+        if (lodObj is not None and not hasLODPlan(coll)) or any(obj.name not in _lookups for obj in collBoards):
+            # only fingerprints of the last apply are saved, plan it again after loading the file
+            from .control import getAppliedPlan
+            plan = getAppliedPlan(scene, coll)
+            if plan is not None:
+                setLODPlan(coll, plan)
+                for obj in collBoards:
+                    setBoardPlan(obj, plan)
+        if lodObj is not None:
+            updateLODObject(scene, lodObj, frame)
+        boards.extend(collBoards)
+    # boards replaced by their flat level of detail are skipped
+    for obj in boards:
+        if not (obj.hide_viewport and obj.hide_render):
+            updateBoardAngles(obj, frame)
+
+
+@persistent
+def resetBoardCache(*args):
+    # object names may refer to different objects after loading another file
+    _lookups.clear()
+    _lastFrames.clear()
+    resetLODCache()
@@ -6,11 +6,19 @@
 
 import os
 import bpy
-import math
-import addon_utils
+import time
+import numpy as np
 from mathutils import Vector
+from bpy_extras.io_utils import ImportHelper
 
-from .texture import createCharactersTexture, findFont
+from .planner import planFrames, replanFrames, sortedKeyframes, compactKeyframes, splitKeyframes, updateKeyframes, holdKeyframes, keyFingerprints, storeFingerprints, loadFingerprints
+from .timeline import getTimeline, formatText, firstChange
+from .schedule import readSchedule, ScheduleError
+from .edit import TimelineEdit, TimelineEditError
+from .optimizer import optimizeDrumOrder
+from .frame import frameGeometry
+from .board import createBoardObject, getBoardObjects, setBoardPlan, setBoardAngleTrack, clearBoardAngleTrack
+from .lod import createLODObject, getLODObject, getDetailObjects, setLODPlan, updateLODObject, atlasShape, DEFAULT_DISTANCE
 from .structures import SplitFlapKeySettings, SplitFlapSettings, flapKeySettings_updateTextSource, flapAnimation_updateDisplay
 
 class SplitFlapPanel(bpy.types.Panel):
@@ -37,6 +45,7 @@ class SplitFlapPanel(bpy.types.Panel):
         row.prop(sfTool, "flapTime")
         row = layout.row()
         row.prop(sfTool, "characters")
+        row.operator("object.splitflapoptimizecharacters", text="", icon='SORTSIZE')
         row = layout.row()
         row.prop(sfTool, "charWidth")
         row.prop(sfTool, "charHeight")
@@ -52,6 +61,11 @@ class SplitFlapPanel(bpy.types.Panel):
         row = layout.row()
         row.prop(sfTool, "createFrame")
         row = layout.row()
+        row.prop(sfTool, "boardMode")
+        row = layout.row()
+        row.prop(sfTool, "atlasLayout")
+        row.prop(sfTool, "atlasFormat")
+        row = layout.row()
         row.operator("object.splitflapcontroller", text="Create split flap items")
 
 
@@ -80,6 +94,7 @@ class SplitFlapAnimationPanel(bpy.types.Panel):
             layout.label(text=textStatus)
         row = layout.row()
         row.prop(sfKeySetting, "keyTime")
+        row.operator("object.splitflapanimationcontroller", text="", icon='SNAP_ON').action='SNAP'
         row = layout.row()
         row.prop(sfKeySetting, "extend")
         row.prop(sfKeySetting, "center")
@@ -90,7 +105,24 @@ class SplitFlapAnimationPanel(bpy.types.Panel):
         row.operator("object.splitflapanimationcontroller", text="update entry").action='UPDATE'
         row.operator("object.splitflapanimationcontroller", text="remove entry").action='DELETE'
         row = layout.row()
-        row.operator("object.splitflapapplyframes")
+        row.operator("object.splitflapimportschedule", text="import schedule")
+        row.operator("object.splitflapretimetimeline", text="retime").mode='RESOLVE'
+        row.operator("object.splitflapretimetimeline", text="compact").mode='COMPACT'
+        row = layout.row()
+        row.operator("object.splitflapedittimeline", text="shift entries").action='SHIFT'
+        row.operator("object.splitflapedittimeline", text="remove entries").action='REMOVE'
+        row = layout.row()
+        row.operator("object.splitflapapplyframes").output='KEYFRAMES'
+        row.operator("object.splitflapapplyframes", text="bake angle track").output='ANGLE_TRACK'
+        row = layout.row()
+        row.operator("object.splitflapapplyframes", text="apply all boards").allBoards = True
+        op = row.operator("object.splitflapapplyframes", text="rebuild keyframes")
+        op.output = 'KEYFRAMES'
+        op.incremental = False
+        row = layout.row()
+        row.operator("object.splitflapboarddetail", text="board detail")
+        row.operator("object.splitflappreviewtimeline", text="preview").mode='FRAME'
+        row.operator("object.splitflappreviewtimeline", text="preview sequence").mode='SEQUENCE'
 
 class SplitFlapAnimationListItem(bpy.types.UIList):
     bl_label = "SplitFlapAnimation List Item"
@@ -116,7 +148,8 @@ class SplitFlapAnimationController(bpy.types.Operator):
         items=[
             ('DELETE', 'remove entry', 'remove entry'),
             ('UPDATE', 'update entry', 'update entry'),
-            ('ADD', 'add entry', 'add entry')
+            ('ADD', 'add entry', 'add entry'),
+            ('SNAP', 'snap to earliest time', 'Set the time key to the earliest feasible time after the previous entry')
         ]
     )
     
@@ -126,41 +159,57 @@ class SplitFlapAnimationController(bpy.types.Operator):
         
         # update text (text input can remain the same but contain new text)
         flapKeySettings_updateTextSource(sfKeySetting, context)
-        print(sfKeySetting) # TODO
         
         # checks
         if len(sfKeySetting.collectionID) == 0:
             self.report({'INFO'}, "Please choose a collection of split flap items to animate!")
             return {'FINISHED'}
         
-        if self.action == "ADD" or self.action == "UPDATE":
+        if self.action in ("ADD", "UPDATE", "SNAP"):
+            if sfKeySetting.collectionID not in bpy.data.collections:
+                self.report({'INFO'}, "The item could not be added/updated due to missing input or duplicated data.")
+                return {'FINISHED'}
+            collection = bpy.data.collections[sfKeySetting.collectionID]
             # convert the string according to the available characters
-            characters = bpy.data.collections[sfKeySetting.collectionID]["SplitFlapSettings.characters"]
             newText = self.formatText(sfKeySetting.text, context)
             sfKeySetting.formattedText = newText
+            for item in sfAnimations.items:
+                if item.collectionID == collection.name and len(item.formattedText) == 0:
+                    item.formattedText = self.formatText(item.text, context)
             
-            timeDiffPrev = self.feasibleTime(context, deltaIndex = -1)
-            timeDiffNext = self.feasibleTime(context, deltaIndex = 1)
+            # check if the time difference is enough to switch from the previous and to the next text
+            timeline = getCollectionTimeline(context.scene, collection)
+            index = context.scene.splitFlapAnimationIndex
+            replaceIndex = timeline.indexOfSource(index) if self.action == "UPDATE" else None
+            newEntry = (sfKeySetting.keyTime, newText, sfKeySetting.extend, sfKeySetting.center)
+            if self.action == "SNAP":
+                sfKeySetting.keyTime = timeline.earliestTime(newEntry, fps=context.scene.render.fps / context.scene.render.fps_base)
+                newEntry = (sfKeySetting.keyTime,) + newEntry[1:]
+                timeDiffPrev, timeDiffNext = timeline.checkEntry(newEntry)
+                if timeDiffPrev < 0 or timeDiffNext < 0:
+                    self.report({'INFO'}, "There is not enough time before the next entry, please retime the timeline.")
+                else:
+                    self.report({'INFO'}, "Time key set to %.2f s." % sfKeySetting.keyTime)
+                return {'FINISHED'}
+            timeDiffPrev, timeDiffNext = timeline.checkEntry(newEntry, replaceIndex=replaceIndex)
             if timeDiffPrev < 0:
                 self.report({'INFO'}, "The time is not sufficient to flap from the previous text. The time diff. amounts to %.2f s." % timeDiffPrev)
                 return {'FINISHED'}
             elif timeDiffNext < 0:
                 self.report({'INFO'}, "The time is not sufficient to flap to the next text. The time diff. amounts to %.2f s." % timeDiffNext)
                 return {'FINISHED'}
-            elif len(sfKeySetting.collectionID) > 0 and sfKeySetting.collectionID in bpy.data.collections:
-                # check if there is already an entry for the same time
-                frameSettings = [frame for frame in sfAnimations.items if frame.collectionID == sfKeySetting.collectionID and abs(frame.keyTime - sfKeySetting.keyTime) < 0.1]
+            else:
                 done = False
                 if self.action == "UPDATE":
-                    index = context.scene.splitFlapAnimationIndex
-                    item = sfAnimations.items[index]
-                    item.text = sfKeySetting.text
-                    item.formattedText = sfKeySetting.formattedText
-                    item.extend = sfKeySetting.extend
-                    item.keyTime = sfKeySetting.keyTime
-                    item.center = sfKeySetting.center
-                    done = True
-                elif len(frameSettings) == 0:
+                    if 0 <= index < len(sfAnimations.items):
+                        item = sfAnimations.items[index]
+                        item.text = sfKeySetting.text
+                        item.formattedText = sfKeySetting.formattedText
+                        item.extend = sfKeySetting.extend
+                        item.keyTime = sfKeySetting.keyTime
+                        item.center = sfKeySetting.center
+                        done = True
+                elif timeline.findNear(sfKeySetting.keyTime) is None: # check if there is already an entry for the same time
                     item = sfAnimations.items.add()
                     sfAnimations.itemIndex = len(sfAnimations.items) - 1
                     item.text = sfKeySetting.text
@@ -183,197 +232,461 @@ class SplitFlapAnimationController(bpy.types.Operator):
         sfKeySetting = context.scene.splitFlapKeySetting
         colCount = sfKeySetting.collection["SplitFlapSettings.colCount"]
         characters = sfKeySetting.collection["SplitFlapSettings.characters"]
-        text = text.replace("\r", "")
-        if "\n" in text:
-            print("newline in text")
-            if colCount is None or ' ' not in characters:
-                text = text.replace("\n", "")
-            elif colCount is not None: # fill incomplete lines with space characters
-                print("Fill with space characters")
-                idx = 0
-                while idx < len(text):
-                    nextNewLine = text.find("\n")
-                    if nextNewLine < 0:
-                        break
-                    diffToFullRow = colCount - nextNewLine % colCount
-                    text = text.replace("\n", ' ' * diffToFullRow, 1)
-                    print("Inserted %d space characters to fill the line" % diffToFullRow)
-                    idx = nextNewLine + diffToFullRow
-        print("format '%s'" % text)
-        newTextList = []
-        for char in text:
-            if char in characters:
-                newTextList.append(char)
-            elif char.lower() in characters:
-                newTextList.append(char.lower())
-            elif char.upper() in characters:
-                newTextList.append(char.upper())
-            elif char in ("\n", "\r"):
-                continue
-            elif ' ' in characters:
-                newTextList.append(' ')
-        print("formatted string: %s" % ("".join(newTextList)))
-        return "".join(newTextList)
-    
-    def feasibleTime(self, context, deltaIndex = -1):
-        sfKeySetting = context.scene.splitFlapKeySetting
-        sfAnimations = context.scene.splitFlapAnimations
-        if len(sfAnimations.items) == 0:
-            return 0
-            
-        # get time and text to add
-        index = context.scene.splitFlapAnimationIndex
-        collection = bpy.data.collections[sfAnimations.items[index].collectionID]
-        flapTime = collection["SplitFlapSettings.flapTime"]
-        characters = collection["SplitFlapSettings.characters"]
-        
-        size = len(sfAnimations.items)
-        for i in range(size):
-            if len(sfAnimations.items[i].formattedText) == 0:
-                sfAnimations.items[i].formattedText = self.formatText(sfAnimations.items[i].text, context)
-        
-        flapCount = len(collection.objects)
-        frames = [(item.keyTime, item.formattedText, False) for item in sfAnimations.items]
-        if self.action == "UPDATE":
-            frames[index] = (sfKeySetting.keyTime, sfKeySetting.formattedText, True)
-        else:
-            frames.append((sfKeySetting.keyTime, sfKeySetting.text, True))
-        # check if the time difference is enough to switch to the new text
-        frames.sort(key=lambda x:x[0])
-        newIndex = -1
-        for i in range(len(frames)):
-            if frames[i][2]:
-                newIndex = i
-                break
-        if deltaIndex < 0: # check previous
-            #print("newIndex %d text %s frames %s" % (newIndex, sfKeySetting.text, str(frames)))
-            if newIndex > 0: 
-                deltaT = frames[newIndex][0] - frames[newIndex-1][0]
-                newString = self.__getFinalString(flapCount, sfAnimations.items, newIndex, sfKeySetting)
-                previousString = self.__getFinalString(flapCount, sfAnimations.items, newIndex-1, sfKeySetting)
-                #print("characters %s newString %s" % (characters, newString))
-                neededTime = max([self.__getFlaps(entry[0], entry[1], characters) for entry in zip(previousString, newString)]) * flapTime
-                return deltaT - neededTime
-            else:
-                if frames[newIndex][0] < 0.01:
-                    return 0
-                else:
-                    fromString = "A" * flapCount
-                    newString = self.__getFinalString(flapCount, sfAnimations.items, newIndex, sfKeySetting)
-                    neededTime = max([self.__getFlaps(entry[0], entry[1], characters) for entry in zip(fromString, newString)]) * flapTime
-                    return frames[newIndex][0] - neededTime
-        else: # check next
-            if newIndex > len(sfAnimations.items) - 2:
-                return 0
-            else:
-                deltaT = frames[newIndex+1][0] - frames[newIndex][0]
-                nextString = self.__getFinalString(flapCount, sfAnimations.items, newIndex+1, sfKeySetting)
-                newString = self.__getFinalString(flapCount, sfAnimations.items, newIndex, sfKeySetting)
-                neededTime = max([self.__getFlaps(entry[0], entry[1], characters) for entry in zip(newString, nextString)]) * flapTime
-                return deltaT - neededTime
-    
-    def __getFinalString(self, length, items, index, newItem):
-        if newItem is None:
-            newItem = items[index]
-        textLen = len(newItem.formattedText)
-        if textLen >= length:
-            return newItem.formattedText[:length]
-        if newItem.center:
-            indent = (length - textLen)//2
-            remainder = length - indent - textLen
-            return " " * indent + newItem.formattedText + " " * remainder
-        elif newItem.extend:
-            remainder = length - textLen
-            return newItem.formattedText + " " * remainder
-        else:
-            previousString = self.__getFinalString(length, items, index-1, None)
-            return newItem.formattedText + previousString[textLen:]
-    
-    def __getFlaps(self, fromChar, toChar, characters):
-        print("from %s to %s in %s" % (fromChar, toChar, characters))
-        startIndex = characters.index(fromChar)
-        targetIndex = characters.index(toChar)
-        return targetIndex - startIndex if targetIndex >= startIndex else len(characters) - startIndex + targetIndex
+        return formatText(text, characters, colCount)
+
+_applied = {} # collection name -> (settings, entries, plan, keyframes, fingerprints) of the last apply in this session
 
 class SplitFlapApplyFrames(bpy.types.Operator):
     bl_idname = "object.splitflapapplyframes"
     bl_label = "Split Flap Apply Frames"
+    output: bpy.props.EnumProperty(
+        items=[
+            ('KEYFRAMES', 'keyframes', 'Animate the drum angle with keyframes'),
+            ('ANGLE_TRACK', 'angle track', 'Bake the drum angles of all frames into a float image sampled by the board (instanced boards only)')
+        ],
+        default='KEYFRAMES'
+    )
+    
+    incremental: bpy.props.BoolProperty(
+        name="incremental",
+        description="Only rewrite the keyframes of split flap items whose animation changed since the last apply",
+        default=True
+    )
+    
+    allBoards: bpy.props.BoolProperty(
+        name="all boards",
+        description="Apply the frames of all split flap collections with entries in the animation list",
+        default=False
+    )
+    
+    compact: bpy.props.BoolProperty(
+        name="compact keyframes",
+        description="Interpolate linearly (constant while a flap rests) and drop the keyframes the interpolation reproduces",
+        default=True
+    )
     
     def execute(self, context):
         frameBefore = context.scene.frame_current
         sfKeySetting = context.scene.splitFlapKeySetting
-        sfAnimations = context.scene.splitFlapAnimations
-        collID = sfKeySetting.collectionID # apply settings of the current collection
-        frameSettings = [frame for frame in sfAnimations.items if frame.collectionID == collID]
-        frameSettings.sort(key=lambda frame:frame.keyTime)
         fps = bpy.context.scene.render.fps / bpy.context.scene.render.fps_base
         
-        if collID in bpy.data.collections:
-            coll = bpy.data.collections[collID]
+        # group the entries of the animation list by collection in a single pass
+        itemGroups = groupAnimationItems(context.scene)
+        if self.allBoards:
+            collections = [bpy.data.collections[collID] for collID in itemGroups if collID in bpy.data.collections]
+        elif sfKeySetting.collectionID in bpy.data.collections: # apply settings of the current collection
+            collections = [bpy.data.collections[sfKeySetting.collectionID]]
+        else:
+            collections = []
+        
+        startTime = time.perf_counter()
+        for coll in collections:
+            boardStartTime = time.perf_counter()
+            changedCount, incremental = self.applyCollection(context, coll, fps, itemGroups.get(coll.name, []))
+            if self.allBoards:
+                self.report({'INFO'}, "%s: %s %d split flap items in %.2f s." % (coll.name, "updated" if incremental else "animated", changedCount, time.perf_counter() - boardStartTime))
+            elif incremental:
+                self.report({'INFO'}, "Updated the keyframes of %d split flap items." % changedCount)
+        if self.allBoards:
+            self.report({'INFO'}, "Applied the frames of %d boards in %.2f s." % (len(collections), time.perf_counter() - startTime))
+        context.scene.frame_set(frameBefore) # set frame back to begin
+        return {'FINISHED'}
+    
+    def applyCollection(self, context, coll, fps, items):
+        # returns the number of animated split flap items and whether the last apply could be updated
+        flapItems = [obj for obj in coll.all_objects if "SplitFlapItem" in obj]
+        interpolation = 'LINEAR' if self.compact else context.preferences.edit.keyframe_new_interpolation_type
+        handleType = context.preferences.edit.keyframe_new_handle_type
+        timeline = getCollectionTimeline(context.scene, coll, items=items)
+        cellCount = timeline.cellCount
+        
+        # the keyframes of the last apply can only be updated if they were written with the same settings
+        # only the fingerprints of the keyframes are stored, the keyframes themselves are kept in memory for this session
+        applySettings = "%g|%s|%s|%d|%d|%s|%g" % (fps, interpolation, handleType, len(flapItems), self.compact, timeline.characters, timeline.flapTime)
+        fingerprints = loadFingerprints(coll)
+        incremental = self.incremental and fingerprints is not None and len(fingerprints) == cellCount and coll.get("SplitFlapApplied.settings") == applySettings
+        applied = _applied.get(coll.name)
+        if not incremental:
             # remove previous settings
             for obj in coll.all_objects:
                 obj.animation_data_clear ()
                 # reset rotation to 0
-                for modifier in obj.modifiers:
-                    if modifier.type == 'NODES' and modifier.name == "SplitFlapCircle":
-                        modifier["Input_8"] = 0.
-            
-            # compute frames: angle for every split flap
-            flapTime =  coll["SplitFlapSettings.flapTime"]
-            characters = coll["SplitFlapSettings.characters"]
-            startChar = characters[0]
-            lastFrame = []
-            maxLen = len(coll.all_objects)
-            startIdx = characters.index(startChar) if startChar in characters else 0
-            spaceIdx = characters.index(" ") if " " in characters else 0
-            lastString = startChar * len(coll.all_objects)
-            
-            for frameSetting in frameSettings:
-                i = 0
-                if frameSetting.extend:
-                    targetString = frameSetting.formattedText[:maxLen] if len(frameSetting.formattedText) >= maxLen else frameSetting.formattedText + " " * (maxLen - len(frameSetting.formattedText))
-                elif frameSetting.center:
-                    textLen = len(frameSetting.formattedText)
-                    if textLen >= maxLen:
-                        targetString = frameSetting.formattedText[:maxLen]
-                    else:
-                        indent = (maxLen - textLen)//2
-                        remainder = maxLen - indent - textLen
-                        targetString = " " * indent + frameSetting.formattedText + " " * remainder
-                else:
-                    targetString = "%s%s" % (frameSetting.formattedText[:maxLen], lastString[len(frameSetting.formattedText):])
-                startFrame = int(round(fps * frameSetting.keyTime))
-                print("lastString '%s' targetString '%s'" % (lastString, targetString))
-                
-                for obj in coll.all_objects:
-                    if not "SplitFlapItem" in obj:
-                        print("skip obj %s" % obj.name)
-                        continue
-                    if lastString[i] == targetString[i]:
-                        print("Skip remaining character '%s' at index %d" % (lastString[i], i))
-                        i += 1
-                        continue
-                    currentIdx = characters.index(lastString[i])
-                    nextIdx = characters.index(targetString[i])
-                    if currentIdx < 0 or nextIdx < 0:
-                        print("Cannot find a character in the given alphabet '%s'" % characters)
-                        i += 1
-                        continue
-                    idxDiff = nextIdx - currentIdx if nextIdx > currentIdx else nextIdx + len(characters) - currentIdx
-                    angleDiff = 2 * math.pi * idxDiff/len(characters)
-                    flapFrames = int(round(fps * idxDiff * flapTime))
-                    endFrame = startFrame + flapFrames
-                    for modifier in obj.modifiers:
-                        if modifier.type == 'NODES' and modifier.name == "SplitFlapCircle":
-                            if frameSetting.keyTime > 0.01:
-                                modifier.keyframe_insert(data_path='["Input_8"]',frame=startFrame)
-                            print("Change from '%s' to '%s' at index %d: index diff %d angle %.2f + %.2f at frame %d" % (lastString, targetString, i, idxDiff, modifier["Input_8"], angleDiff, startFrame))
-                            modifier["Input_8"] += angleDiff
-                            modifier.keyframe_insert(data_path='["Input_8"]',frame=endFrame)
-                            lastString = lastString[:i] + targetString[i] + lastString[i + 1:]
-                            break
-                    i += 1
-        context.scene.frame_set(frameBefore) # set frame back to begin
+                modifier = getFlapModifier(obj)
+                if modifier is not None:
+                    modifier["Input_8"] = 0.
+        
+        # compute frames: angle for every split flap
+        # the kept keyframes match the stored fingerprints unless the file was reloaded or changed in between
+        if incremental and applied is not None and applied[0] == applySettings and np.array_equal(applied[4], fingerprints):
+            lastEntries, lastPlan, lastKeys = applied[1:4]
+            first = firstChange(timeline.entries, lastEntries)
+            plan = replanFrames(lastPlan, first, cellCount, timeline.characters, timeline.flapTime, fps, timeline.keyTimes, timeline.states())
+            # no transition of the changed time keys starts before the earlier of their old and new first time key
+            fromFrame = min([int(np.rint(fps * entries[first][0])) for entries in (lastEntries, timeline.entries) if first < len(entries)], default=None)
+            if fromFrame is None:
+                keys, changes = lastKeys, []
+            else:
+                keys, changes = updateKeyframes(lastKeys, plan, cellCount, fromFrame, compact=self.compact)
+            keyCount = None
+        else:
+            plan = planFrames(cellCount, timeline.characters, timeline.flapTime, fps, timeline.keyTimes, timeline.states())
+            keys = sortedKeyframes(plan)
+            keyCount = len(keys[0])
+            if self.compact:
+                keys = compactKeyframes(*keys)
+            if incremental:
+                # only the cells whose keyframes differ from the last apply according to the fingerprints are rewritten
+                bounds = np.searchsorted(keys[0], np.arange(cellCount + 1))
+                changes = [(int(cell), 0, 0, keys[1][bounds[cell]:bounds[cell + 1]], keys[2][bounds[cell]:bounds[cell + 1]])
+                           for cell in np.flatnonzero(keyFingerprints(keys, cellCount) != fingerprints)]
+            else:
+                changes = [(cell, 0, 0, frames, values) for cell, frames, values in splitKeyframes(*keys)]
+        
+        # instanced boards evaluate the plan when the frame changes or sample the baked angle track
+        boardObjects = getBoardObjects(coll)
+        for boardObj in boardObjects:
+            setBoardPlan(boardObj, plan)
+            if self.output == 'ANGLE_TRACK':
+                frameCount = max(int(plan.endFrames.max()) + 1 if len(plan.endFrames) > 0 else 1, context.scene.frame_end + 1)
+                if setBoardAngleTrack(boardObj, plan, frameCount) is None:
+                    self.report({'INFO'}, "The angle track of %s would exceed the maximum image size, keep evaluating the plan on frame change." % boardObj.name)
+            else:
+                clearBoardAngleTrack(boardObj)
+        if self.output == 'ANGLE_TRACK' and len(boardObjects) == 0:
+            self.report({'INFO'}, "Angle tracks are only available for instanced boards, keyframes are used for %s instead." % coll.name)
+        
+        # write the keyframes, one F-curve per split flap item
+        # compaction drops the keyframes linear interpolation reproduces, the F-curves hold the compacted keys
+        changedCount = 0
+        for cell, first, oldCount, frames, values in changes:
+            if cell >= len(flapItems):
+                continue
+            modifier = getFlapModifier(flapItems[cell])
+            if modifier is None:
+                continue
+            # keep the keyframes before the first difference if the F-curve still has the keys of the last apply
+            fcurve = getFlapFCurve(flapItems[cell])
+            if fcurve is None or len(fcurve.keyframe_points) != oldCount:
+                first = 0
+            elif self.compact and first > 0:
+                first -= 1 # the interpolation of the last kept key depends on the following key
+            modifier["Input_8"] = float(values[-1]) if len(values) > 0 else 0.
+            writeFlapKeyframes(flapItems[cell], frames[first:], values[first:], interpolation=interpolation, handleType=handleType, start=first,
+                               holdConstant=self.compact)
+            changedCount += 1
+        fingerprints = keyFingerprints(keys, cellCount)
+        storeFingerprints(coll, fingerprints)
+        _applied[coll.name] = (applySettings, list(timeline.entries), plan, keys, fingerprints)
+        setLODPlan(coll, plan)
+        coll["SplitFlapApplied.settings"] = applySettings
+        coll["SplitFlapApplied.fps"] = fps
+        coll["SplitFlapApplied.lastFrame"] = int(plan.endFrames.max()) if len(plan.endFrames) > 0 else 0
+        if self.compact and keyCount is not None and len(flapItems) > 0:
+            self.report({'INFO'}, "%s: %d keyframes after compaction instead of %d." % (coll.name, len(keys[0]), keyCount))
+        return changedCount, incremental
+
+
+class SplitFlapRetimeTimeline(bpy.types.Operator):
+    bl_idname = "object.splitflapretimetimeline"
+    bl_label = "Retime Split Flap Timeline"
+    bl_description = "Move the time keys of the current collection such that every switch can be completed in time"
+    mode: bpy.props.EnumProperty(
+        items=[
+            ('RESOLVE', 'retime', 'Only move entries which cannot be reached in time to their earliest feasible time'),
+            ('COMPACT', 'compact', 'Move all entries to their earliest feasible time')
+        ],
+        default='RESOLVE'
+    )
+    hold: bpy.props.FloatProperty(
+        name="Hold time",
+        description="Additional time in seconds every moved text stays on display",
+        default=0.,
+        min=0.
+    )
+    
+    def execute(self, context):
+        collID = context.scene.splitFlapKeySetting.collectionID
+        if collID not in bpy.data.collections:
+            self.report({'INFO'}, "Please choose a collection of split flap items to animate!")
+            return {'CANCELLED'}
+        timeline = getCollectionTimeline(context.scene, bpy.data.collections[collID])
+        items = context.scene.splitFlapAnimations.items
+        fps = context.scene.render.fps / context.scene.render.fps_base
+        movedCount = 0
+        for source, keyTime in zip(timeline.sources, timeline.retime(compact=self.mode == 'COMPACT', hold=self.hold, fps=fps)):
+            if abs(items[source].keyTime - keyTime) > 1e-6:
+                items[source].keyTime = keyTime
+                movedCount += 1
+        self.report({'INFO'}, "Moved %d of %d entries." % (movedCount, len(timeline.entries)))
+        return {'FINISHED'}
+
+
+class SplitFlapEditTimeline(bpy.types.Operator):
+    bl_idname = "object.splitflapedittimeline"
+    bl_label = "Edit Split Flap Timeline"
+    bl_description = "Shift or remove all entries of the current collection in a time range at once"
+    action: bpy.props.EnumProperty(
+        items=[
+            ('SHIFT', 'shift', 'Move the entries in the time range by the offset'),
+            ('REMOVE', 'remove', 'Remove the entries in the time range')
+        ],
+        default='SHIFT'
+    )
+    start: bpy.props.FloatProperty(
+        name="Start",
+        description="Start of the time range in seconds",
+        default=0.,
+        min=0.
+    )
+    end: bpy.props.FloatProperty(
+        name="End",
+        description="End of the time range in seconds (excluded), 0 for all entries from the start on",
+        default=0.,
+        min=0.
+    )
+    offset: bpy.props.FloatProperty(
+        name="Offset",
+        description="Time in seconds to move the entries by",
+        default=1.
+    )
+    strict: bpy.props.BoolProperty(
+        name="Keep feasible",
+        description="Cancel the change if an entry could not be reached in time afterwards",
+        default=True
+    )
+    
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+    
+    def execute(self, context):
+        collID = context.scene.splitFlapKeySetting.collectionID
+        if collID not in bpy.data.collections:
+            self.report({'INFO'}, "Please choose a collection of split flap items to animate!")
+            return {'CANCELLED'}
+        edit = TimelineEdit(context.scene, strict=self.strict)
+        end = self.end if self.end > self.start else None
+        try:
+            if self.action == 'SHIFT':
+                count = edit.shift(collID, self.offset, start=self.start, end=end)
+            else:
+                count = edit.removeRange(collID, start=self.start, end=end)
+            conflicts = edit.commit()
+        except TimelineEditError as e:
+            self.report({'ERROR'}, "The timeline has not been changed: %s." % e)
+            return {'CANCELLED'}
+        conflictCount = sum(len(collConflicts) for collConflicts in conflicts.values())
+        self.report({'INFO'}, "%s %d entries%s." % ("Shifted" if self.action == 'SHIFT' else "Removed", count,
+                                                    ", %d of them cannot be reached in time" % conflictCount if conflictCount > 0 else ""))
+        return {'FINISHED'}
+
+
+class SplitFlapBoardDetail(bpy.types.Operator):
+    bl_idname = "object.splitflapboarddetail"
+    bl_label = "Split Flap Board Detail"
+    bl_description = "Replace the drums of the current collection by a flat plane per split flap item showing the current character"
+    detail: bpy.props.EnumProperty(
+        items=[
+            ('FULL', 'drums', 'Always show the split flap drums'),
+            ('FLAT', 'planes', 'Always show the flat planes'),
+            ('AUTO', 'by camera distance', 'Show the flat planes if the board is farther from the scene camera than the distance')
+        ],
+        default='AUTO'
+    )
+    distance: bpy.props.FloatProperty(
+        name="Distance",
+        description="Camera distance from which the flat planes are shown",
+        default=DEFAULT_DISTANCE,
+        min=0.,
+        subtype='DISTANCE'
+    )
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        collID = context.scene.splitFlapKeySetting.collectionID
+        if collID not in bpy.data.collections:
+            self.report({'INFO'}, "Please choose a collection of split flap items to animate!")
+            return {'CANCELLED'}
+        coll = bpy.data.collections[collID]
+        lodObj = getLODObject(coll)
+        if lodObj is None and self.detail != 'FULL':
+            lodObj = createBoardLOD(coll, SplitFlapController.materialName, SplitFlapController.uvAttribute)
+            if lodObj is None:
+                self.report({'ERROR'}, "%s has no split flap items to replace." % collID)
+                return {'CANCELLED'}
+        coll["SplitFlapSettings.detail"] = self.detail
+        coll["SplitFlapSettings.detailDistance"] = self.distance
+        if lodObj is not None:
+            updateLODObject(context.scene, lodObj, context.scene.frame_current + context.scene.frame_subframe)
+        self.report({'INFO'}, "%s shows %s." % (collID, "flat planes" if lodObj is not None and not lodObj.hide_render else "drums"))
+        return {'FINISHED'}
+
+
+class SplitFlapPreviewTimeline(bpy.types.Operator):
+    bl_idname = "object.splitflappreviewtimeline"
+    bl_label = "Preview Split Flap Timeline"
+    bl_description = "Render the characters the current collection shows into images from the character texture without evaluating the scene"
+    mode: bpy.props.EnumProperty(
+        items=[
+            ('FRAME', 'current frame', 'Render the current frame into the image SplitFlapPreview'),
+            ('SEQUENCE', 'image sequence', 'Render an image sequence of the time range into the output directory')
+        ],
+        default='FRAME'
+    )
+    start: bpy.props.FloatProperty(
+        name="Start",
+        description="Start of the image sequence in seconds",
+        default=0.,
+        min=0.
+    )
+    end: bpy.props.FloatProperty(
+        name="End",
+        description="End of the image sequence in seconds, 0 for the end of the last switch",
+        default=0.,
+        min=0.
+    )
+    step: bpy.props.FloatProperty(
+        name="Step",
+        description="Time in seconds between two images of the sequence, 0 for one image per frame",
+        default=0.,
+        min=0.
+    )
+    tileHeight: bpy.props.IntProperty(
+        name="Character height",
+        description="Height of a character in pixels",
+        default=40,
+        min=4
+    )
+    outputDir: bpy.props.StringProperty(
+        name="Output",
+        description="Directory of the image sequence",
+        default="//preview/",
+        subtype='DIR_PATH'
+    )
+
+    def invoke(self, context, event):
+        if self.mode == 'FRAME':
+            return self.execute(context)
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        collID = context.scene.splitFlapKeySetting.collectionID
+        if collID not in bpy.data.collections:
+            self.report({'INFO'}, "Please choose a collection of split flap items to animate!")
+            return {'CANCELLED'}
+        coll = bpy.data.collections[collID]
+        atlasPath = bpy.path.abspath("//%s" % coll.get("SplitFlapSettings.texture", ""))
+        if "SplitFlapSettings.texture" not in coll or not os.path.exists(atlasPath):
+            self.report({'ERROR'}, "The character texture of %s cannot be found." % collID)
+            return {'CANCELLED'}
+        try:
+            import PIL
+        except ImportError:
+            self.report({'ERROR'}, "Please install the python module pillow in your Blender python beforehand.")
+            return {'CANCELLED'}
+        from .preview import renderPreview, previewTimes
+        scene = context.scene
+        fps = scene.render.fps / scene.render.fps_base
+        timeline = getCollectionTimeline(scene, coll)
+        atlasColumns, atlasRows = atlasShape(coll)
+        startTime = time.perf_counter()
+        if self.mode == 'FRAME':
+            output = bpy.path.abspath("//SplitFlapPreview_%s.png" % collID)
+            renderPreview(timeline, [(scene.frame_current + scene.frame_subframe) / fps], fps, atlasPath, atlasColumns, atlasRows,
+                          coll["SplitFlapSettings.colCount"], output, tileHeight=self.tileHeight)
+            image = findImage(output)
+            if image is None:
+                image = bpy.data.images.load(output, check_existing=True)
+                image.name = "SplitFlapPreview"
+            else:
+                image.reload()
+            self.report({'INFO'}, "Rendered the preview of %s at frame %d into the image %s." % (collID, scene.frame_current, image.name))
+            return {'FINISHED'}
+        end = self.end
+        if end <= self.start and len(timeline.entries) > 0:
+            # until the end of the last switch
+            end = timeline.keyTimes[-1] + timeline.neededTime(len(timeline.entries) - 1)
+        times = previewTimes(self.start, end, self.step if self.step > 0 else 1. / fps)
+        paths = renderPreview(timeline, times, fps, atlasPath, atlasColumns, atlasRows, coll["SplitFlapSettings.colCount"],
+                              os.path.join(bpy.path.abspath(self.outputDir), "%s_%%05d.png" % collID), tileHeight=self.tileHeight)
+        self.report({'INFO'}, "Rendered %d preview images of %s in %.2f s." % (len(paths), collID, time.perf_counter() - startTime))
+        return {'FINISHED'}
+
+
+class SplitFlapOptimizeCharacters(bpy.types.Operator):
+    bl_idname = "object.splitflapoptimizecharacters"
+    bl_label = "Optimize Split Flap Characters"
+    bl_description = "Reorder the drum characters for the timeline of the current collection such that fewer flaps are needed, the order is used for the next board"
+    objective: bpy.props.EnumProperty(
+        items=[
+            ('TOTAL', 'total flaps', 'Minimize the number of flaps of all cells'),
+            ('SWITCH', 'switch time', 'Minimize the time the slowest cell needs for every switch')
+        ],
+        default='TOTAL'
+    )
+
+    def execute(self, context):
+        collID = context.scene.splitFlapKeySetting.collectionID
+        if collID not in bpy.data.collections:
+            self.report({'INFO'}, "Please choose a collection of split flap items to animate!")
+            return {'CANCELLED'}
+        coll = bpy.data.collections[collID]
+        timeline = getCollectionTimeline(context.scene, coll)
+        if len(timeline.entries) == 0:
+            self.report({'INFO'}, "The timeline of %s is empty." % collID)
+            return {'CANCELLED'}
+        try:
+            characters, before, after = optimizeDrumOrder(timeline.states(), timeline.characters, timeline.cellCount,
+                                                          objective=self.objective, skipFirst=timeline.keyTimes[0] < 0.01)
+        except ValueError as e:
+            self.report({'ERROR'}, "The characters cannot be reordered: %s." % e)
+            return {'CANCELLED'}
+        context.scene.splitFlapTool.characters = characters
+        if self.objective == 'SWITCH':
+            flapTime = timeline.flapTime
+            self.report({'INFO'}, "Character order for the next board: %.2f s instead of %.2f s switch time." % (after * flapTime, before * flapTime))
+        else:
+            self.report({'INFO'}, "Character order for the next board: %d instead of %d flaps." % (after, before))
+        return {'FINISHED'}
+
+
+class SplitFlapImportSchedule(bpy.types.Operator, ImportHelper):
+    bl_idname = "object.splitflapimportschedule"
+    bl_label = "Import Split Flap Schedule"
+    bl_description = "Add the entries of a CSV/JSON schedule (time, text, collection, extend, center) to the animation list"
+    filename_ext = ".csv"
+    filter_glob: bpy.props.StringProperty(default="*.csv;*.json;*.jsonl;*.ndjson", options={'HIDDEN'})
+    replace: bpy.props.BoolProperty(
+        name="Replace entries",
+        description="Remove the existing entries of the collections in the schedule before importing",
+        default=False
+    )
+    extend: bpy.props.BoolProperty(
+        name="Fill with space",
+        description="Default for rows without extend column",
+        default=True
+    )
+    center: bpy.props.BoolProperty(
+        name="Center text",
+        description="Default for rows without center column",
+        default=False
+    )
+    
+    def execute(self, context):
+        startTime = time.perf_counter()
+        try:
+            rowCount, conflicts = importSchedule(context.scene, self.filepath, defaultCollection=context.scene.splitFlapKeySetting.collectionID,
+                                                 replace=self.replace, extend=self.extend, center=self.center)
+        except (OSError, ScheduleError) as e:
+            self.report({'ERROR'}, "The schedule could not be imported, nothing has been changed: %s" % e)
+            return {'CANCELLED'}
+        conflictCount = sum(len(collConflicts) for collConflicts in conflicts.values())
+        if conflictCount > 0:
+            report = writeConflictReport(context.scene, conflicts)
+            self.report({'INFO'}, "Imported %d entries with %d conflicts, see the text data block %s." % (rowCount, conflictCount, report.name))
+        else:
+            self.report({'INFO'}, "Imported %d entries in %.2f s without conflicts." % (rowCount, time.perf_counter() - startTime))
         return {'FINISHED'}
 
 
@@ -393,22 +706,19 @@ class SplitFlapController(bpy.types.Operator):
     collectionMarker = "SplitFlap"
     uvAttribute = "MyUVMap"
     charSpace = (120,200)
+    parallelCharCount = 256 # rasterize the characters in parallel from this character count on
     
     def execute(self, context):
         # find directory to save the font to
         if not bpy.data.is_saved:
             self.report({'ERROR'}, "Please save the blend file first to indicate the texture storage directory.")
             return {'FINISHED'}
-        # look for template file if still undefined
-        if len(self.templatePath) == 0:
-            for mod in addon_utils.modules():
-                if mod.bl_info.get("name") == "Split Flap Table Generator":
-                    self.templatePath = os.path.join(os.path.dirname(mod.__file__), self.templateFile)
-                    break
+        # the template file is shipped with the addon
         if len(self.templatePath) == 0:
-            self.report({'INFO'}, "Cannot find the template blend file %." % self.templateFile)
-            return
-        oldObjectNames = [obj.name for obj in context.scene.objects]
+            self.templatePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.templateFile)
+        if not os.path.exists(self.templatePath):
+            self.report({'ERROR'}, "Cannot find the template blend file %s." % self.templatePath)
+            return {'CANCELLED'}
         templateFlapItem = None if len(context.scene.splitFlapTemplate) == 0 or context.scene.splitFlapTemplate not in bpy.data.objects else bpy.data.objects[context.scene.splitFlapTemplate]
         cardTemplate = None if len(context.scene.cardTemplate) == 0 or context.scene.cardTemplate not in bpy.data.objects else bpy.data.objects[context.scene.cardTemplate]
         if templateFlapItem is None or cardTemplate is None:
@@ -416,55 +726,67 @@ class SplitFlapController(bpy.types.Operator):
                 if (material.name.startswith(self.materialName) or material.name.startswith(self.frameMaterialName)) and not material.users:
                     print("Remove unused material %s" % material.name)
                     bpy.data.materials.remove(material)
-            bpy.ops.wm.append(
-                filepath=os.path.join(self.templatePath, self.innerPath, self.itemName),
-                directory=os.path.join(self.templatePath, self.innerPath),
-                filename=self.itemName
-            )
-            bpy.context.view_layer.update()
-            
-            # import material too
-            with bpy.data.libraries.load(self.templatePath) as (dataFrom, dataTo):
-                dataTo.materials = dataFrom.materials
-            # pass the current SplitFlapProperties to Geometry Nodes input where necessary
-            newObjectNames = [obj.name for obj in context.scene.objects if obj.name not in oldObjectNames and obj.name.startswith(self.itemName)]
-            newCardNames = [obj.name for obj in context.scene.objects if obj.name not in oldObjectNames and obj.name.startswith(self.cardName)]
-            
-            if len(newObjectNames) > 0 and len(newCardNames) > 0:
-                context.scene.splitFlapTemplate = newObjectNames[0]
-                context.scene.cardTemplate = newCardNames[0]
-                templateFlapItem = bpy.data.objects[context.scene.splitFlapTemplate]
-                cardTemplate = bpy.data.objects[context.scene.cardTemplate]
-                print("imported cardTemplate object name: '%s'" % newCardNames[0])
-            else:
+            # only the objects and materials in use are loaded (with the meshes and node groups they depend on)
+            templateData = loadTemplateData(self.templatePath, {"objects" : (self.itemName, self.cardName), "materials" : (self.materialName, self.frameMaterialName)})
+            templateFlapItem = templateData["objects"].get(self.itemName)
+            cardTemplate = templateData["objects"].get(self.cardName)
+            if templateFlapItem is None or cardTemplate is None:
                 self.report({'ERROR'}, "The import of the flap item template failed.")
                 return {'FINISHED'}
+            # keep the templates in the scene like an appended object such that they are saved with the file
+            for obj in (templateFlapItem, cardTemplate):
+                if obj.name not in context.scene.collection.objects:
+                    context.scene.collection.objects.link(obj)
+            context.scene.splitFlapTemplate = templateFlapItem.name
+            context.scene.cardTemplate = cardTemplate.name
+            print("imported cardTemplate object name: '%s'" % cardTemplate.name)
         
         sfTool = context.scene.splitFlapTool
-        # generate texture
+        # generate texture, pillow and the texture module are only loaded on the first use
+        try:
+            import PIL
+        except ImportError:
+            self.report({'ERROR'}, "Please install the python module pillow in your Blender python beforehand.")
+            return {'CANCELLED'}
+        from .texture import createCharactersTexture, atlasLayout, findFont, getTextureKey, TextureCache
         fontPath = findFont(sfTool.fontName)
-        texturePath = None
-        textureFile = "FlapCharacters%d.png"
         
         if fontPath is None:
             self.report({'ERROR'}, "The font %s could not be found or cannot be used as a TrueType font." % sfTool.fontName)
             return {'FINISHED'}
         
-        # generate texture
-        textureIndex = 0
-        while os.path.exists(os.path.join(bpy.path.abspath("//"), textureFile % textureIndex)):
-            textureIndex += 1
-        textureFile = textureFile % textureIndex
-        texturePath = os.path.join(bpy.path.abspath("//"), textureFile)
+        # generate texture or take it from the cache if all inputs are the same
         fontColor = [min(255, int(255*round(value))) for value in [sfTool.fontColor.r, sfTool.fontColor.g, sfTool.fontColor.b]]
         fontColor.append(255)
         backgroundColor = [min(255, int(255*round(value))) for value in [sfTool.backgroundColor.r, sfTool.backgroundColor.g, sfTool.backgroundColor.b]]
         backgroundColor.append(255)
-        charsPerRow = math.ceil(math.sqrt(len(sfTool.characters)))
         defaultTextureRatio = self.charSpace[0] / self.charSpace[1]
-        createCharactersTexture(charSpace=(self.charSpace[0], int(self.charSpace[1] * defaultTextureRatio / sfTool.flapRatio)), characters=sfTool.characters, 
-                                fontPath=fontPath, output=texturePath, color=tuple(fontColor), background=tuple(backgroundColor),
-                                fontFactorWidth=sfTool.charWidth, fontFactorHeight=sfTool.charHeight, itemsPerSide=charsPerRow)
+        charSpace = (self.charSpace[0], int(self.charSpace[1] * defaultTextureRatio / sfTool.flapRatio))
+        atlasColumns, atlasRows, atlasSize = atlasLayout(len(sfTool.characters), charSpace, powerOfTwo=sfTool.atlasLayout == 'POWER_OF_TWO')
+        maskAtlas = sfTool.atlasFormat == 'MASK'
+        textureInputs = {"charSpace" : charSpace, "characters" : sfTool.characters, "fontPath" : fontPath,
+                         "fontFactorWidth" : sfTool.charWidth, "fontFactorHeight" : sfTool.charHeight, "layout" : (atlasColumns, atlasRows, atlasSize)}
+        # the mask atlas does not depend on the colours and is shared by all colour variants
+        if maskAtlas:
+            textureInputs["mask"] = True
+        else:
+            textureInputs.update({"color" : tuple(fontColor), "background" : tuple(backgroundColor)})
+        textureCache = TextureCache(bpy.path.abspath("//"), owner=os.path.basename(bpy.data.filepath) or None)
+        textureKey = getTextureKey(textureInputs)
+        textureFile = textureCache.fileName(textureKey)
+        texturePath = textureCache.lookup(textureKey)
+        textureImage = findImage(textureCache.path(textureKey))
+        if texturePath is None:
+            texturePath = textureCache.path(textureKey)
+            createCharactersTexture(output=texturePath, workers=os.cpu_count() if len(sfTool.characters) >= self.parallelCharCount else 0, **textureInputs)
+            textureCache.store(textureKey)
+            if textureImage is not None: # file has been evicted and generated again
+                textureImage.reload()
+        if textureImage is None:
+            textureImage = bpy.data.images.load("//%s" % textureFile, check_existing=True)
+        if maskAtlas:
+            textureImage.colorspace_settings.name = 'Non-Color'
+        textureCache.evict(inUse={os.path.basename(bpy.path.abspath(image.filepath)) for image in bpy.data.images if image.users > 0 or image == textureImage})
         splitFlapItems = []
         prefix = '' if " " in sfTool.identPrefix else sfTool.identPrefix
         newCard = duplicateObject(cardTemplate)
@@ -472,10 +794,12 @@ class SplitFlapController(bpy.types.Operator):
         cardTemplate.hide_viewport = True
         cardTemplate.hide_render = True
         newMat = None
-        oldMat = bpy.data.materials.get(self.materialName)
+        oldMat = getTemplateMaterial(self.templatePath, self.materialName)
         if oldMat is not None:
             newMat = oldMat.copy()
-            newMat.node_tree.nodes["Image Texture"].image = bpy.data.images.load("//%s" % textureFile)
+            newMat.node_tree.nodes["Image Texture"].image = textureImage
+            if maskAtlas:
+                setMaskColors(newMat, tuple(sfTool.fontColor) + (1.,), tuple(sfTool.backgroundColor) + (1.,))
             for slot in newCard.material_slots:
                 if slot.material.name.startswith(self.materialName):
                     print("replace material %s with new one in card" % slot.material.name)
@@ -496,15 +820,15 @@ class SplitFlapController(bpy.types.Operator):
             if modifier.type == 'NODES' and modifier.name == "SplitFlapCircle":
                 modifier["Input_3"] = sfTool.flapRadius
                 modifier["Input_4"] = sfTool.characters
-                modifier["Input_5"] = charsPerRow
-                modifier["Input_7"] = charsPerRow
+                modifier["Input_5"] = atlasColumns
+                modifier["Input_7"] = atlasRows
                 modifier["Input_8"] = 0.
                 modifier["Input_9"] = newCard
                 modifier["Output_6_attribute_name"] = self.uvAttribute
                 # rename object according to the wanted prefix
                 newObj.name = "%sItem0" % prefix
         #unlink original
-        otherCollections = [collection.name for collection in newObj.users_collection if collection.name != collName]
+        otherCollections = [collection.name for collection in newObj.users_collection]
         for otherCollName in otherCollections:
             if otherCollName == "Scene Collection":
                 bpy.context.scene.collection.objects.unlink(newObj) 
@@ -525,6 +849,11 @@ class SplitFlapController(bpy.types.Operator):
         collection["SplitFlapSettings.characters"] = sfTool.characters
         collection["SplitFlapSettings.rowCount"] = sfTool.rowCount
         collection["SplitFlapSettings.colCount"] = sfTool.colCount
+        collection["SplitFlapSettings.texture"] = textureFile
+        collection["SplitFlapSettings.atlasColumns"] = atlasColumns
+        collection["SplitFlapSettings.atlasRows"] = atlasRows
+        collection["SplitFlapSettings.atlasMask"] = maskAtlas
+        collection["SplitFlapSettings.boardMode"] = sfTool.boardMode
         collection["SplitFlap"] = self.collectionMarker
         bpy.context.scene.collection.children.link(collection)
         newCard.name = "%sCard%d" % (sfTool.identPrefix, collIndex)
@@ -537,88 +866,49 @@ class SplitFlapController(bpy.types.Operator):
         newCard.hide_viewport = True
         
         # make the wanted number of copies and add them to the same collection
-        # get width and height of the split flap item
+        # get width and height of the split flap item once, all cell positions are derived from it
         splitFlapItems[0].name = "%sItem%d.%d" % (sfTool.identPrefix, collIndex, 0)
-        d = 1
         collection.objects.link(splitFlapItems[0])
         bpy.context.view_layer.update()
-        width = splitFlapItems[0].dimensions.x
-        height = splitFlapItems[0].dimensions.z
-        print("splitFlapItem height %.2f" % height)
-        bounds = []
-        bounds.append(splitFlapItems[0].bound_box)
-        
-        for v in range(0, sfTool.rowCount):
-            for h in range(0, sfTool.colCount):
-                if h == 0 and v == 0:
-                    
-                    continue
-                objCopy = duplicateObject(splitFlapItems[0])
-                objCopy.name = "%sItem%d.%d" % (sfTool.identPrefix, collIndex, d)
-                objCopy.location.x = splitFlapItems[0].location.x + h*(width + sfTool.horizontalGap)
-                objCopy.location.z = splitFlapItems[0].location.z - v*(height + sfTool.verticalGap)
-                splitFlapItems.append(objCopy)
-                #print("split flap copy h=%d v=%d x0=%.2f z0=%.2f x=%.2f z=%.2f height=%.2f" % (h, v, splitFlapItems[0].location.x, splitFlapItems[0].location.z, objCopy.location.x, objCopy.location.z, height))
-                d += 1
+        templateCenter = getBoundingBoxCenter(splitFlapItems[0])
+        templateDimensions = splitFlapItems[0].dimensions.copy()
+        width = templateDimensions.x
+        height = templateDimensions.z
+        collection["SplitFlapSettings.cellWidth"] = width
+        collection["SplitFlapSettings.cellHeight"] = height
+        offsets = cellOffsets(sfTool.rowCount, sfTool.colCount, width + sfTool.horizontalGap, height + sfTool.verticalGap)
         
-        for splitFlapItem in splitFlapItems[1:]:
-            bounds.append(splitFlapItem.bound_box)
-            collection.objects.link(splitFlapItem)
+        startTime = time.perf_counter()
+        if sfTool.boardMode == 'INSTANCES':
+            # a single board object instancing the split flap item as drum on every cell
+            drum = splitFlapItems[0]
+            del drum["SplitFlapItem"]
+            drum["SplitFlapDrum"] = True
+            drum.hide_viewport = True
+            drum.hide_render = True
+            boardObj = createBoardObject("%sBoard%d" % (sfTool.identPrefix, collIndex), collection, drum, offsets)
+            boardObj.location = drum.location
+        else:
+            splitFlapItems.extend(buildCells(context, splitFlapItems[0], collection, offsets[1:], "%sItem%d.%%d" % (sfTool.identPrefix, collIndex)))
+        buildTime = time.perf_counter() - startTime
+        cellCount = sfTool.rowCount * sfTool.colCount
+        self.report({'INFO'}, "Built %d split flap items in %.2f s (%.3f s per 1000 items)." % (cellCount, buildTime, 1000 * buildTime / cellCount))
         
-        # optionally create the frame mesh / cut out holes for the flap items
+        # optionally create the frame mesh with one pocket per split flap item
         if sfTool.createFrame:
-            bpy.context.view_layer.update()
-            locBegin = getBoundingBoxCenter(splitFlapItems[0])
-            locEnd = getBoundingBoxCenter(splitFlapItems[-1])
-            dimensions = splitFlapItems[0].dimensions
-            add = (0.1, 0.05, 0.1)
-            factor = 0.5
-            xMin = locBegin.x - (factor + add[0]) * dimensions.x 
-            xMax = locEnd.x + (factor + add[0]) * dimensions.x
-            yMin = locBegin.y - (factor + add[1]) * dimensions.y
-            yMax = locEnd.y + (factor + add[1]) * dimensions.y
-            zMin = locEnd.z - (factor + add[2]) * dimensions.z 
-            zMax = locBegin.z + (factor + add[2]) * dimensions.z
-            #print("X %.2f - %.2f\nY  %.2f - %.2f\nZ %.2f - %.2f" % (xMin, xMax, yMin, yMax, zMin, zMax))
-            frameSize = (0.5 * abs(xMax-xMin), 0.5 * abs(yMax-yMin), 0.5 * abs(zMax-zMin))
-            frameCenter = (0.5 * (xMin + xMax), 0.5 * (yMin + yMax), 0.5 * (zMin + zMax))
-            bpy.ops.mesh.primitive_cube_add(location=frameCenter, scale=frameSize)
-            frameObj = context.object
-            
-            # add cutters for the split flap items
-            tempSelectedObj = bpy.context.view_layer.objects.active
-            bpy.ops.object.select_all(action='DESELECT')
-            cutters = []
-            for splitFlapItem in splitFlapItems:
-                loc = getBoundingBoxCenter(splitFlapItem)
-                dim = splitFlapItem.dimensions
-                loc.y -= 0.15*dim.y
-                scaled = (dim.x*1.03*0.5, dim.y*1.1*0.5, dim.z*1.02*0.5)
-                bpy.ops.mesh.primitive_cube_add(location=loc, scale=scaled)
-                cutterObj = context.object
-                cutters.append(cutterObj)
-            # join cutter objects
-            with bpy.context.temp_override(active_object=cutters[0], selected_editable_objects=cutters):
-                bpy.ops.object.join()
-            boolObj = cutters[0]
-            boolModifier = frameObj.modifiers.new(type="BOOLEAN", name="cutFrame")
-            boolModifier.object = boolObj
-            boolModifier.operation = 'DIFFERENCE'
-            bpy.context.view_layer.objects.active = frameObj
-            bpy.ops.object.modifier_apply(modifier="cutFrame")
-            bpy.ops.object.select_all(action='DESELECT')
-            boolObj.select_set(True)
-            bpy.ops.object.delete()
-            frameObj.name = "%s_frame" % collName
-            moveToCollection(frameObj, collection)
+            centers = np.asarray(offsets) + np.asarray(templateCenter)
+            vertices, faces, frameCenter = frameGeometry(centers, sfTool.rowCount, sfTool.colCount, templateDimensions)
+            frameMesh = bpy.data.meshes.new("%s_frame" % collName)
+            frameMesh.from_pydata(vertices.tolist(), [], faces)
+            frameMesh.update()
+            frameObj = bpy.data.objects.new("%s_frame" % collName, frameMesh)
+            collection.objects.link(frameObj)
+            frameObj.location = frameCenter
             # apply material
-            frameMat = bpy.data.materials.get("BlackMetal")
+            frameMat = getTemplateMaterial(self.templatePath, self.frameMaterialName)
             if frameMat is not None:
-                if frameObj.data.materials:
-                    frameObj.data.materials[0] = frameMat
-                else:
-                    frameObj.data.materials.append(frameMat)
-            parent(context, splitFlapItems, frameObj)
+                frameMesh.materials.append(frameMat)
+            parent([boardObj] if sfTool.boardMode == 'INSTANCES' else splitFlapItems, frameObj)
             frameObj.location = context.scene.cursor.location # move frame to cursor
             
         # choose as default split flap items if there is no other selected
@@ -627,25 +917,267 @@ class SplitFlapController(bpy.types.Operator):
             sfKeySetting.collection = collection
         return {'FINISHED'}
 
-def parent(context, childrenList, parentObj):
-    if len(bpy.context.selected_objects) > 0:
-        bpy.ops.object.select_all(action="DESELECT")
+_templateData = {} # template file -> data type -> datablocks loaded from it in this session by name
+
+def loadTemplateData(templatePath, names):
+    # append only the named datablocks (names: data type -> names) from the template file in a single pass,
+    # the datablocks of an earlier call are reused as long as none of them has been removed
+    loaded = _templateData.get(templatePath)
+    if loaded is None or not all(isValidID(loaded.get(dataType, {}).get(name)) for dataType in names for name in names[dataType]):
+        with bpy.data.libraries.load(templatePath, link=False) as (dataFrom, dataTo):
+            requested = {dataType : [name for name in names[dataType] if name in getattr(dataFrom, dataType)] for dataType in names}
+            for dataType in names:
+                setattr(dataTo, dataType, requested[dataType])
+        loaded = {dataType : {name : block for name, block in zip(requested[dataType], getattr(dataTo, dataType)) if block is not None} for dataType in names}
+        _templateData[templatePath] = loaded
+    return loaded
+
+def getTemplateMaterial(templatePath, name):
+    # material loaded from the template in this session, otherwise the one of the blend file with the same name
+    material = _templateData.get(templatePath, {}).get("materials", {}).get(name)
+    return material if isValidID(material) else bpy.data.materials.get(name)
+
+def isValidID(block):
+    # the Python object of a removed datablock raises ReferenceError on access
+    if block is None:
+        return False
+    try:
+        block.name
+    except ReferenceError:
+        return False
+    return True
+
+def parent(childrenList, parentObj):
+    # parent keeping the world transform of the children, the parent itself must not have a parent
+    parentInverse = parentObj.matrix_basis.inverted()
     for child in childrenList:
-        child.select_set(True)
-    parentObj.select_set(True)
-    bpy.ops.object.parent_set(type='OBJECT', keep_transform=True)
-    bpy.ops.object.select_all(action="DESELECT")
+        child.parent = parentObj
+        child.matrix_parent_inverse = parentInverse
+
+def getCollectionTimeline(scene, collection, items=None):
+    # sync the cached timeline engine of the collection with the entries of the UI list
+    # items: the (list index, entry) pairs of the collection if already known (see groupAnimationItems)
+    cellCount = collection["SplitFlapSettings.rowCount"] * collection["SplitFlapSettings.colCount"]
+    timeline = getTimeline(collection.name, cellCount, collection["SplitFlapSettings.characters"], collection["SplitFlapSettings.flapTime"])
+    if items is None:
+        items = [(i, item) for i, item in enumerate(scene.splitFlapAnimations.items) if item.collectionID == collection.name]
+    items = sorted(items, key=lambda entry:entry[1].keyTime)
+    timeline.sync([(item.keyTime, item.formattedText, item.extend, item.center) for i, item in items], sources=[i for i, item in items])
+    return timeline
+
+def getAppliedPlan(scene, collection):
+    # plan of the last apply, planned again from the animation list after loading the file (only fingerprints are stored)
+    fingerprints = loadFingerprints(collection)
+    if fingerprints is None or "SplitFlapApplied.fps" not in collection:
+        return None
+    applied = _applied.get(collection.name)
+    if applied is not None and np.array_equal(applied[4], fingerprints):
+        return applied[2]
+    timeline = getCollectionTimeline(scene, collection)
+    return planFrames(timeline.cellCount, timeline.characters, timeline.flapTime, collection["SplitFlapApplied.fps"], timeline.keyTimes, timeline.states())
+
+def groupAnimationItems(scene):
+    # collection name -> (list index, entry) pairs of the animation list
+    groups = {}
+    for i, item in enumerate(scene.splitFlapAnimations.items):
+        groups.setdefault(item.collectionID, []).append((i, item))
+    return groups
+
+def importSchedule(scene, path, defaultCollection=None, replace=False, extend=True, center=False):
+    # add all rows of a CSV/JSON schedule to the animation list in one go
+    # raises ScheduleError without touching the list if a row cannot be read or refers to an unknown collection
+    # returns the number of imported rows and the conflicts per collection as (list index, kind, value)
+    return addScheduleRows(scene, readSchedule(path, extend=extend, center=center), defaultCollection=defaultCollection, replace=replace)
+
+def addScheduleRows(scene, rows, defaultCollection=None, replace=False):
+    # all rows are added in one batch, the affected timelines are checked in a single sweep
+    edit = TimelineEdit(scene, strict=False)
+    cleared = set()
+    rowCount = 0
+    for row in rows:
+        collName = row.collection or defaultCollection
+        try:
+            if replace and collName not in cleared:
+                edit.clear(collName)
+                cleared.add(collName)
+            edit.add(collName, row.keyTime, row.text, extend=row.extend, center=row.center)
+        except TimelineEditError as e:
+            raise ScheduleError(row.line, str(e))
+        rowCount += 1
+    return rowCount, edit.commit()
+
+def writeConflictReport(scene, conflicts, name="SplitFlapImportReport"):
+    report = bpy.data.texts.get(name)
+    if report is None:
+        report = bpy.data.texts.new(name)
+    items = scene.splitFlapAnimations.items
+    lines = []
+    for collName, collConflicts in conflicts.items():
+        for index, kind, value in collConflicts:
+            item = items[index]
+            if kind == "duplicate":
+                lines.append("%s t %.2f '%s': only %.2f s after the previous entry" % (collName, item.keyTime, item.text, value))
+            else:
+                lines.append("%s t %.2f '%s': %.2f s missing to flap from the previous text" % (collName, item.keyTime, item.text, -value))
+    report.from_string("\n".join(lines))
+    print("\n".join(lines))
+    return report
+
+def findImage(path):
+    # image data block already loaded from the given file
+    for image in bpy.data.images:
+        if image.source == 'FILE' and os.path.normpath(bpy.path.abspath(image.filepath)) == os.path.normpath(path):
+            return image
+    return None
+
+def setMaskColors(material, fontColor, backgroundColor):
+    # colour the glyph mask of the image texture node: mix between background and font colour by the mask value
+    nodes = material.node_tree.nodes
+    links = material.node_tree.links
+    imageNode = nodes["Image Texture"]
+    mixNode = nodes.get("SplitFlapColors")
+    if mixNode is None:
+        mixNode = nodes.new("ShaderNodeMix")
+        mixNode.name = "SplitFlapColors"
+        mixNode.data_type = 'RGBA'
+        mixNode.location = (imageNode.location[0] + 300, imageNode.location[1])
+        result = getSocket(mixNode.outputs, "Result_Color")
+        # the mixed colour replaces the texture colour wherever it was used
+        for link in [link for link in links if link.from_node == imageNode and link.from_socket.identifier == "Color"]:
+            links.new(result, link.to_socket)
+            links.remove(link)
+        links.new(imageNode.outputs["Color"], getSocket(mixNode.inputs, "Factor_Float"))
+    getSocket(mixNode.inputs, "A_Color").default_value = backgroundColor
+    getSocket(mixNode.inputs, "B_Color").default_value = fontColor
+
+def getSocket(sockets, identifier):
+    # sockets of the mix node share their names between the data types, only the identifier is unique
+    for socket in sockets:
+        if socket.identifier == identifier:
+            return socket
+    return None
+
+def getFlapModifier(obj):
+    for modifier in obj.modifiers:
+        if modifier.type == 'NODES' and modifier.name == "SplitFlapCircle":
+            return modifier
+    return None
+
+def getFlapFCurve(obj):
+    if obj.animation_data is None or obj.animation_data.action is None:
+        return None
+    return obj.animation_data.action.fcurves.find('modifiers["SplitFlapCircle"]["Input_8"]')
+
+def writeFlapKeyframes(obj, frames, values, interpolation='BEZIER', handleType='AUTO_CLAMPED', start=0, holdConstant=False):
+    # create the F-curve of the flap angle once and fill all its keyframes in bulk,
+    # the keyframes before index start are kept and the ones from there on are replaced
+    # holdConstant: constant interpolation for keys followed by a key of the same value
+    dataPath = 'modifiers["SplitFlapCircle"]["Input_8"]'
+    fcurve = getFlapFCurve(obj)
+    count = start + len(frames)
+    if count == 0:
+        if fcurve is not None:
+            obj.animation_data.action.fcurves.remove(fcurve)
+        return None
+    if fcurve is None:
+        animData = obj.animation_data_create()
+        if animData.action is None:
+            animData.action = bpy.data.actions.new("%sAction" % obj.name)
+        fcurve = animData.action.fcurves.new(dataPath)
+    keyframePoints = fcurve.keyframe_points
+    # reuse the existing keyframes, only remove the surplus ones from the end
+    if len(keyframePoints) > count:
+        for i in range(len(keyframePoints) - 1, count - 1, -1):
+            keyframePoints.remove(keyframePoints[i], fast=True)
+    elif len(keyframePoints) < count:
+        keyframePoints.add(count - len(keyframePoints))
+    co = np.empty(2 * count, dtype=np.float32)
+    keyframePoints.foreach_get("co", co)
+    co[2*start::2] = frames
+    co[2*start+1::2] = values
+    keyframePoints.foreach_set("co", co)
+    setKeyframeEnum(keyframePoints, "interpolation", interpolation, start)
+    if holdConstant:
+        setKeyframeEnum(keyframePoints, "interpolation", 'CONSTANT', start, mask=holdKeyframes(values))
+    setKeyframeEnum(keyframePoints, "handle_left_type", handleType, start)
+    setKeyframeEnum(keyframePoints, "handle_right_type", handleType, start)
+    fcurve.update() # sort the keyframes and compute the handles
+    return fcurve
+
+def setKeyframeEnum(keyframePoints, attribute, identifier, offset=0, mask=None):
+    # enum values have to be passed as their internal integer value to foreach_set
+    # mask: only set the keyframes from offset on where the mask is True
+    enumValue = bpy.types.Keyframe.bl_rna.properties[attribute].enum_items[identifier].value
+    values = np.empty(len(keyframePoints), dtype=np.int32)
+    keyframePoints.foreach_get(attribute, values)
+    if mask is None:
+        values[offset:] = enumValue
+    else:
+        values[offset:][mask] = enumValue
+    keyframePoints.foreach_set(attribute, values)
 
 def getBoundingBoxCenter(obj):
     localCenter = 0.125 * sum((Vector(b) for b in obj.bound_box), Vector())
     return obj.matrix_world @ localCenter
 
-def moveToCollection(obj, collection, exclusive=True):
-    if exclusive:
-        for coll in obj.users_collection:
-            coll.objects.unlink(obj)
-    if obj.name not in collection.objects:
-        collection.objects.link(obj)
+def createBoardLOD(coll, materialName, uvName):
+    # flat level of detail in front of the drums of the split flap items or of the instanced board
+    detailObjects = getDetailObjects(coll)
+    if len(detailObjects) == 0:
+        return None
+    boardObjects = getBoardObjects(coll)
+    if len(boardObjects) > 0:
+        boardObj = boardObjects[0]
+        drum = next((obj for obj in coll.all_objects if "SplitFlapDrum" in obj), None)
+        if drum is None:
+            return None
+        # the drum geometry is instanced on the board points in its local coordinates
+        localCenter = 0.125 * sum((Vector(b) for b in drum.bound_box), Vector())
+        centers = [boardObj.matrix_world @ (vertex.co + localCenter) for vertex in boardObj.data.vertices]
+        cellObj = drum
+    else:
+        centers = [getBoundingBoxCenter(obj) for obj in detailObjects]
+        cellObj = detailObjects[0]
+    dimensions = cellObj.dimensions
+    centers = [(center.x, center.y - 0.5 * dimensions.y, center.z) for center in centers]
+    material = next((slot.material for slot in cellObj.material_slots if slot.material is not None and slot.material.name.startswith(materialName)), None)
+    lodObj = createLODObject("%s_LOD" % coll.name, coll, centers, coll.get("SplitFlapSettings.cellWidth", dimensions.x),
+                             coll.get("SplitFlapSettings.cellHeight", dimensions.z), material=material, uvName=uvName)
+    if detailObjects[0].parent is not None:
+        parent([lodObj], detailObjects[0].parent)
+    return lodObj
+
+def cellOffsets(rowCount, colCount, xStep, zStep):
+    # offsets of all cells relative to the first one, row by row
+    return [(h*xStep, 0., -v*zStep) for v in range(0, rowCount) for h in range(0, colCount)]
+
+def findLayerCollection(layerCollection, collection):
+    if layerCollection.collection == collection:
+        return layerCollection
+    for child in layerCollection.children:
+        result = findLayerCollection(child, collection)
+        if result is not None:
+            return result
+    return None
+
+def buildCells(context, template, collection, offsets, nameFormat, startIndex=1):
+    # create, place and link all copies of the template in a single pass while the collection is excluded
+    # from the view layer, such that the depsgraph is evaluated only once afterwards
+    layerCollection = findLayerCollection(context.view_layer.layer_collection, collection)
+    if layerCollection is not None:
+        layerCollection.exclude = True
+    baseLocation = template.location.copy()
+    cells = []
+    for i, offset in enumerate(offsets):
+        # the geometry is generated by the modifier, the mesh data can be shared
+        objCopy = duplicateObject(template, data=False)
+        objCopy.name = nameFormat % (startIndex + i)
+        objCopy.location = (baseLocation.x + offset[0], baseLocation.y + offset[1], baseLocation.z + offset[2])
+        collection.objects.link(objCopy)
+        cells.append(objCopy)
+    if layerCollection is not None:
+        layerCollection.exclude = False
+    return cells
 
 def duplicateObject(obj, data=True, actions=True, collection=None):
     objCopy = obj.copy()
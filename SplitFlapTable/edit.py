@@ -0,0 +1,270 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Batch editing of the animation list for scripts: entries are added, updated, removed and shifted
+# in memory with a sorted index per collection. The changed timelines are validated in a single
+# sweep and the animation list is written once at commit.
+#
+#   with TimelineEdit(bpy.context.scene) as edit:
+#       for keyTime, text in show:
+#           edit.add("SplitFlapSystem0", keyTime, text)
+#       edit.shift("SplitFlapSystem0", 30., start=600.)
+
+import bisect
+
+import bpy
+
+from .timeline import getTimeline, formatText, DUPLICATE_TOLERANCE
+
+
+class TimelineEditError(ValueError):
+    def __init__(self, message, conflicts=None):
+        super().__init__(message)
+        self.conflicts = conflicts if conflicts is not None else {}
+
+
+class Entry:
+    # entry of the animation list, source: index in the list (None for new entries)
+    __slots__ = ("source", "keyTime", "text", "formattedText", "extend", "center", "changed")
+
+    def __init__(self, source, keyTime, text, formattedText, extend, center, changed=False):
+        self.source = source
+        self.keyTime = keyTime
+        self.text = text
+        self.formattedText = formattedText
+        self.extend = extend
+        self.center = center
+        self.changed = changed
+
+    def asTuple(self):
+        return (self.keyTime, self.text, self.extend, self.center)
+
+
+class CollectionEntries:
+    # entries of one split flap collection sorted by time key, the time keys are the index for the bisection
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.entries = []
+        self.keyTimes = []
+
+    def insert(self, entry):
+        index = bisect.bisect_right(self.keyTimes, entry.keyTime)
+        self.entries.insert(index, entry)
+        self.keyTimes.insert(index, entry.keyTime)
+        return index
+
+    def pop(self, index):
+        del self.keyTimes[index]
+        return self.entries.pop(index)
+
+    def find(self, keyTime, tolerance=DUPLICATE_TOLERANCE):
+        # index of the entry closest to the time key within the tolerance or None
+        low = bisect.bisect_left(self.keyTimes, keyTime - tolerance)
+        high = bisect.bisect_right(self.keyTimes, keyTime + tolerance)
+        if low == high:
+            return None
+        return min(range(low, high), key=lambda i: abs(self.keyTimes[i] - keyTime))
+
+    def range(self, start=0., end=None):
+        # index range of the entries with start <= keyTime < end
+        low = bisect.bisect_left(self.keyTimes, start)
+        high = len(self.keyTimes) if end is None else bisect.bisect_left(self.keyTimes, end)
+        return low, max(low, high)
+
+    def resort(self):
+        # nearly sorted after shifting a range of entries, the stable sort merges the runs in linear time
+        self.entries.sort(key=lambda entry: entry.keyTime)
+        self.keyTimes = [entry.keyTime for entry in self.entries]
+
+
+class TimelineEdit:
+    # batch of changes to the animation list of a scene, entries are identified by collection name and time key
+
+    def __init__(self, scene, strict=True):
+        self.scene = scene
+        self.strict = strict # refuse to commit changes leaving conflicts in a timeline
+        self._collections = None # collection name -> CollectionEntries, loaded on first use
+        self._removed = [] # list indices of removed entries
+        self._changed = set() # names of the collections with changes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.commit()
+        return False
+
+    def _load(self):
+        # group the animation list by collection in a single pass
+        self._collections = {}
+        for i, item in enumerate(self.scene.splitFlapAnimations.items):
+            if item.collectionID not in self._collections:
+                self._collections[item.collectionID] = CollectionEntries(bpy.data.collections.get(item.collectionID))
+            collEntries = self._collections[item.collectionID]
+            collEntries.entries.append(Entry(i, item.keyTime, item.text, item.formattedText, item.extend, item.center))
+        for collEntries in self._collections.values():
+            collEntries.resort()
+
+    def _get(self, collName):
+        if self._collections is None:
+            self._load()
+        collEntries = self._collections.get(collName)
+        if collEntries is None or collEntries.collection is None:
+            collection = bpy.data.collections.get(collName) if collName else None
+            if collection is None or "SplitFlapSettings.characters" not in collection:
+                raise TimelineEditError("unknown split flap collection '%s'" % collName)
+            if collEntries is None:
+                collEntries = CollectionEntries(collection)
+                self._collections[collName] = collEntries
+            collEntries.collection = collection
+        return collEntries
+
+    def _format(self, collEntries, text):
+        collection = collEntries.collection
+        return formatText(text, collection["SplitFlapSettings.characters"], collection["SplitFlapSettings.colCount"])
+
+    def _find(self, collEntries, collName, keyTime, tolerance):
+        index = collEntries.find(keyTime, tolerance)
+        if index is None:
+            raise TimelineEditError("no entry of '%s' at t %.2f" % (collName, keyTime))
+        return index
+
+    def add(self, collName, keyTime, text, extend=True, center=False):
+        if keyTime < 0:
+            raise TimelineEditError("negative time key %.2f" % keyTime)
+        collEntries = self._get(collName)
+        collEntries.insert(Entry(None, keyTime, text, self._format(collEntries, text), extend, center, changed=True))
+        self._changed.add(collName)
+
+    def update(self, collName, keyTime, newKeyTime=None, text=None, extend=None, center=None, tolerance=DUPLICATE_TOLERANCE):
+        # change the entry at the time key, None keeps the current value
+        if newKeyTime is not None and newKeyTime < 0:
+            raise TimelineEditError("negative time key %.2f" % newKeyTime)
+        collEntries = self._get(collName)
+        entry = collEntries.pop(self._find(collEntries, collName, keyTime, tolerance))
+        if newKeyTime is not None:
+            entry.keyTime = newKeyTime
+        if text is not None:
+            entry.text = text
+            entry.formattedText = self._format(collEntries, text)
+        if extend is not None:
+            entry.extend = extend
+        if center is not None:
+            entry.center = center
+        entry.changed = True
+        collEntries.insert(entry)
+        self._changed.add(collName)
+
+    def remove(self, collName, keyTime, tolerance=DUPLICATE_TOLERANCE):
+        collEntries = self._get(collName)
+        self._discard(collEntries.pop(self._find(collEntries, collName, keyTime, tolerance)))
+        self._changed.add(collName)
+
+    def removeRange(self, collName, start=0., end=None):
+        # remove the entries with start <= keyTime < end, returns their number
+        collEntries = self._get(collName)
+        low, high = collEntries.range(start, end)
+        for entry in collEntries.entries[low:high]:
+            self._discard(entry)
+        del collEntries.entries[low:high]
+        del collEntries.keyTimes[low:high]
+        if high > low:
+            self._changed.add(collName)
+        return high - low
+
+    def clear(self, collName):
+        return self.removeRange(collName)
+
+    def shift(self, collName, offset, start=0., end=None):
+        # move the entries with start <= keyTime < end by offset seconds, returns their number
+        collEntries = self._get(collName)
+        low, high = collEntries.range(start, end)
+        if high > low and collEntries.keyTimes[low] + offset < 0:
+            raise TimelineEditError("shifting by %.2f s would move the entry at t %.2f before the start" % (offset, collEntries.keyTimes[low]))
+        for entry in collEntries.entries[low:high]:
+            entry.keyTime += offset
+            entry.changed = True
+        if high > low:
+            collEntries.resort()
+            self._changed.add(collName)
+        return high - low
+
+    def _discard(self, entry):
+        if entry.source is not None:
+            self._removed.append(entry.source)
+
+    def entries(self, collName):
+        # (keyTime, text, extend, center) of the entries sorted by time key including the pending changes
+        return [entry.asTuple() for entry in self._get(collName).entries]
+
+    def neighbours(self, collName, keyTime):
+        # entries right before and from the time key on, None at the ends
+        collEntries = self._get(collName)
+        index = bisect.bisect_left(collEntries.keyTimes, keyTime)
+        previous = collEntries.entries[index - 1].asTuple() if index > 0 else None
+        following = collEntries.entries[index].asTuple() if index < len(collEntries.entries) else None
+        return previous, following
+
+    def validate(self):
+        # single sweep over the timeline of every changed collection: collection name -> [(entry, kind, value)]
+        conflicts = {}
+        for collName in self._changed:
+            collEntries = self._collections[collName]
+            collection = collEntries.collection
+            cellCount = collection["SplitFlapSettings.rowCount"] * collection["SplitFlapSettings.colCount"]
+            for entry in collEntries.entries:
+                if len(entry.formattedText) == 0 and len(entry.text) > 0:
+                    entry.formattedText = self._format(collEntries, entry.text)
+                    entry.changed = True
+            timeline = getTimeline(collName, cellCount, collection["SplitFlapSettings.characters"], collection["SplitFlapSettings.flapTime"])
+            timeline.sync([(entry.keyTime, entry.formattedText, entry.extend, entry.center) for entry in collEntries.entries])
+            conflicts[collName] = [(collEntries.entries[i], kind, value) for i, kind, value in timeline.conflicts()]
+        return conflicts
+
+    def commit(self):
+        # write the changes to the animation list, returns the conflicts per collection as (list index, kind, value)
+        if self._collections is None or (len(self._changed) == 0 and len(self._removed) == 0):
+            return {}
+        conflicts = self.validate()
+        conflictCount = sum(len(collConflicts) for collConflicts in conflicts.values())
+        if self.strict and conflictCount > 0:
+            raise TimelineEditError("%d entries cannot be reached in time or are too close to the previous one" % conflictCount,
+                                    {collName : [(entry.keyTime, kind, value) for entry, kind, value in collConflicts] for collName, collConflicts in conflicts.items()})
+        items = self.scene.splitFlapAnimations.items
+        # changed entries in place, then the removals from the end, the new entries are appended
+        for collName in self._changed:
+            for entry in self._collections[collName].entries:
+                if entry.changed and entry.source is not None:
+                    self._write(items[entry.source], entry, collName)
+        removed = sorted(set(self._removed))
+        for i in reversed(removed):
+            items.remove(i)
+        if len(removed) > 0:
+            for collEntries in self._collections.values():
+                for entry in collEntries.entries:
+                    if entry.source is not None:
+                        entry.source -= bisect.bisect_left(removed, entry.source)
+        for collName in self._changed:
+            for entry in self._collections[collName].entries:
+                if entry.source is None:
+                    entry.source = len(items)
+                    self._write(items.add(), entry, collName)
+                entry.changed = False
+        if self.scene.splitFlapAnimationIndex >= len(items):
+            self.scene.splitFlapAnimationIndex = len(items) - 1
+        self._removed = []
+        self._changed = set()
+        return {collName : [(entry.source, kind, value) for entry, kind, value in collConflicts] for collName, collConflicts in conflicts.items()}
+
+    def _write(self, item, entry, collName):
+        item["text"] = entry.text # bypass the update of the text status message in the panel
+        item.formattedText = entry.formattedText
+        item.keyTime = entry.keyTime
+        item.extend = entry.extend
+        item.center = entry.center
+        item.collectionID = collName
@@ -0,0 +1,104 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Geometry of the frame housing the split flap items: a box with one pocket per
+# item cut into its front face. This module must not import bpy.
+
+import numpy as np
+
+FRAME_MARGIN = (0.1, 0.05, 0.1) # frame border beyond the outer items relative to the item dimensions
+HOLE_SCALE = (1.03, 1.02) # hole width/height relative to the item dimensions
+HOLE_DEPTH = 0.4 # pocket depth behind the item center relative to the item depth
+
+
+def frameGeometry(centers, rowCount, colCount, dimensions):
+    # centers: bounding box centers of the items row by row (top row first), dimensions: item dimensions
+    # returns the vertices relative to the frame center, the faces and the frame center
+    centers = np.asarray(centers, dtype=np.float64).reshape(rowCount, colCount, 3)
+    dx, dy, dz = dimensions
+    first = centers[0, 0]
+    last = centers[-1, -1]
+    xMin = first[0] - (0.5 + FRAME_MARGIN[0]) * dx
+    xMax = last[0] + (0.5 + FRAME_MARGIN[0]) * dx
+    yMin = first[1] - (0.5 + FRAME_MARGIN[1]) * dy
+    yMax = last[1] + (0.5 + FRAME_MARGIN[1]) * dy
+    zMin = last[2] - (0.5 + FRAME_MARGIN[2]) * dz
+    zMax = first[2] + (0.5 + FRAME_MARGIN[2]) * dz
+    frameCenter = np.array((0.5 * (xMin + xMax), 0.5 * (yMin + yMax), 0.5 * (zMin + zMax)))
+    yBack = first[1] + HOLE_DEPTH * dy
+
+    # grid lines of the front face: frame border and hole borders, holes never overlap their neighbours
+    colX = centers[0, :, 0]
+    rowZ = centers[::-1, 0, 2] # bottom row first
+    xLines = gridLines(colX, 0.5 * HOLE_SCALE[0] * dx, xMin, xMax)
+    zLines = gridLines(rowZ, 0.5 * HOLE_SCALE[1] * dz, zMin, zMax)
+    nx, nz = len(xLines), len(zLines)
+
+    # front face vertices, index k*nx + i
+    gridX, gridZ = np.meshgrid(xLines, zLines)
+    front = np.column_stack((gridX.ravel(), np.full(nx * nz, yMin), gridZ.ravel()))
+    # pocket bottom vertices, four per hole
+    holeI, holeK = np.meshgrid(np.arange(1, nx - 1, 2), np.arange(1, nz - 1, 2))
+    holeI, holeK = holeI.ravel(), holeK.ravel()
+    holeCount = len(holeI)
+    back = np.empty((holeCount, 4, 3))
+    for j, (di, dk) in enumerate(((0, 0), (1, 0), (1, 1), (0, 1))):
+        back[:, j, 0] = xLines[holeI + di]
+        back[:, j, 1] = yBack
+        back[:, j, 2] = zLines[holeK + dk]
+    backOffset = nx * nz
+    # back corners of the box
+    corners = np.array(((xMin, yMax, zMin), (xMax, yMax, zMin), (xMax, yMax, zMax), (xMin, yMax, zMax)))
+    cornerOffset = backOffset + 4 * holeCount
+    vertices = np.concatenate((front, back.reshape(-1, 3), corners)) - frameCenter
+
+    # front face quads except the holes
+    quadI, quadK = np.meshgrid(np.arange(nx - 1), np.arange(nz - 1))
+    quadI, quadK = quadI.ravel(), quadK.ravel()
+    solid = ~((quadI % 2 == 1) & (quadK % 2 == 1))
+    quadI, quadK = quadI[solid], quadK[solid]
+    v0 = quadK * nx + quadI
+    faces = np.column_stack((v0, v0 + 1, v0 + nx + 1, v0 + nx)).tolist()
+
+    # pocket walls and bottom
+    f0 = holeK * nx + holeI
+    frontRing = np.column_stack((f0, f0 + 1, f0 + nx + 1, f0 + nx))
+    backRing = backOffset + 4 * np.arange(holeCount)[:, None] + np.arange(4)[None, :]
+    for j in range(4):
+        k = (j + 1) % 4
+        faces.extend(np.column_stack((frontRing[:, j], frontRing[:, k], backRing[:, k], backRing[:, j])).tolist())
+    faces.extend(backRing.tolist())
+
+    # outer faces of the box
+    bottom = list(range(0, nx))
+    top = list(range((nz - 1) * nx, nz * nx))
+    left = list(range(0, nz * nx, nx))
+    right = list(range(nx - 1, nz * nx, nx))
+    c0, c1, c2, c3 = range(cornerOffset, cornerOffset + 4)
+    faces.append(bottom[::-1] + [c0, c1])
+    faces.append(top + [c2, c3])
+    faces.append(left + [c3, c0])
+    faces.append(right[::-1] + [c1, c2])
+    faces.append([c0, c3, c2, c1])
+    return vertices, faces, frameCenter
+
+
+def gridLines(centers, halfSize, low, high):
+    # sorted coordinates: low border, hole borders around every center, high border
+    centers = np.sort(np.asarray(centers, dtype=np.float64))
+    lower = centers - halfSize
+    upper = centers + halfSize
+    if len(centers) > 1:
+        middle = 0.5 * (centers[1:] + centers[:-1])
+        gap = 1e-4 * halfSize
+        upper[:-1] = np.minimum(upper[:-1], middle - gap)
+        lower[1:] = np.maximum(lower[1:], middle + gap)
+    lines = np.empty(2 * len(centers) + 2)
+    lines[0] = low
+    lines[1:-1:2] = lower
+    lines[2:-1:2] = upper
+    lines[-1] = high
+    return lines
@@ -0,0 +1,146 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Level of detail for distant boards: a single mesh with a flat plane per split flap item
+# showing the atlas tile of the current character replaces the drums. The tiles are chosen
+# on frame change from the plan of the last apply.
+
+import math
+import bpy
+import numpy as np
+from mathutils import Vector
+
+from .planner import frameLookup, lookupAngles, angleCharacters
+
+LOD_MARKER = "SplitFlapLOD" # custom property of the plane object holding the collection name
+DEFAULT_DISTANCE = 30. # camera distance from which AUTO shows the planes
+
+_lookups = {} # collection name -> FrameLookup of the plan of the last apply
+_lastTiles = {} # plane object name -> drum positions shown
+
+
+def planeGeometry(centers, width, height):
+    # one quad per cell in the XZ plane facing -Y, centers: front centers of the cells row by row
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+    corners = np.array(((-0.5, 0., -0.5), (0.5, 0., -0.5), (0.5, 0., 0.5), (-0.5, 0., 0.5))) * (width, 0., height)
+    vertices = (centers[:, None, :] + corners[None, :, :]).reshape(-1, 3)
+    faces = np.arange(len(vertices)).reshape(-1, 4)
+    return vertices, faces
+
+
+def tileUVs(positions, atlasColumns, atlasRows):
+    # UV coordinates of the quad corners for the atlas tiles of the drum positions (tiles row by row from the top)
+    positions = np.asarray(positions, dtype=np.int64)
+    u = (positions % atlasColumns)[:, None] + np.array((0., 1., 1., 0.))
+    v = atlasRows - (positions // atlasColumns)[:, None] - np.array((1., 1., 0., 0.))
+    return np.stack((u / atlasColumns, v / atlasRows), axis=-1).astype(np.float32)
+
+
+def atlasShape(collection):
+    # boards built before the atlas layout setting use a square atlas
+    side = math.ceil(math.sqrt(len(collection["SplitFlapSettings.characters"])))
+    return collection.get("SplitFlapSettings.atlasColumns", side), collection.get("SplitFlapSettings.atlasRows", side)
+
+
+def createLODObject(name, collection, centers, width, height, material=None, uvName="UVMap"):
+    vertices, faces = planeGeometry(centers, width, height)
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(vertices.tolist(), [], faces.tolist())
+    uvLayer = mesh.uv_layers.new(name=uvName)
+    uvLayer.data.foreach_set("uv", tileUVs(np.zeros(len(faces), dtype=np.int64), *atlasShape(collection)).ravel())
+    if material is not None:
+        mesh.materials.append(material)
+    mesh.update()
+    lodObj = bpy.data.objects.new(name, mesh)
+    lodObj[LOD_MARKER] = collection.name
+    lodObj.hide_viewport = True
+    lodObj.hide_render = True
+    collection.objects.link(lodObj)
+    return lodObj
+
+
+def getLODObject(collection):
+    for obj in collection.all_objects:
+        if LOD_MARKER in obj and obj.type == 'MESH':
+            return obj
+    return None
+
+
+def getDetailObjects(collection):
+    # objects replaced by the planes: the split flap items or the instanced boards
+    return [obj for obj in collection.all_objects if ("SplitFlapItem" in obj or "SplitFlapBoard" in obj) and obj.type == 'MESH']
+
+
+def setLODPlan(collection, plan):
+    # boards without planes do not need the lookup, it is created with the planes on the next frame change
+    lodObj = getLODObject(collection)
+    if lodObj is None:
+        _lookups.pop(collection.name, None)
+        return
+    _lookups[collection.name] = frameLookup(plan)
+    _lastTiles.pop(lodObj.name, None)
+
+
+def hasLODPlan(collection):
+    return collection.name in _lookups
+
+
+def useFlatDetail(scene, collection, lodObj):
+    # FULL keeps the drums, FLAT shows the planes, AUTO shows the planes from the distance on
+    mode = collection.get("SplitFlapSettings.detail", 'FULL')
+    if mode != 'AUTO':
+        return mode == 'FLAT'
+    if scene.camera is None:
+        return False
+    localCenter = 0.125 * sum((Vector(b) for b in lodObj.bound_box), Vector())
+    distance = (scene.camera.matrix_world.translation - lodObj.matrix_world @ localCenter).length
+    return distance > collection.get("SplitFlapSettings.detailDistance", DEFAULT_DISTANCE)
+
+
+def setFlatDetail(collection, lodObj, flat):
+    # hidden drums are not evaluated at all
+    for obj in getDetailObjects(collection):
+        obj.hide_viewport = flat
+        obj.hide_render = flat
+    lodObj.hide_viewport = not flat
+    lodObj.hide_render = not flat
+    _lastTiles.pop(lodObj.name, None)
+
+
+def updateLODTiles(lodObj, collection, frame):
+    mesh = lodObj.data
+    cellCount = len(mesh.polygons)
+    lookup = _lookups.get(collection.name)
+    characters = collection["SplitFlapSettings.characters"]
+    if lookup is None:
+        positions = np.zeros(cellCount, dtype=np.int64)
+    else:
+        positions = angleCharacters(lookupAngles(lookup, cellCount, frame), len(characters))
+    # most frames show the same characters as the previous one
+    lastPositions = _lastTiles.get(lodObj.name)
+    if lastPositions is not None and np.array_equal(lastPositions, positions):
+        return
+    uvLayer = mesh.uv_layers.active if mesh.uv_layers.active is not None else mesh.uv_layers[0]
+    uvLayer.data.foreach_set("uv", tileUVs(positions, *atlasShape(collection)).ravel())
+    mesh.update()
+    _lastTiles[lodObj.name] = positions
+
+
+def updateLODObject(scene, lodObj, frame):
+    collection = bpy.data.collections.get(lodObj[LOD_MARKER])
+    if collection is None or len(lodObj.data.uv_layers) == 0:
+        return
+    flat = useFlatDetail(scene, collection, lodObj)
+    # only switch the visibility on changes, the depsgraph is rebuilt afterwards
+    if lodObj.hide_render == flat:
+        setFlatDetail(collection, lodObj, flat)
+    if flat:
+        updateLODTiles(lodObj, collection, frame)
+
+
+def resetLODCache():
+    _lookups.clear()
+    _lastTiles.clear()
@@ -0,0 +1,292 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Geometry Nodes groups generated by the addon (in addition to the ones of the template file)
+
+import math
+import bpy
+
+BOARD_GROUP_NAME = "SplitFlapBoard"
+ANGLE_ATTRIBUTE = "flapAngle"
+CELL_ATTRIBUTE = "flapCell" # board point of the drum a realized vertex belongs to
+CARD_ATTRIBUTE = "CardNr" # card index stored by the template drum group
+FLAP_GROUP_NAME = "FlapOrientation" # template group computing the rotation of a single flap
+MIN_FLAP_COUNT = 8 # the template drum has at least this many flaps
+
+
+def newSocket(nodeGroup, name, inOut, socketType):
+    if hasattr(nodeGroup, "interface"): # Blender 4.0+
+        return nodeGroup.interface.new_socket(name, in_out=inOut, socket_type=socketType)
+    sockets = nodeGroup.inputs if inOut == 'INPUT' else nodeGroup.outputs
+    return sockets.new(socketType, name)
+
+
+def inputIdentifier(nodeGroup, name):
+    # identifier of the group input to be used as key for modifier inputs
+    if hasattr(nodeGroup, "interface"):
+        for item in nodeGroup.interface.items_tree:
+            if item.item_type == 'SOCKET' and item.in_out == 'INPUT' and item.name == name:
+                return item.identifier
+        return None
+    socket = nodeGroup.inputs.get(name)
+    return socket.identifier if socket is not None else None
+
+
+def setModifierInput(modifier, name, value):
+    identifier = inputIdentifier(modifier.node_group, name)
+    if identifier is not None:
+        modifier[identifier] = value
+    return identifier
+
+
+def enabledOutput(node, name):
+    # nodes with a data type option have several outputs of the same name in older Blender versions
+    for socket in node.outputs:
+        if socket.name == name and socket.enabled:
+            return socket
+    return node.outputs[name]
+
+
+def enabledInput(node, name):
+    for socket in node.inputs:
+        if socket.name == name and socket.enabled:
+            return socket
+    return node.inputs[name]
+
+
+def mathNode(nodeGroup, operation, a, b=None, location=(0, 0)):
+    # math node with sockets or constant values as inputs
+    node = nodeGroup.nodes.new('ShaderNodeMath')
+    node.operation = operation
+    node.location = location
+    for i, value in enumerate((a, b)):
+        if value is None:
+            continue
+        if isinstance(value, bpy.types.NodeSocket):
+            nodeGroup.links.new(value, node.inputs[i])
+        else:
+            node.inputs[i].default_value = value
+    return node.outputs[0]
+
+
+def addAngleTrackSampler(nodeGroup, groupInput, location=(-900, -600)):
+    # angle of the current cell (point index) and frame from the baked angle track image
+    # the track stores four consecutive frames in the RGBA channels of one row, one column per cell
+    nodes = nodeGroup.nodes
+    links = nodeGroup.links
+    x, y = location
+    sceneTime = nodes.new('GeometryNodeInputSceneTime')
+    sceneTime.location = (x - 400, y)
+    lastFrame = mathNode(nodeGroup, 'SUBTRACT', groupInput.outputs["Track Frames"], 1., location=(x - 400, y - 150))
+    frame = mathNode(nodeGroup, 'MAXIMUM', sceneTime.outputs["Frame"], 0., location=(x - 200, y))
+    frame = mathNode(nodeGroup, 'MINIMUM', frame, lastFrame, location=(x, y))
+    frame = mathNode(nodeGroup, 'FLOOR', frame, location=(x + 200, y))
+    row = mathNode(nodeGroup, 'FLOOR', mathNode(nodeGroup, 'DIVIDE', frame, 4., location=(x + 400, y)), location=(x + 600, y))
+    channel = mathNode(nodeGroup, 'SUBTRACT', frame, mathNode(nodeGroup, 'MULTIPLY', row, 4., location=(x + 800, y - 150)), location=(x + 1000, y))
+    rowCount = mathNode(nodeGroup, 'CEIL', mathNode(nodeGroup, 'DIVIDE', groupInput.outputs["Track Frames"], 4., location=(x + 400, y - 300)), location=(x + 600, y - 300))
+
+    index = nodes.new('GeometryNodeInputIndex')
+    index.location = (x + 600, y - 450)
+    u = mathNode(nodeGroup, 'DIVIDE', mathNode(nodeGroup, 'ADD', index.outputs["Index"], 0.5, location=(x + 800, y - 450)), groupInput.outputs["Cell Count"], location=(x + 1000, y - 450))
+    v = mathNode(nodeGroup, 'DIVIDE', mathNode(nodeGroup, 'ADD', row, 0.5, location=(x + 800, y - 300)), rowCount, location=(x + 1000, y - 300))
+    uv = nodes.new('ShaderNodeCombineXYZ')
+    uv.location = (x + 1200, y - 350)
+    links.new(u, uv.inputs["X"])
+    links.new(v, uv.inputs["Y"])
+
+    image = nodes.new('GeometryNodeImageTexture')
+    image.interpolation = 'Closest'
+    image.extension = 'EXTEND'
+    image.location = (x + 1400, y - 300)
+    links.new(groupInput.outputs["Angle Track"], image.inputs["Image"])
+    links.new(uv.outputs["Vector"], image.inputs["Vector"])
+    separate = nodes.new('FunctionNodeSeparateColor')
+    separate.location = (x + 1600, y - 300)
+    links.new(image.outputs["Color"], separate.inputs["Color"])
+
+    # pick the channel of the frame
+    angle = None
+    for i, value in enumerate((separate.outputs["Red"], separate.outputs["Green"], separate.outputs["Blue"], image.outputs["Alpha"])):
+        compare = nodes.new('FunctionNodeCompare')
+        compare.data_type = 'FLOAT'
+        compare.operation = 'EQUAL'
+        compare.location = (x + 1800, y - 200*i)
+        links.new(channel, compare.inputs[0])
+        compare.inputs[1].default_value = i
+        compare.inputs["Epsilon"].default_value = 0.1
+        weighted = mathNode(nodeGroup, 'MULTIPLY', compare.outputs["Result"], value, location=(x + 2000, y - 200*i))
+        angle = weighted if angle is None else mathNode(nodeGroup, 'ADD', angle, weighted, location=(x + 2200, y - 200*i))
+    return angle
+
+
+def getFlapGroup(drum):
+    # the flap rotation group nested in the SplitFlapCircle group of the drum
+    for modifier in drum.modifiers:
+        if modifier.type == 'NODES' and modifier.node_group is not None:
+            for node in modifier.node_group.nodes:
+                if node.type == 'GROUP' and node.node_tree is not None and node.node_tree.name.startswith(FLAP_GROUP_NAME):
+                    return node.node_tree
+    return None
+
+
+def flapCount(characters):
+    return max(len(characters), MIN_FLAP_COUNT)
+
+
+def addFlapPose(nodeGroup, groupInput, flapGroup, location=(600, -300)):
+    # position of a realized drum vertex turned from the drum angle 0 to the angle of its board point like the template
+    # SplitFlapCircle group does it: the flaps sit on a ring turned by the drum angle around the X axis and every flap
+    # is turned around its ring point by the angle of the FlapOrientation group (which depends on the drum angle)
+    nodes = nodeGroup.nodes
+    links = nodeGroup.links
+    x, y = location
+
+    def attribute(name, dataType, offset):
+        node = nodes.new('GeometryNodeInputNamedAttribute')
+        node.data_type = dataType
+        node.inputs["Name"].default_value = name
+        node.location = (x, y - offset)
+        return enabledOutput(node, "Attribute")
+
+    cell = attribute(CELL_ATTRIBUTE, 'FLOAT_VECTOR', 0)
+    card = attribute(CARD_ATTRIBUTE, 'INT', 150)
+    angle = attribute(ANGLE_ATTRIBUTE, 'FLOAT', 300)
+    count = groupInput.outputs["Flap Count"]
+    radius = groupInput.outputs["Ring Radius"]
+
+    # flap rotation at the drum angle and at angle 0
+    flapAngles = []
+    for i, circleRotation in enumerate((angle, 0.)):
+        flap = nodes.new('GeometryNodeGroup')
+        flap.node_tree = flapGroup
+        flap.location = (x + 200, y - 450 - 200*i)
+        links.new(card, flap.inputs["FlapIndex"])
+        links.new(count, flap.inputs["Flap count"])
+        if i == 0:
+            links.new(circleRotation, flap.inputs["Circle rotation"])
+        else:
+            flap.inputs["Circle rotation"].default_value = circleRotation
+        separate = nodes.new('ShaderNodeSeparateXYZ')
+        separate.location = (x + 400, y - 450 - 200*i)
+        links.new(flap.outputs["Flap angle"], separate.inputs["Vector"])
+        flapAngles.append(separate.outputs["X"])
+    flapTurn = mathNode(nodeGroup, 'SUBTRACT', flapAngles[0], flapAngles[1], location=(x + 600, y - 500))
+
+    # ring point of the card at angle 0: the mesh circle turned by 90 degrees around Y and by pi/count - pi/2 around X
+    step = mathNode(nodeGroup, 'DIVIDE', 2 * math.pi, count, location=(x + 200, y - 900))
+    ringAngle = mathNode(nodeGroup, 'MULTIPLY', card, step, location=(x + 400, y - 900))
+    ringAngle = mathNode(nodeGroup, 'ADD', ringAngle, mathNode(nodeGroup, 'MULTIPLY', step, 0.5, location=(x + 400, y - 1050)), location=(x + 600, y - 900))
+    ringAngle = mathNode(nodeGroup, 'SUBTRACT', ringAngle, 0.5 * math.pi, location=(x + 800, y - 900))
+    ringPoint = nodes.new('ShaderNodeCombineXYZ')
+    ringPoint.location = (x + 1200, y - 900)
+    links.new(mathNode(nodeGroup, 'MULTIPLY', mathNode(nodeGroup, 'SINE', ringAngle, location=(x + 1000, y - 850)), radius, location=(x + 1100, y - 850)), ringPoint.inputs["Y"])
+    cosine = mathNode(nodeGroup, 'MULTIPLY', mathNode(nodeGroup, 'COSINE', ringAngle, location=(x + 1000, y - 1000)), radius, location=(x + 1100, y - 1000))
+    links.new(mathNode(nodeGroup, 'MULTIPLY', cosine, -1., location=(x + 1150, y - 1000)), ringPoint.inputs["Z"])
+
+    # drum local position turned around the ring point by the flap rotation, moved with the ring point to the drum angle
+    position = nodes.new('GeometryNodeInputPosition')
+    position.location = (x, y - 1200)
+    local = nodes.new('ShaderNodeVectorMath')
+    local.operation = 'SUBTRACT'
+    local.location = (x + 200, y - 1200)
+    links.new(position.outputs["Position"], local.inputs[0])
+    links.new(cell, local.inputs[1])
+    flapRotate = nodes.new('ShaderNodeVectorRotate')
+    flapRotate.rotation_type = 'X_AXIS'
+    flapRotate.location = (x + 1400, y - 1200)
+    links.new(local.outputs["Vector"], flapRotate.inputs["Vector"])
+    links.new(ringPoint.outputs["Vector"], flapRotate.inputs["Center"])
+    links.new(flapTurn, flapRotate.inputs["Angle"])
+    ringRotate = nodes.new('ShaderNodeVectorRotate')
+    ringRotate.rotation_type = 'X_AXIS'
+    ringRotate.location = (x + 1400, y - 900)
+    links.new(ringPoint.outputs["Vector"], ringRotate.inputs["Vector"])
+    links.new(angle, ringRotate.inputs["Angle"])
+    result = flapRotate.outputs["Vector"]
+    for i, (operation, value) in enumerate((('SUBTRACT', ringPoint.outputs["Vector"]), ('ADD', ringRotate.outputs["Vector"]), ('ADD', cell))):
+        vectorMath = nodes.new('ShaderNodeVectorMath')
+        vectorMath.operation = operation
+        vectorMath.location = (x + 1600 + 200*i, y - 1000)
+        links.new(result, vectorMath.inputs[0])
+        links.new(value, vectorMath.inputs[1])
+        result = vectorMath.outputs["Vector"]
+    return result
+
+
+def getBoardNodeGroup(flapGroup):
+    # instance the drum object (evaluated at angle 0) on every point of the board mesh and turn the flaps of every drum
+    # to the point attribute flapAngle or to the angle of the baked angle track like the drum group of the template
+    nodeGroup = bpy.data.node_groups.get(BOARD_GROUP_NAME)
+    if nodeGroup is not None and inputIdentifier(nodeGroup, "Flap Count") is not None:
+        return nodeGroup
+    if nodeGroup is None:
+        nodeGroup = bpy.data.node_groups.new(BOARD_GROUP_NAME, 'GeometryNodeTree')
+        newSocket(nodeGroup, "Geometry", 'INPUT', 'NodeSocketGeometry')
+        newSocket(nodeGroup, "Drum", 'INPUT', 'NodeSocketObject')
+        newSocket(nodeGroup, "Use Angle Track", 'INPUT', 'NodeSocketBool')
+        newSocket(nodeGroup, "Angle Track", 'INPUT', 'NodeSocketImage')
+        newSocket(nodeGroup, "Track Frames", 'INPUT', 'NodeSocketInt')
+        newSocket(nodeGroup, "Cell Count", 'INPUT', 'NodeSocketInt')
+        newSocket(nodeGroup, "Geometry", 'OUTPUT', 'NodeSocketGeometry')
+    # groups of boards built before rotate the whole drum, they are rebuilt in place
+    nodeGroup.nodes.clear()
+    newSocket(nodeGroup, "Flap Count", 'INPUT', 'NodeSocketInt')
+    newSocket(nodeGroup, "Ring Radius", 'INPUT', 'NodeSocketFloat')
+    nodes = nodeGroup.nodes
+    links = nodeGroup.links
+
+    groupInput = nodes.new('NodeGroupInput')
+    groupInput.location = (-600, 0)
+    objectInfo = nodes.new('GeometryNodeObjectInfo')
+    objectInfo.transform_space = 'ORIGINAL'
+    objectInfo.location = (-300, -150)
+    angle = nodes.new('GeometryNodeInputNamedAttribute')
+    angle.data_type = 'FLOAT'
+    angle.inputs["Name"].default_value = ANGLE_ATTRIBUTE
+    angle.location = (-600, -350)
+    trackAngle = addAngleTrackSampler(nodeGroup, groupInput)
+    switch = nodes.new('GeometryNodeSwitch')
+    switch.input_type = 'FLOAT'
+    switch.location = (-450, -350)
+    links.new(groupInput.outputs["Use Angle Track"], enabledInput(switch, "Switch"))
+    links.new(enabledOutput(angle, "Attribute"), enabledInput(switch, "False"))
+    links.new(trackAngle, enabledInput(switch, "True"))
+
+    # the angle and the position of every board point are passed on to the vertices of its drum
+    storeAngle = nodes.new('GeometryNodeStoreNamedAttribute')
+    storeAngle.data_type = 'FLOAT'
+    storeAngle.domain = 'POINT'
+    storeAngle.inputs["Name"].default_value = ANGLE_ATTRIBUTE
+    storeAngle.location = (-250, 0)
+    links.new(groupInput.outputs["Geometry"], storeAngle.inputs["Geometry"])
+    links.new(enabledOutput(switch, "Output"), enabledInput(storeAngle, "Value"))
+    storeCell = nodes.new('GeometryNodeStoreNamedAttribute')
+    storeCell.data_type = 'FLOAT_VECTOR'
+    storeCell.domain = 'POINT'
+    storeCell.inputs["Name"].default_value = CELL_ATTRIBUTE
+    storeCell.location = (-50, 0)
+    position = nodes.new('GeometryNodeInputPosition')
+    position.location = (-250, -200)
+    links.new(storeAngle.outputs["Geometry"], storeCell.inputs["Geometry"])
+    links.new(position.outputs["Position"], enabledInput(storeCell, "Value"))
+
+    instanceOnPoints = nodes.new('GeometryNodeInstanceOnPoints')
+    instanceOnPoints.location = (150, 0)
+    realize = nodes.new('GeometryNodeRealizeInstances')
+    realize.location = (350, 0)
+    setPosition = nodes.new('GeometryNodeSetPosition')
+    setPosition.location = (2600, 0)
+    groupOutput = nodes.new('NodeGroupOutput')
+    groupOutput.location = (2800, 0)
+
+    links.new(groupInput.outputs["Drum"], objectInfo.inputs["Object"])
+    links.new(storeCell.outputs["Geometry"], instanceOnPoints.inputs["Points"])
+    links.new(objectInfo.outputs["Geometry"], instanceOnPoints.inputs["Instance"])
+    links.new(instanceOnPoints.outputs["Instances"], realize.inputs["Geometry"])
+    links.new(realize.outputs["Geometry"], setPosition.inputs["Geometry"])
+    links.new(addFlapPose(nodeGroup, groupInput, flapGroup), setPosition.inputs["Position"])
+    links.new(setPosition.outputs["Geometry"], groupOutput.inputs["Geometry"])
+    return nodeGroup
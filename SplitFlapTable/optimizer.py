@@ -0,0 +1,101 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Search for the order of the characters on the drum which needs the fewest flaps for a given
+# timeline: the cells only rotate forward, so the flaps between two characters depend on their
+# distance on the drum. This module must not import bpy.
+
+import numpy as np
+
+from .planner import charIndices
+
+OBJECTIVES = ("TOTAL", "SWITCH") # all flaps of all cells / sum of the longest flap sequence of every switch
+MAX_EVALUATION_SIZE = 1 << 22 # candidate orders x transitions evaluated at once
+
+
+def transitionTable(states, characters, cellCount, skipFirst=False):
+    # unique character changes of the resolved board states as arrays (switch, from, to, number of cells) of drum indices,
+    # the board starts with the first character on every cell, unknown characters keep the previous one
+    # skipFirst: the first state is displayed from the beginning without switching to it
+    charCount = len(characters)
+    positions = charIndices(states, characters, cellCount)
+    previous = np.zeros(cellCount, dtype=np.int64)
+    codes = []
+    for i, target in enumerate(positions):
+        target = np.where(target >= 0, target, previous)
+        changed = target != previous
+        if not (skipFirst and i == 0):
+            codes.append((i * charCount + previous[changed]) * charCount + target[changed])
+        previous = target
+    codes, counts = np.unique(np.concatenate(codes) if len(codes) > 0 else np.zeros(0, dtype=np.int64), return_counts=True)
+    return codes // (charCount * charCount), codes // charCount % charCount, codes % charCount, counts
+
+
+def drumCosts(positions, table, objective="TOTAL"):
+    # cost of every candidate, positions: drum position of every character per candidate (candidates x characters)
+    switches, sources, targets, counts = table
+    charCount = positions.shape[1]
+    if len(switches) == 0:
+        return np.zeros(len(positions), dtype=np.int64)
+    if objective == "SWITCH":
+        starts = np.flatnonzero(np.concatenate(([True], switches[1:] != switches[:-1])))
+    result = np.empty(len(positions), dtype=np.int64)
+    chunkSize = max(1, MAX_EVALUATION_SIZE // len(switches))
+    for first in range(0, len(positions), chunkSize):
+        chunk = positions[first:first+chunkSize]
+        flaps = (chunk[:, targets] - chunk[:, sources]) % charCount
+        if objective == "SWITCH":
+            result[first:first+chunkSize] = np.maximum.reduceat(flaps, starts, axis=1).sum(axis=1)
+        else:
+            result[first:first+chunkSize] = flaps @ counts
+    return result
+
+
+def moveCandidates(order, index):
+    # orders after swapping the character at the index with every other one and after moving it to every other position,
+    # the first character (the initial state of the board) stays in place
+    candidates = []
+    for other in range(1, len(order)):
+        if other == index:
+            continue
+        swapped = order.copy()
+        swapped[[index, other]] = swapped[[other, index]]
+        candidates.append(swapped)
+        candidates.append(np.insert(np.delete(order, index), other, order[index]))
+    return np.array(candidates, dtype=np.int64).reshape(-1, len(order))
+
+
+def optimizeDrumOrder(states, characters, cellCount, objective="TOTAL", skipFirst=False, maxRounds=100):
+    # local search over the drum orders: for every character the best swap or move is taken until no move improves the cost
+    # returns the characters in the new order, the cost of the given order and the cost of the new order
+    if objective not in OBJECTIVES:
+        raise ValueError("unknown objective %s" % objective)
+    if len(set(characters)) != len(characters):
+        raise ValueError("the drum characters have to be unique")
+    table = transitionTable(states, characters, cellCount, skipFirst=skipFirst)
+    if objective == "TOTAL":
+        # only the number of changes per character pair matters
+        pairs, inverse = np.unique(table[1] * len(characters) + table[2], return_inverse=True)
+        counts = np.bincount(inverse, weights=table[3]).astype(np.int64)
+        table = (np.zeros(len(pairs), dtype=np.int64), pairs // len(characters), pairs % len(characters), counts)
+    order = np.arange(len(characters))
+    cost = initialCost = int(drumCosts(order[None, :], table, objective)[0])
+    for iteration in range(maxRounds):
+        improved = False
+        for index in range(1, len(order)):
+            candidates = moveCandidates(order, index)
+            if len(candidates) == 0:
+                continue
+            # the positions are the inverse permutation of the orders
+            costs = drumCosts(np.argsort(candidates, axis=1), table, objective)
+            best = int(np.argmin(costs))
+            if costs[best] < cost:
+                order = candidates[best]
+                cost = int(costs[best])
+                improved = True
+        if not improved:
+            break
+    return "".join(characters[i] for i in order), initialCost, cost
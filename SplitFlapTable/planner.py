@@ -0,0 +1,310 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Animation planning for split flap boards. This module must not import bpy
+# such that it can be used (and benchmarked) outside of Blender.
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# One entry per cell transition, all fields are arrays of the same length:
+# cells: index of the split flap item in the board
+# startFrames/endFrames: frame where the transition starts/ends
+# startAngles/angles: cumulative drum angle at the start/end of the transition
+# keyStart: whether a key should be set at the start frame (not for texts displayed from the beginning)
+# keyIndices: index of the time key of the transition (the transitions are sorted by it)
+FramePlan = namedtuple("FramePlan", ["cells", "startFrames", "endFrames", "startAngles", "angles", "keyStart", "keyIndices"])
+
+# The transitions of a plan sorted by cell and start frame for the lookup of single frames (see frameLookup):
+# plan: the sorted FramePlan, keys: cell * span + start frame - first (sorted), span/first: frame range of the keys
+FrameLookup = namedtuple("FrameLookup", ["plan", "keys", "span", "first"])
+
+
+def charIndices(strings, characters, length):
+    # translate the strings into an array of drum positions, -1 for unknown characters
+    result = np.full((len(strings), length), -1, dtype=np.int64)
+    if len(strings) == 0:
+        return result
+    codes = np.array([ord(c) for c in characters], dtype=np.int64)
+    # keep the first occurrence of duplicated drum characters like characters.index does
+    drumCodes, firstIndex = np.unique(codes, return_index=True)
+    stringCodes = np.frombuffer("".join(strings).encode("utf-32-le"), dtype=np.uint32).astype(np.int64).reshape(len(strings), length)
+    pos = np.clip(np.searchsorted(drumCodes, stringCodes), 0, len(drumCodes) - 1)
+    found = drumCodes[pos] == stringCodes
+    result[found] = firstIndex[pos[found]]
+    return result
+
+
+def planFrames(cellCount, characters, flapTime, fps, keyTimes, states, startAngles=None, firstKey=0):
+    # compute all cell transitions of the board at once
+    # keyTimes: sorted time keys, states: resolved board string (length cellCount) for every time key
+    # startAngles: cumulative drum angle of every cell before the first time key, firstKey: index of the first time key
+    emptyInt = np.zeros(0, dtype=np.int64)
+    emptyFloat = np.zeros(0, dtype=np.float64)
+    if cellCount == 0 or len(states) == 0 or len(characters) == 0:
+        return FramePlan(emptyInt, emptyInt, emptyInt, emptyFloat, emptyFloat, np.zeros(0, dtype=bool), emptyInt)
+    charCount = len(characters)
+    targets = charIndices(states, characters, cellCount)
+
+    # unknown characters keep the previous state of the cell
+    positions = np.empty((len(states) + 1, cellCount), dtype=np.int64)
+    positions[0] = 0 if startAngles is None else np.rint(startAngles / (2 * math.pi / charCount)).astype(np.int64) % charCount
+    for i in range(len(states)):
+        positions[i + 1] = np.where(targets[i] >= 0, targets[i], positions[i])
+    steps = (positions[1:] - positions[:-1]) % charCount
+
+    # cumulative angle per cell after each key, positions[0] corresponds to the start angles
+    angles = np.empty((len(states) + 1, cellCount), dtype=np.float64)
+    angles[0] = 0. if startAngles is None else startAngles
+    angles[1:] = 2 * math.pi * steps / charCount
+    np.cumsum(angles, axis=0, out=angles)
+
+    keyTimes = np.asarray(keyTimes, dtype=np.float64)
+    keyFrames = np.rint(fps * keyTimes).astype(np.int64)
+    flapFrames = np.rint(fps * steps * flapTime).astype(np.int64)
+
+    keys, cells = np.nonzero(steps)
+    startFrames = keyFrames[keys]
+    return FramePlan(cells, startFrames, startFrames + flapFrames[keys, cells], angles[keys, cells], angles[keys + 1, cells], keyTimes[keys] > 0.01,
+                     keys + firstKey)
+
+
+def replanFrames(plan, first, cellCount, characters, flapTime, fps, keyTimes, states):
+    # plan of time keys changed from index first on: the transitions of the time keys before are kept from the previous plan
+    count = int(np.searchsorted(plan.keyIndices, first))
+    # the drum angle only grows, the largest angle of a cell is its angle after the kept transitions
+    startAngles = np.zeros(cellCount, dtype=np.float64)
+    np.maximum.at(startAngles, plan.cells[:count], plan.angles[:count])
+    changed = planFrames(cellCount, characters, flapTime, fps, keyTimes[first:], states[first:], startAngles=startAngles, firstKey=first)
+    return FramePlan(*[np.concatenate((kept[:count], new)) for kept, new in zip(plan, changed)])
+
+
+def sortedKeyframes(plan):
+    # keyframes of all cells as flat arrays (cells, frames, values) sorted by cell and frame,
+    # later keys replace earlier ones on the same frame
+    count = len(plan.cells)
+    startMask = plan.keyStart
+    cells = np.concatenate((plan.cells[startMask], plan.cells))
+    frames = np.concatenate((plan.startFrames[startMask], plan.endFrames))
+    values = np.concatenate((plan.startAngles[startMask], plan.angles))
+    # insertion order: start key of a transition before its end key
+    order = np.concatenate((2 * np.nonzero(startMask)[0], 2 * np.arange(count) + 1))
+    sortIdx = np.lexsort((order, frames, cells))
+    cells, frames, values = cells[sortIdx], frames[sortIdx], values[sortIdx]
+    keep = np.ones(len(cells), dtype=bool)
+    keep[:-1] = (cells[1:] != cells[:-1]) | (frames[1:] != frames[:-1])
+    return cells[keep], frames[keep], values[keep]
+
+
+def compactKeyframes(cells, frames, values, tolerance=1e-6):
+    # drop the keyframes linear interpolation between their neighbours of the same cell reproduces
+    # (keys in the middle of a hold, between adjacent transitions of the same speed), input as from sortedKeyframes
+    keep = np.ones(len(cells), dtype=bool)
+    while True:
+        idx = np.flatnonzero(keep)
+        if len(idx) < 3:
+            break
+        c = cells[idx]
+        f = frames[idx].astype(np.float64)
+        v = values[idx]
+        inner = (c[:-2] == c[1:-1]) & (c[1:-1] == c[2:])
+        expected = v[:-2] + (v[2:] - v[:-2]) * (f[1:-1] - f[:-2]) / np.where(inner, f[2:] - f[:-2], 1.)
+        redundant = inner & (np.abs(v[1:-1] - expected) <= tolerance)
+        if not redundant.any():
+            break
+        # a key is only checked against kept neighbours: drop every other key of a run of redundant keys per pass
+        pos = np.arange(len(redundant))
+        runStart = redundant.copy()
+        runStart[1:] &= ~redundant[:-1]
+        startPos = np.maximum.accumulate(np.where(runStart, pos, 0))
+        keep[idx[1:-1][redundant & ((pos - startPos) % 2 == 0)]] = False
+    return cells[keep], frames[keep], values[keep]
+
+
+def cellKeyframes(plan, compact=False):
+    # yield (cell, frames, values) with the keyframes of every animated cell sorted by frame
+    # compact: without the keyframes linear interpolation reproduces
+    if len(plan.cells) == 0:
+        return
+    keys = sortedKeyframes(plan)
+    yield from splitKeyframes(*(compactKeyframes(*keys) if compact else keys))
+
+
+def splitKeyframes(cells, frames, values):
+    # yield (cell, frames, values) per cell of flat keyframe arrays as from sortedKeyframes
+    if len(cells) == 0:
+        return
+    bounds = np.flatnonzero(np.diff(cells)) + 1
+    for cellFrames, cellValues, cell in zip(np.split(frames, bounds), np.split(values, bounds), cells[np.concatenate(([0], bounds))]):
+        yield int(cell), cellFrames, cellValues
+
+
+def holdKeyframes(values, tolerance=1e-6):
+    # keyframes followed by a keyframe of the same value, constant interpolation is enough for them
+    hold = np.zeros(len(values), dtype=bool)
+    hold[:-1] = np.abs(np.diff(values)) <= tolerance
+    return hold
+
+
+def updateKeyframes(oldKeys, plan, cellCount, fromFrame, compact=False):
+    # keyframes of a plan whose transitions only changed from frame fromFrame on, oldKeys: the keyframes of the previous plan
+    # (flat arrays as from sortedKeyframes/compactKeyframes). Every cell keeps its old keyframes up to the last one before
+    # fromFrame (the anchor), only the transitions reaching behind the anchor are turned into keyframes again.
+    # returns the new flat keyframes and the (cell, first, oldCount, frames, values) of the cells whose keyframes changed,
+    # first: index of the first keyframe which may differ, oldCount: number of keyframes of the cell before
+    oldCells, oldFrames, oldValues = oldKeys
+    bounds = np.searchsorted(oldCells, np.arange(cellCount + 1))
+    before = np.bincount(oldCells[oldFrames < fromFrame], minlength=cellCount)[:cellCount]
+    hasAnchor = before > 0
+    anchor = bounds[:-1] + before - 1
+    anchorCells = np.flatnonzero(hasAnchor)
+    anchorFrames = np.full(cellCount, np.iinfo(np.int64).min, dtype=np.int64)
+    anchorFrames[anchorCells] = oldFrames[anchor[anchorCells]]
+
+    # new keyframes from the anchor on, the anchor itself is kept by the compaction as the first keyframe of the cell
+    window = plan.endFrames > anchorFrames[plan.cells]
+    cells, frames, values = sortedKeyframes(FramePlan(*[field[window] for field in plan]))
+    later = frames > anchorFrames[cells]
+    tail = mergeKeyframes((anchorCells, anchorFrames[anchorCells], oldValues[anchor[anchorCells]]), (cells[later], frames[later], values[later]), cellCount)
+    if compact:
+        tail = compactKeyframes(*tail)
+
+    # compare the old and new keyframes from the anchor on
+    tailStart = np.where(hasAnchor, anchor, bounds[:-1])
+    oldTail = np.arange(len(oldCells)) >= tailStart[oldCells]
+    oldCount = np.diff(bounds)
+    changed = oldCount - (tailStart - bounds[:-1]) != np.bincount(tail[0], minlength=cellCount)[:cellCount]
+    sameOld = oldTail & ~changed[oldCells]
+    sameNew = ~changed[tail[0]]
+    differs = (oldFrames[sameOld] != tail[1][sameNew]) | ~np.isclose(oldValues[sameOld], tail[2][sameNew])
+    changed[oldCells[sameOld][differs]] = True
+
+    # merge the kept old keyframes with the new ones
+    newKeys = mergeKeyframes((oldCells[~oldTail], oldFrames[~oldTail], oldValues[~oldTail]), tail, cellCount)
+    newBounds = np.searchsorted(newKeys[0], np.arange(cellCount + 1))
+    changes = []
+    for cell in np.flatnonzero(changed):
+        start, end = newBounds[cell], newBounds[cell + 1]
+        # the anchor is unchanged, only the keyframes after it may differ
+        first = int(tailStart[cell] - bounds[cell] + hasAnchor[cell])
+        changes.append((int(cell), first, int(oldCount[cell]), newKeys[1][start:end], newKeys[2][start:end]))
+    return newKeys, changes
+
+
+def mergeKeyframes(head, tail, cellCount):
+    # flat keyframes sorted by cell of two parts, the keyframes of head come before the ones of tail in every cell
+    headCount = np.bincount(head[0], minlength=cellCount)[:cellCount]
+    tailCount = np.bincount(tail[0], minlength=cellCount)[:cellCount]
+    bounds = np.concatenate(([0], np.cumsum(headCount + tailCount)))
+    headPos = bounds[head[0]] + np.arange(len(head[0])) - np.concatenate(([0], np.cumsum(headCount)))[head[0]]
+    tailPos = bounds[tail[0]] + headCount[tail[0]] + np.arange(len(tail[0])) - np.concatenate(([0], np.cumsum(tailCount)))[tail[0]]
+    result = []
+    for headField, tailField in zip(head, tail):
+        merged = np.empty(bounds[-1], dtype=np.result_type(headField, tailField))
+        merged[headPos] = headField
+        merged[tailPos] = tailField
+        result.append(merged)
+    return tuple(result)
+
+
+def keyFingerprints(keys, cellCount):
+    # hash of the keyframes of every cell to find the changed cells of the next apply without storing the keyframes:
+    # the sum of a hash of every keyframe (the frames of a cell are unique), 0 for cells without keyframes
+    cells, frames, values = keys
+    result = np.zeros(cellCount, dtype=np.uint64)
+    if len(cells) == 0:
+        return result
+    h = frames.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) ^ np.rint(values * 1e6).astype(np.int64).view(np.uint64)
+    # splitmix64 finalizer
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    h ^= h >> np.uint64(31)
+    starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+    result[cells[starts]] = np.add.reduceat(h, starts)
+    return result
+
+
+def storeFingerprints(container, fingerprints, prefix="SplitFlapApplied"):
+    # custom properties of Blender IDs only hold 32 bit integers
+    container["%s.fingerprints" % prefix] = fingerprints.view(np.int32).tolist()
+
+
+def loadFingerprints(container, prefix="SplitFlapApplied"):
+    if "%s.fingerprints" % prefix not in container:
+        return None
+    return np.array(container["%s.fingerprints" % prefix], dtype=np.int32).view(np.uint64)
+
+
+def anglesAtFrame(plan, cellCount, frame):
+    # drum angle of every cell at the given frame, linear between start and end of a transition
+    if len(plan.cells) == 0:
+        return np.zeros(cellCount, dtype=np.float64)
+    duration = plan.endFrames - plan.startFrames
+    progress = np.clip((frame - plan.startFrames) / np.maximum(duration, 1), 0., 1.)
+    progress = np.where(duration > 0, progress, frame >= plan.endFrames)
+    # texts displayed from the beginning are only keyed at their end frame
+    progress = np.where(plan.keyStart, progress, 1.)
+    return np.bincount(plan.cells, weights=(plan.angles - plan.startAngles) * progress, minlength=cellCount)[:cellCount]
+
+
+def charactersAtFrame(plan, cellCount, charCount, frame):
+    # drum position of the character every cell shows at the given frame (the upper flap while the drum turns)
+    return angleCharacters(anglesAtFrame(plan, cellCount, frame), charCount)
+
+
+def angleCharacters(angles, charCount):
+    if charCount == 0:
+        return np.zeros(len(angles), dtype=np.int64)
+    return np.floor(angles / (2 * math.pi / charCount) + 1e-6).astype(np.int64) % charCount
+
+
+def frameLookup(plan):
+    # sort the transitions by cell and start frame once, such that a frame only needs the last transition started per cell
+    # texts displayed from the beginning count as started before the first frame
+    startFrames = np.where(plan.keyStart, plan.startFrames, np.iinfo(np.int64).min)
+    order = np.lexsort((startFrames, plan.cells))
+    sortedPlan = FramePlan(*[getattr(plan, field)[order] for field in FramePlan._fields])
+    if len(order) == 0:
+        return FrameLookup(sortedPlan, np.zeros(0, dtype=np.int64), 1, 0)
+    startFrames = startFrames[order]
+    started = sortedPlan.keyStart
+    first = int(startFrames[started].min()) - 1 if started.any() else 0
+    span = int(startFrames[started].max()) - first + 2 if started.any() else 1
+    keys = sortedPlan.cells * span + np.maximum(startFrames, first) - first
+    return FrameLookup(sortedPlan, keys, span, first)
+
+
+def lookupAngles(lookup, cellCount, frame):
+    # drum angle of every cell at the given frame like anglesAtFrame, from the last transition started per cell
+    # (a binary search per cell instead of a pass over all transitions, the switches of a cell must not overlap)
+    plan = lookup.plan
+    if len(plan.cells) == 0:
+        return np.zeros(cellCount, dtype=np.float64)
+    cells = np.arange(cellCount)
+    offset = int(np.clip(math.floor(frame) - lookup.first, 0, lookup.span - 1))
+    index = np.searchsorted(lookup.keys, cells * lookup.span + offset, side="right") - 1
+    valid = index >= 0
+    index = np.maximum(index, 0)
+    valid &= plan.cells[index] == cells
+    startFrames, endFrames = plan.startFrames[index], plan.endFrames[index]
+    duration = endFrames - startFrames
+    progress = np.clip((frame - startFrames) / np.maximum(duration, 1), 0., 1.)
+    progress = np.where(duration > 0, progress, frame >= endFrames)
+    progress = np.where(plan.keyStart[index], progress, 1.)
+    startAngles, angles = plan.startAngles[index], plan.angles[index]
+    return np.where(valid, startAngles + (angles - startAngles) * progress, 0.)
+
+
+def bakeAngleTrack(plan, cellCount, frameCount):
+    # drum angle of every cell for the frames 0 ... frameCount-1 (shape frames x cells), interpolated like the keyframes
+    track = np.zeros((frameCount, cellCount), dtype=np.float32)
+    frames = np.arange(frameCount, dtype=np.float64)
+    for cell, cellFrames, cellValues in cellKeyframes(plan):
+        if cell < cellCount:
+            track[:, cell] = np.interp(frames, cellFrames, cellValues)
+    return track
@@ -0,0 +1,60 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# 2D preview of a board: the characters shown at a time are composed from the tiles of the
+# character texture without evaluating the scene. This module must not import bpy.
+
+import os
+
+import numpy as np
+
+
+def atlasTiles(atlasPath, atlasColumns, atlasRows, tileHeight=40):
+    # tiles of the character texture scaled to the tile height (array tiles x height x width [x channels]),
+    # the texture is resized as a whole such that power of two atlases split into equal tiles
+    from PIL import Image
+    with Image.open(atlasPath) as im:
+        im = im.convert("L" if im.mode in ("L", "1") else "RGB")
+        tileWidth = max(1, round(tileHeight * im.size[0] * atlasRows / (im.size[1] * atlasColumns)))
+        pixels = np.asarray(im.resize((atlasColumns * tileWidth, atlasRows * tileHeight), Image.LANCZOS))
+    tiles = pixels.reshape((atlasRows, tileHeight, atlasColumns, tileWidth) + pixels.shape[2:]).swapaxes(1, 2)
+    return tiles.reshape((atlasRows * atlasColumns, tileHeight, tileWidth) + pixels.shape[2:])
+
+
+def composeBoard(tiles, positions, colCount):
+    # board image (array) of the drum positions row by row
+    rowCount = len(positions) // colCount
+    board = tiles[np.asarray(positions[:rowCount * colCount])].reshape((rowCount, colCount) + tiles.shape[1:])
+    return board.swapaxes(1, 2).reshape((rowCount * tiles.shape[1], colCount * tiles.shape[2]) + tiles.shape[3:])
+
+
+def previewTimes(start, end, step):
+    # times of an image sequence from start to end (included) every step seconds
+    if step <= 0 or end < start:
+        return [start]
+    return list(start + step * np.arange(int(np.floor((end - start) / step + 1e-9)) + 1))
+
+
+def renderPreview(timeline, times, fps, atlasPath, atlasColumns, atlasRows, colCount, output, tileHeight=40):
+    # save an image of the board for every time, output: file path with a %d placeholder for the image number
+    # for several times, consecutive equal states are composed once, returns the file paths
+    from PIL import Image
+    tiles = atlasTiles(atlasPath, atlasColumns, atlasRows, tileHeight=tileHeight)
+    directory = os.path.dirname(output)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    paths = []
+    lastPositions = None
+    image = None
+    for i, t in enumerate(times):
+        positions = timeline.positionsAt(t, fps)
+        if image is None or not np.array_equal(positions, lastPositions):
+            image = Image.fromarray(composeBoard(tiles, positions, colCount))
+            lastPositions = positions
+        path = output % i if "%" in output else output
+        image.save(path)
+        paths.append(path)
+    return paths
@@ -0,0 +1,138 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Reading timeline schedules (time, text, collection, extend, center) from CSV and
+# JSON files row by row. This module must not import bpy.
+
+import os
+import csv
+import json
+from collections import namedtuple
+
+ScheduleRow = namedtuple("ScheduleRow", ["line", "keyTime", "text", "collection", "extend", "center"])
+
+# accepted column names / object keys
+TIME_KEYS = ("time", "keyTime", "keytime", "t")
+TEXT_KEYS = ("text",)
+COLLECTION_KEYS = ("collection", "collectionID", "collectionid")
+EXTEND_KEYS = ("extend",)
+CENTER_KEYS = ("center", "centre")
+TRUE_VALUES = ("1", "true", "yes", "y", "x")
+FALSE_VALUES = ("0", "false", "no", "n")
+MAX_RECORD_SIZE = 1 << 20 # longest JSON object of a schedule entry in characters
+
+
+class ScheduleError(ValueError):
+    def __init__(self, line, message):
+        super().__init__("line %d: %s" % (line, message))
+        self.line = line
+
+
+def readSchedule(path, extend=True, center=False, chunkSize=1 << 16):
+    # yield the rows of a CSV or JSON schedule file one by one, the extend/center defaults apply to rows without these columns
+    # JSON files may contain an array of objects or one object per line
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if extension == ".csv":
+            records = ((reader.line_num, record) for reader in [csv.DictReader(f)] for record in reader)
+        elif extension in (".json", ".jsonl", ".ndjson"):
+            records = iterJSONObjects(f, chunkSize)
+        else:
+            raise ScheduleError(0, "unknown schedule format '%s'" % extension)
+        for line, record in records:
+            yield parseRecord(line, record, extend, center)
+
+
+def iterJSONObjects(f, chunkSize=1 << 16, maxRecordSize=MAX_RECORD_SIZE):
+    # yield (line, object) for the objects of a top level array or of JSON lines without loading the whole file
+    decoder = json.JSONDecoder()
+    buffer = ""
+    line = 1
+    pos = 0
+    eof = False
+    while True:
+        # skip separators between the objects
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,[]":
+            if buffer[pos] == "\n":
+                line += 1
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                return
+            buffer = f.read(chunkSize)
+            pos = 0
+            eof = len(buffer) == 0
+            continue
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            # an object cut at the end of the buffer fails at its last token: an unterminated string or the start of a cut
+            # literal, number or escape. Other errors (also any before a line break, strings do not contain line breaks)
+            # are not resolved by reading further
+            cut = e.msg.startswith("Unterminated string") or len(buffer) - e.pos < 16
+            if eof or not cut or buffer.find("\n", e.pos) >= 0:
+                raise ScheduleError(line + buffer.count("\n", pos, e.pos), "invalid JSON: %s" % e.msg)
+            if len(buffer) - pos > maxRecordSize:
+                raise ScheduleError(line, "schedule entry longer than %d characters" % maxRecordSize)
+            # object continues in the next chunk
+            chunk = f.read(chunkSize)
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            eof = len(chunk) == 0
+            continue
+        if not isinstance(obj, dict):
+            raise ScheduleError(line, "expected an object per schedule entry")
+        yield line, obj
+        line += buffer.count("\n", pos, end)
+        pos = end
+
+
+def parseRecord(line, record, extend=True, center=False):
+    keyTime = parseTime(line, getField(record, TIME_KEYS))
+    text = getField(record, TEXT_KEYS)
+    if text is None:
+        raise ScheduleError(line, "missing text")
+    collection = getField(record, COLLECTION_KEYS)
+    return ScheduleRow(line, keyTime, str(text), str(collection) if collection else None,
+                       parseBool(line, getField(record, EXTEND_KEYS), extend), parseBool(line, getField(record, CENTER_KEYS), center))
+
+
+def getField(record, keys):
+    for key in keys:
+        if key in record and record[key] is not None:
+            return record[key]
+    return None
+
+
+def parseTime(line, value):
+    # seconds as number or clock time [hh:]mm:ss[.f]
+    if value is None or value == "":
+        raise ScheduleError(line, "missing time")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        result = float(value)
+    else:
+        try:
+            result = 0.
+            for part in str(value).strip().split(":"):
+                result = 60 * result + float(part)
+        except ValueError:
+            raise ScheduleError(line, "invalid time '%s'" % value)
+    if result < 0:
+        raise ScheduleError(line, "negative time %.2f" % result)
+    return result
+
+
+def parseBool(line, value, default):
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ScheduleError(line, "invalid boolean '%s'" % value)
@@ -4,14 +4,21 @@
 # This source code is licensed under the MIT-style license found in the
 # LICENSE file in the same directory of this source tree.
 import bpy
-from .texture import getFonts
+from .timeline import formatText
+
+_fontItems = []
+_fontItemsVersion = None
 
 def flapSettings_getFonts(scene, context):
-    items = []
-    fonts = getFonts()
-    for fontName, fontPath in fonts:
-        items.append((fontPath, fontName, "available font"))
-    return items
+    # memoized between redraws, Blender also needs a reference to the enum items to be kept
+    global _fontItems, _fontItemsVersion
+    from .texture import getFontIndex
+    fontIndex = getFontIndex()
+    fontIndex.refresh()
+    if _fontItemsVersion != fontIndex.version:
+        _fontItems = [(fontPath, fontName, "available font") for fontName, fontPath in fontIndex.fonts]
+        _fontItemsVersion = fontIndex.version
+    return _fontItems
 
 def flapAnimation_updateDisplay(self, context):
     index = self.splitFlapAnimationIndex
@@ -37,6 +44,8 @@ def flapKeySettings_evalText(self, context):
     if self.collection is not None:
         colCount = self.collection["SplitFlapSettings.colCount"]
         rowCount = self.collection["SplitFlapSettings.rowCount"]
+        # length of the text as displayed, the normalizer is cached per collection settings
+        textLen = len(formatText(self.text, self.collection["SplitFlapSettings.characters"], colCount))
         maxLen = colCount * rowCount
         if textLen == maxLen:
             context.scene.textStatusMessage = "Complete"
@@ -147,6 +156,33 @@ class SplitFlapSettings(bpy.types.PropertyGroup):
         description = "Create a frame shape to house the flaps",
         default = False
     )
+    boardMode : bpy.props.EnumProperty(
+        name="Board mode",
+        description="Representation of the split flap items in the scene",
+        items=[
+            ('OBJECTS', "Objects", "One object per split flap item"),
+            ('INSTANCES', "Instances", "A single board object instancing the split flap item on every cell (for large boards)")
+        ],
+        default='OBJECTS'
+    )
+    atlasLayout : bpy.props.EnumProperty(
+        name="Atlas layout",
+        description="Arrangement of the character tiles in the texture",
+        items=[
+            ('SQUARE', "Square", "Square grid of character tiles in their native size"),
+            ('POWER_OF_TWO', "Power of two", "Tile grid fitting a nearly square power of two texture, scaled to its size")
+        ],
+        default='SQUARE'
+    )
+    atlasFormat : bpy.props.EnumProperty(
+        name="Atlas format",
+        description="Pixel format of the character texture",
+        items=[
+            ('RGB', "Colour", "Font and background colour are baked into the texture"),
+            ('MASK', "Mask", "Single channel glyph mask shared by all colours, the material applies font and background colour")
+        ],
+        default='RGB'
+    )
     
     
 class SplitFlapKeySettings(bpy.types.PropertyGroup):
@@ -175,7 +211,7 @@ class SplitFlapKeySettings(bpy.types.PropertyGroup):
         description = "Time in seconds when the flap starts switching to the target text",
         default = 5,
         min = 0,
-        max = 240
+        soft_max = 240
     )
     useTextInput : bpy.props.BoolProperty(
         name = "Use text input field",
@@ -6,102 +6,422 @@
 
 import os, sys
 import math
-from PIL import Image, ImageDraw, ImageFont
+import json
+import time
+import hashlib
+import functools
+import multiprocessing
+import concurrent.futures
+
+# pillow is imported by the functions using it, such that the font index is available without loading it
 
 def initFontDir():
     result = None
     if sys.platform.startswith("win"):
         result = [os.path.join(os.environ['WINDIR'],'fonts')]
     elif sys.platform.startswith("linux"): 
-        result = ["/usr/share/fonts", "/usr/local/share/fonts"]
+        result = ["/usr/share/fonts", "/usr/local/share/fonts", os.path.expanduser("~/.local/share/fonts"), os.path.expanduser("~/.fonts")]
     elif sys.platform.startswith("darwin"):
-        result = ["/System/Library/Fonts", "/Library/Fonts"]
-    return result
+        result = ["/System/Library/Fonts", "/Library/Fonts", os.path.expanduser("~/Library/Fonts")]
+    return result if result is not None else []
+
+
+@functools.lru_cache(maxsize=32)
+def getFont(fontPath, size):
+    from PIL import ImageFont
+    return ImageFont.truetype(fontPath, size)
+
+
+@functools.lru_cache(maxsize=8192)
+def getGlyphBox(fontPath, size, glyph):
+    # bounding box of the rendered glyph mask, None for empty glyphs
+    return getFont(fontPath, size).getmask(glyph).getbbox()
 
 
-def createCharactersTexture(charSpace=(120,200), characters="ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-+.?! ", fontPath="bahnschrift.ttf", color="white", background="black", output="characters.png", fontFactorWidth=0.7, fontFactorHeight=0.65, itemsPerSide=None):
-    if itemsPerSide is None:
-        itemsPerSide = math.ceil(math.sqrt(len(characters)))
-    imgSize = (charSpace[0]*itemsPerSide, charSpace[1]*itemsPerSide)
+def fitFontSize(fontPath, characters, targetSize, minSize=40, increment=2, maxIt=100):
+    # smallest font size of the series minSize + k*increment where the widest character reaches the target size
+    charWidths = []
+    for character in characters:
+        box = getGlyphBox(fontPath, minSize, character) if character != ' ' else None
+        charWidths.append(box[2] - box[0] if box is not None else 0)
+    if len(charWidths) == 0 or max(charWidths) == 0:
+        return minSize
+    widestChar = characters[charWidths.index(max(charWidths))]
+    
+    def reachesTarget(step):
+        bbox = getGlyphBox(fontPath, minSize + step*increment, widestChar)
+        return bbox is not None and (bbox[2] >= targetSize[0] or bbox[3] >= targetSize[1])
+    
+    # bisection over the steps, the glyph size grows monotonically with the font size
+    low, high = 0, maxIt - 1
+    while low < high:
+        middle = (low + high) // 2
+        if reachesTarget(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return minSize + low*increment
+
+
+def glyphPlacement(draw, character, font, charSpace):
+    # top left position to center the character in its tile and the bounding box of the glyph in the tile (if known)
+    box = None
+    deprecatedSize = getattr(draw, "textsize", None) is None # pillow API change in v.10
+    if deprecatedSize:
+        left, top, right, bottom = draw.textbbox((0,0), character, font=font)
+        # print("left %.0f top %.0f right %.0f bottom %.0f" % (left, top, right, bottom))
+        textWidth = right - left
+        textHeight = bottom - top
+    else:
+        textWidth, textHeight = draw.textsize(character, font=font)
+    position = (0.5*charSpace[0] - 0.5*textWidth, 0.5*charSpace[1] - 0.5*textHeight)
+    if deprecatedSize:
+        box = (position[0] + left, position[1] + top, position[0] + right, position[1] + bottom)
+    return position, box
+
+
+def renderCharacterTile(character, font, charSpace, color, background, mode="RGB"):
+    from PIL import Image, ImageDraw
+    imChar = Image.new(mode, charSpace, color=background)
+    dChar = ImageDraw.Draw(imChar)
+    position, box = glyphPlacement(dChar, character, font, charSpace)
+    dChar.text(position, character, color, font)
+    return imChar
+
+
+def renderTileChunk(fontPath, fontSize, charSpace, characters, color, background, mode="RGB"):
+    # worker function of the parallel rasterization, returns the raw tile data
+    font = getFont(fontPath, fontSize)
+    return [renderCharacterTile(c, font, charSpace, color, background, mode).tobytes() for c in characters]
+
+
+# run by the spawned workers before the tasks are unpickled: the addon package (and the packages above it) is registered
+# as a bare module such that this bpy free module can be imported without running the package __init__ which imports bpy
+WORKER_INIT = """import sys, types
+names = %r
+for i, name in enumerate(names):
+    if name not in sys.modules:
+        package = types.ModuleType(name)
+        package.__path__ = [%r] if i == len(names) - 1 else []
+        sys.modules[name] = package
+"""
+
+
+def renderTilesParallel(fontPath, fontSize, charSpace, characters, color, background, workers, mode="RGB"):
+    # rasterize the character tiles in a process pool, None if the pool cannot be used
+    chunkSize = max(1, math.ceil(len(characters) / (4*workers)))
+    chunks = [characters[i:i+chunkSize] for i in range(0, len(characters), chunkSize)]
+    count = len(chunks)
+    # forking Blender can deadlock on the locks held by its threads, the workers are started as fresh interpreters instead
+    mpContext = multiprocessing.get_context("spawn")
+    packageNames = []
+    if __package__:
+        parts = __package__.split(".")
+        packageNames = [".".join(parts[:i+1]) for i in range(len(parts))]
+    workerInit = WORKER_INIT % (packageNames, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=mpContext, initializer=exec, initargs=(workerInit, {})) as executor:
+            results = executor.map(renderTileChunk, [fontPath]*count, [fontSize]*count, [charSpace]*count, chunks, [color]*count, [background]*count, [mode]*count)
+            return [tile for chunk in results for tile in chunk]
+    except (OSError, concurrent.futures.process.BrokenProcessPool) as e:
+        print("Parallel rasterization failed (%s), continue in a single process" % str(e))
+    return None
+
+
+def atlasLayout(count, charSpace=(120,200), powerOfTwo=False, maxSize=16384):
+    # tile columns, tile rows and image size of the character atlas
+    # default: square grid of ceil(sqrt(count)) tiles; powerOfTwo: the grid whose power of two image (each side rounded from
+    # its native size) is closest to square and scales the tiles least unevenly, then the smallest image and the fewest unused tiles
+    if not powerOfTwo:
+        itemsPerSide = math.ceil(math.sqrt(count))
+        return itemsPerSide, itemsPerSide, (charSpace[0]*itemsPerSide, charSpace[1]*itemsPerSide)
+    best = None
+    for cols in range(1, max(count, 1) + 1):
+        rows = math.ceil(count / cols)
+        size = (cols*charSpace[0], rows*charSpace[1])
+        imgSize = tuple(min(maxSize, 2**max(0, round(math.log2(length)))) for length in size)
+        scale = [math.log2(imgSize[i] / size[i]) for i in range(2)]
+        # strips of tiles give long thin images, uneven scaling distorts the glyphs and shrinking loses detail
+        distortion = abs(math.log2(imgSize[0] / imgSize[1])) + abs(scale[0] - scale[1]) + max(0., -min(scale))
+        cost = (round(distortion, 1), imgSize[0]*imgSize[1], cols*rows - count)
+        if best is None or cost < best[0]:
+            best = (cost, cols, rows, imgSize)
+    cost, cols, rows, imgSize = best
+    return cols, rows, imgSize
+
+
+def createCharactersTexture(charSpace=(120,200), characters="ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-+.?! ", fontPath="bahnschrift.ttf", color="white", background="black", output="characters.png", fontFactorWidth=0.7, fontFactorHeight=0.65, itemsPerSide=None, renderMode="DIRECT", workers=0, layout=None, mask=False):
+    # renderMode DIRECT draws the glyphs straight into the texture where they fit into their tile, TILES renders every character
+    # into a separate tile image first. workers > 1 rasterizes the tiles in a process pool. All variants give the same image.
+    # layout: (columns, rows, image size) as from atlasLayout, the tiles are rendered in charSpace and scaled to the image size
+    # mask: single channel image with white glyphs on black, color and background are applied by the material
+    from PIL import Image, ImageDraw
+    if layout is None:
+        if itemsPerSide is None:
+            itemsPerSide = math.ceil(math.sqrt(len(characters)))
+        layout = (itemsPerSide, itemsPerSide, (charSpace[0]*itemsPerSide, charSpace[1]*itemsPerSide))
+    itemsPerSide, rowCount, outputSize = layout
+    imgSize = (charSpace[0]*itemsPerSide, charSpace[1]*rowCount)
+    mode = "L" if mask else "RGB"
+    if mask:
+        color, background = 255, 0
     
     # create the img
-    im = Image.new("RGB", imgSize, color=background)
+    im = Image.new(mode, imgSize, color=background)
     
     # define the character size and the base line (should be at max .75 of charSpace height, tested on zero = 0)
     targetSize = (int(fontFactorWidth*charSpace[0]), int(fontFactorHeight*charSpace[1]))
-    charSize = 40
-    increment = 2
-    maxIt = 100
-    i = 0
-    font = None
-    
-    # get the widest character
-    font = ImageFont.truetype(fontPath, charSize)
-    charWidths = [(font.getmask(character).getbbox())[2] - (font.getmask(character).getbbox())[0] if character != ' ' else 0 for character in characters]
-    widestChar = characters[charWidths.index(max(charWidths))]
-    
-    while i < maxIt:
-        font = ImageFont.truetype(fontPath, charSize)
-        bbox = font.getmask(widestChar).getbbox()
-        currentSize = (bbox[2], bbox[3])
-        # ending criterion 
-        if currentSize[0]-targetSize[0]>=0 or currentSize[1]-targetSize[1]>=0:
-            #print("Stop char heuristic: %s target size %s actual size %s" % (widestChar, str(targetSize), str(currentSize)))
-            break
-        charSize += increment
-        i += 1
+    fontSize = fitFontSize(fontPath, characters, targetSize)
+    font = getFont(fontPath, fontSize)
+    tiles = None
+    if workers > 1 and len(characters) > 1:
+        tiles = renderTilesParallel(fontPath, fontSize, charSpace, characters, color, background, workers, mode)
 
     # type
-    i = 0
     d = ImageDraw.Draw(im)
-    deprecatedSize = getattr(d, "textsize", None) is None # pillow API change in v.10
-    for c in characters:
-        imChar = Image.new("RGB", charSpace, color=background)
-        dChar = ImageDraw.Draw(imChar)
-        if deprecatedSize:
-            left, top, right, bottom = dChar.textbbox((0,0), c, font=font)
-            # print("left %.0f top %.0f right %.0f bottom %.0f" % (left, top, right, bottom))
-            textWidth = right - left
-            textHeight = bottom - top
-        else:
-            textWidth, textHeight = dChar.textsize(c, font=font)
-        dChar.text((0.5*charSpace[0] - 0.5*textWidth, 0.5*charSpace[1] - 0.5*textHeight), c, color, font)
+    for i, c in enumerate(characters):
         col = i % itemsPerSide
         row = int(i/itemsPerSide)
         boundaries = [col*charSpace[0], row*charSpace[1], (col+1)*charSpace[0], (row+1)*charSpace[1]]
         d.rectangle(boundaries, fill=background, outline=color)
-        im.paste(imChar, (boundaries[0], boundaries[1]))
-        i += 1
+        if tiles is not None:
+            im.paste(Image.frombytes(mode, charSpace, tiles[i]), (boundaries[0], boundaries[1]))
+            continue
+        position, box = glyphPlacement(d, c, font, charSpace)
+        # a glyph reaching the tile border would be clipped by the tile image
+        fitsTile = box is not None and box[0] >= 1 and box[1] >= 1 and box[2] <= charSpace[0] - 1 and box[3] <= charSpace[1] - 1
+        if renderMode == "DIRECT" and fitsTile:
+            # remove the outline inside the own tile as pasting the tile would do
+            d.rectangle([boundaries[0], boundaries[1], boundaries[2] - 1, boundaries[3] - 1], fill=background)
+            d.text((boundaries[0] + position[0], boundaries[1] + position[1]), c, color, font)
+        else:
+            im.paste(renderCharacterTile(c, font, charSpace, color, background, mode), (boundaries[0], boundaries[1]))
 
     # save
+    if tuple(outputSize) != imgSize:
+        im = im.resize(tuple(outputSize), Image.LANCZOS)
     im.save(output)
 
 
+def getTextureKey(textureInputs):
+    # content hash of all inputs of createCharactersTexture, the font file is identified by path, size and modification time
+    fontPath = textureInputs.get("fontPath")
+    fontStat = os.stat(fontPath) if fontPath is not None and os.path.exists(fontPath) else None
+    content = dict(textureInputs)
+    content["fontFile"] = (fontStat.st_size, fontStat.st_mtime_ns) if fontStat is not None else None
+    serialized = json.dumps(content, sort_keys=True, default=list)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()[:16]
+
+
+class TextureCache:
+    # content addressed texture files in a directory, indexed by a json file with their last use and the blend files
+    # using them: key -> {"used": time, "owners": [blend file names]}. Several blend files may share the directory,
+    # a texture is only deleted when no other blend file has used it.
+    indexFile = "FlapCharacters.json"
+
+    def __init__(self, directory, prefix="FlapCharacters", maxEntries=8, owner=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.maxEntries = maxEntries
+        self.owner = owner # name of the blend file using the cache
+        self.entries = {}
+        indexPath = os.path.join(self.directory, self.indexFile)
+        if os.path.exists(indexPath):
+            try:
+                with open(indexPath, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                print("Could not read the texture cache index %s" % indexPath)
+        for key, entry in self.entries.items():
+            # entries of older indices (last use only) may be used by any blend file of the directory
+            if not isinstance(entry, dict):
+                self.entries[key] = {"used" : entry, "owners" : None}
+
+    def fileName(self, key):
+        return "%s_%s.png" % (self.prefix, key)
+
+    def path(self, key):
+        return os.path.join(self.directory, self.fileName(key))
+
+    def lookup(self, key):
+        # path of the cached texture or None
+        if key not in self.entries or not os.path.exists(self.path(key)):
+            return None
+        self.store(key)
+        return self.path(key)
+
+    def store(self, key):
+        entry = self.entries.setdefault(key, {"used" : 0., "owners" : []})
+        entry["used"] = time.time()
+        if self.owner is not None and entry["owners"] is not None and self.owner not in entry["owners"]:
+            entry["owners"].append(self.owner)
+        self.save()
+
+    def evict(self, inUse=()):
+        # delete the least recently used textures beyond the maximum count which are not in use by this blend file
+        # and have not been used by another one, the others only lose this blend file as owner
+        candidates = sorted(self.entries.keys(), key=lambda key: self.entries[key]["used"], reverse=True)
+        removed = []
+        changed = False
+        for key in candidates[self.maxEntries:]:
+            if self.fileName(key) in inUse:
+                continue
+            owners = self.entries[key]["owners"]
+            if owners is not None and self.owner in owners:
+                owners.remove(self.owner)
+                changed = True
+            if owners is None or len(owners) > 0:
+                continue
+            try:
+                if os.path.exists(self.path(key)):
+                    os.remove(self.path(key))
+            except OSError:
+                print("Could not remove the cached texture %s" % self.path(key))
+                continue
+            del self.entries[key]
+            removed.append(key)
+        if changed or len(removed) > 0:
+            self.save()
+        return removed
+
+    def save(self):
+        try:
+            with open(os.path.join(self.directory, self.indexFile), "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+        except OSError:
+            print("Could not write the texture cache index in %s" % self.directory)
+
+
 def findFont(name):
     if os.path.isabs(name): # is already an absolute path
         return name
-    if not "." in name:
-        name = name + ".ttf"
-    testNames = (name, name.lower())
-    fonts = getFonts()
-    for fontName, fontPath in fonts:
-        if fontName in testNames:
-            # test for TrueType:
-            try:
-                testFont = ImageFont.truetype(fontPath, 15)
-            except OSError:
-                return None
-            return fontPath
+    fontPath = getFontIndex().find(name)
+    if fontPath is not None:
+        # test for TrueType:
+        try:
+            getFont(fontPath, 15)
+        except OSError:
+            return None
+        return fontPath
     print("Could not find font %s" % name)
     return None
 
 
 def getFonts():
-    result = []
-    for directory in OS_FontsDir:
-        for root, dirNames, fileNames in os.walk(directory):
-           result.extend([(f.split('.')[0], os.path.join(root, f)) for f in fileNames if f.endswith(".ttf")])
-    return result
+    return getFontIndex().fonts
+
+
+def initCacheDir():
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    elif sys.platform.startswith("darwin"):
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "splitflap")
+
+
+class FontIndex:
+    # font files of the font directories, stored on disk and rebuilt only if a directory has been modified
+    extensions = (".ttf", ".otf", ".ttc")
+    formatVersion = 1
+
+    def __init__(self, directories, cachePath=None, checkInterval=5.):
+        self.directories = [directory for directory in directories if os.path.isdir(directory)]
+        self.cachePath = cachePath
+        self.checkInterval = checkInterval
+        self.fonts = [] # (name, path) like getFonts used to return
+        self.byName = {}
+        self.dirTimes = {}
+        self.version = 0 # increases with every rebuild
+        self.lastCheck = 0.
+        if not self.load() or not self.isValid():
+            self.build()
+
+    def load(self):
+        if self.cachePath is None or not os.path.exists(self.cachePath):
+            return False
+        try:
+            with open(self.cachePath, "r", encoding="utf-8") as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if content.get("formatVersion") != self.formatVersion or content.get("directories") != self.directories:
+            return False
+        self.dirTimes = content["dirTimes"]
+        self.setFonts([tuple(entry) for entry in content["fonts"]])
+        return True
+
+    def save(self):
+        if self.cachePath is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cachePath), exist_ok=True)
+            with open(self.cachePath, "w", encoding="utf-8") as f:
+                json.dump({"formatVersion" : self.formatVersion, "directories" : self.directories, "dirTimes" : self.dirTimes, "fonts" : self.fonts}, f)
+        except OSError:
+            print("Could not write the font index %s" % self.cachePath)
+
+    def isValid(self):
+        # adding or removing a file or folder changes the modification time of the parent directory
+        for directory, mtime in self.dirTimes.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def build(self):
+        fonts = []
+        self.dirTimes = {}
+        for directory in self.directories:
+            for root, dirNames, fileNames in os.walk(directory):
+                try:
+                    self.dirTimes[root] = os.stat(root).st_mtime_ns
+                except OSError:
+                    continue
+                fonts.extend([(f.split('.')[0], os.path.join(root, f)) for f in fileNames if f.lower().endswith(self.extensions)])
+        fonts.sort(key=lambda font: (font[0].lower(), font[1]))
+        self.setFonts(fonts)
+        self.save()
+
+    def setFonts(self, fonts):
+        self.fonts = fonts
+        self.byName = {}
+        for fontName, fontPath in fonts:
+            fileName = os.path.basename(fontPath)
+            for key in (fontName, fontName.lower(), fileName, fileName.lower()):
+                self.byName.setdefault(key, fontPath)
+        self.version += 1
+
+    def refresh(self, force=False):
+        # rebuild if a font directory has changed, checked at most every checkInterval seconds
+        now = time.monotonic()
+        if not force and now - self.lastCheck < self.checkInterval:
+            return False
+        self.lastCheck = now
+        if self.isValid():
+            return False
+        self.build()
+        return True
+
+    def find(self, name):
+        self.refresh()
+        for key in (name, name.lower(), os.path.splitext(name)[0], os.path.splitext(name)[0].lower()):
+            if key in self.byName:
+                return self.byName[key]
+        return None
+
+
+_fontIndex = None
+
+def getFontIndex():
+    global _fontIndex
+    if _fontIndex is None:
+        _fontIndex = FontIndex(OS_FontsDir, cachePath=os.path.join(initCacheDir(), "fontindex.json"))
+    return _fontIndex
+
 
 OS_FontsDir = initFontDir()
 
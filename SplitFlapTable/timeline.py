@@ -0,0 +1,354 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Timeline engine: resolves the board state after every time key of a split flap
+# collection in a single forward pass and caches the result. This module must not
+# import bpy.
+
+import bisect
+import functools
+import unicodedata
+
+import numpy as np
+
+from .planner import charIndices
+
+# time keys closer than this are considered duplicates
+DUPLICATE_TOLERANCE = 0.1
+
+
+def resolveString(formattedText, length, extend, center, previous):
+    textLen = len(formattedText)
+    if textLen >= length:
+        return formattedText[:length]
+    if center:
+        indent = (length - textLen)//2
+        remainder = length - indent - textLen
+        return " " * indent + formattedText + " " * remainder
+    elif extend:
+        return formattedText + " " * (length - textLen)
+    return formattedText + previous[textLen:]
+
+
+UNKNOWN_CODE = 0xFFFFFFFF
+DROP_CODE = 0xFFFFFFFE
+
+
+class TranslationTable(dict):
+    # character code -> drum character (None: drop), filled on first use of a character
+    def __init__(self, characters):
+        super().__init__()
+        self.characters = characters
+        self.drumSet = set(characters)
+        self.fallback = ' ' if ' ' in self.drumSet else None
+        self[ord("\n")] = None
+        self[ord("\r")] = None
+
+    def __missing__(self, code):
+        char = chr(code)
+        result = self.lookup(char)
+        if result is None:
+            # accent folding: try the base character (e.g. 'ä' -> 'a' -> 'A' if the drum lacks umlauts)
+            base = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+            result = self.lookup(base) if len(base) == 1 else None
+        if result is None:
+            result = self.fallback
+        self[code] = result
+        return result
+
+    def lookup(self, char):
+        for candidate in (char, char.lower(), char.upper()):
+            if candidate in self.drumSet:
+                return candidate
+        return None
+
+
+class TextNormalizer:
+    # converts texts to the characters available on the drum in linear time, one instance per
+    # character set and row length (see getTextNormalizer)
+
+    def __init__(self, characters, colCount=None):
+        self.characters = characters
+        self.colCount = colCount
+        self.fillLines = colCount is not None and colCount > 0 and ' ' in characters
+        self.table = TranslationTable(characters)
+        self.codeMap = np.full(0x10000, UNKNOWN_CODE, dtype=np.uint32) # translation of the table as array
+
+    def normalize(self, text):
+        text = text.replace("\r", "")
+        if self.fillLines and "\n" in text:
+            text = self.fill(text)
+        if text.isascii(): # str.translate has a fast path for ASCII
+            return text.translate(self.table)
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        if codes.max() >= len(self.codeMap): # beyond the basic multilingual plane
+            return text.translate(self.table)
+        mapped = self.codeMap[codes]
+        unknown = mapped == UNKNOWN_CODE
+        if unknown.any():
+            for code in np.unique(codes[unknown]).tolist():
+                result = self.table[code]
+                self.codeMap[code] = DROP_CODE if result is None else ord(result)
+            mapped = self.codeMap[codes]
+        return mapped[mapped != DROP_CODE].tobytes().decode("utf-32-le")
+
+    def fill(self, text):
+        # replace every line break by the space characters to complete the row (a whole row at the row start),
+        # every line starts at the beginning of a row such that the padding only depends on the line length
+        lines = text.split("\n")
+        colCount = self.colCount
+        return "".join([line + " " * (colCount - len(line) % colCount) for line in lines[:-1]]) + lines[-1]
+
+
+@functools.lru_cache(maxsize=64)
+def getTextNormalizer(characters, colCount=None):
+    return TextNormalizer(characters, colCount)
+
+
+def formatText(text, characters, colCount=None):
+    # convert the text to the characters available on the drum, line breaks fill the row with space characters
+    return getTextNormalizer(characters, colCount).normalize(text)
+
+
+class Timeline:
+    # entries are tuples (keyTime, formattedText, extend, center) sorted by keyTime
+
+    def __init__(self, cellCount, characters, flapTime):
+        self.cellCount = cellCount
+        self.characters = characters
+        self.flapTime = flapTime
+        self.startString = characters[0] * cellCount if len(characters) > 0 else ""
+        self.entries = []
+        self.keyTimes = []
+        self.sources = [] # optional reference to the origin of every entry (e.g. the index in the UI list)
+        self._states = [] # resolved board strings, valid for the first len(self._states) entries
+        self._indices = [] # drum positions of the resolved board strings
+        self._shown = [] # drum positions the cells show after the switch (unknown characters keep the previous one)
+
+    def copy(self):
+        result = Timeline(self.cellCount, self.characters, self.flapTime)
+        result.entries = list(self.entries)
+        result.keyTimes = list(self.keyTimes)
+        result.sources = list(self.sources)
+        result._states = list(self._states)
+        result._indices = list(self._indices)
+        result._shown = list(self._shown)
+        return result
+
+    def matches(self, cellCount, characters, flapTime):
+        return self.cellCount == cellCount and self.characters == characters and self.flapTime == flapTime
+
+    def invalidate(self, index):
+        # drop the cached states from the given entry onward
+        if index < len(self._states):
+            del self._states[index:]
+            del self._indices[index:]
+            del self._shown[index:]
+
+    def sync(self, entries, sources=None):
+        # replace the entries and keep the cached states up to the first difference
+        # the states only depend on the order of the entries, not on their time keys
+        entries = [tuple(entry) for entry in entries]
+        firstDiff = firstChange(entries, self.entries, withTimes=False)
+        self.invalidate(firstDiff)
+        self.entries = entries
+        self.keyTimes = [entry[0] for entry in entries]
+        self.sources = list(sources) if sources is not None else [None] * len(entries)
+        return firstDiff
+
+    def insert(self, entry, source=None):
+        index = bisect.bisect_right(self.keyTimes, entry[0])
+        self.entries.insert(index, tuple(entry))
+        self.keyTimes.insert(index, entry[0])
+        self.sources.insert(index, source)
+        self.invalidate(index)
+        return index
+
+    def remove(self, index):
+        del self.entries[index]
+        del self.keyTimes[index]
+        del self.sources[index]
+        self.invalidate(index)
+
+    def indexOfSource(self, source):
+        try:
+            return self.sources.index(source)
+        except ValueError:
+            return None
+
+    def findNear(self, keyTime, tolerance=DUPLICATE_TOLERANCE):
+        # index of an entry with a time key closer than the tolerance or None
+        index = bisect.bisect_left(self.keyTimes, keyTime - tolerance)
+        while index < len(self.keyTimes) and self.keyTimes[index] < keyTime + tolerance:
+            if round(abs(self.keyTimes[index] - keyTime), 6) < tolerance:
+                return index
+            index += 1
+        return None
+
+    def _resolveUntil(self, index):
+        # single forward pass from the last valid state
+        while len(self._states) <= index:
+            i = len(self._states)
+            previous = self._states[-1] if i > 0 else self.startString
+            keyTime, formattedText, extend, center = self.entries[i]
+            state = resolveString(formattedText, self.cellCount, extend, center, previous)
+            self._states.append(state)
+            indices = charIndices([state], self.characters, self.cellCount)[0]
+            self._indices.append(indices)
+            self._shown.append(np.where(indices >= 0, indices, self._shown[-1] if i > 0 else 0))
+
+    def state(self, index):
+        if index < 0:
+            return self.startString
+        self._resolveUntil(index)
+        return self._states[index]
+
+    def states(self):
+        if len(self.entries) > 0:
+            self._resolveUntil(len(self.entries) - 1)
+        return list(self._states)
+
+    def _shownPositions(self, index):
+        # drum positions after the switch to the entry, the initial state shows the first character
+        if index < 0:
+            return np.zeros(self.cellCount, dtype=np.int64)
+        self._resolveUntil(index)
+        return self._shown[index]
+
+    def positionsAt(self, time, fps):
+        # drum positions the cells show at the given time, also in the middle of a switch, with the frame rounding of
+        # the planner: the switches start at rint(fps*keyTime) and take rint(fps*steps*flapTime) frames. The positions
+        # after the last switch started minus the flaps still to come of the switches running (binary search, the states are cached)
+        charCount = len(self.characters)
+        frame = round(time * fps, 6)
+        # rint(fps*keyTime) <= frame implies keyTime <= (frame + 0.5) / fps
+        index = bisect.bisect_right(self.keyTimes, (frame + 0.5) / fps) - 1
+        while index >= 0 and np.rint(fps * self.keyTimes[index]) > frame:
+            index -= 1
+        if index < 0 and len(self.keyTimes) > 0 and self.keyTimes[0] <= 0.01:
+            index = 0 # displayed from the beginning
+        if index < 0 or charCount == 0:
+            return np.zeros(self.cellCount, dtype=np.int64)
+        self._resolveUntil(index)
+        shown = self._shown[index]
+        remaining = np.zeros(self.cellCount, dtype=np.float64)
+        # a switch takes at most charCount - 1 flaps, texts displayed from the beginning do not switch
+        maxFrames = np.rint(fps * (charCount - 1) * self.flapTime)
+        while index >= 0 and self.keyTimes[index] > 0.01 and frame < np.rint(fps * self.keyTimes[index]) + maxFrames:
+            previous = self._shown[index - 1] if index > 0 else 0
+            steps = (self._shown[index] - previous) % charCount
+            duration = np.rint(fps * steps * self.flapTime)
+            progress = np.clip((frame - np.rint(fps * self.keyTimes[index])) / np.maximum(duration, 1), 0., 1.)
+            remaining += steps * np.where(duration > 0, 1. - progress, 0.)
+            index -= 1
+        # the upper flap shows the last character reached like planner.charactersAtFrame
+        return (shown + np.floor(1e-6 - remaining).astype(np.int64)) % charCount
+
+    def stateAt(self, time, fps):
+        # board string shown at the given time
+        return "".join(np.array(list(self.characters))[self.positionsAt(time, fps)]) if len(self.characters) > 0 else self.startString
+
+    def flapCount(self, fromIndex, toIndex):
+        # maximum number of flaps over all cells to switch between two resolved states, cells with unknown characters
+        # keep their previous character like in the planner
+        if self.cellCount == 0 or len(self.characters) == 0:
+            return 0
+        fromPos = self._shownPositions(fromIndex)
+        toPos = self._shownPositions(toIndex)
+        return int(((toPos - fromPos) % len(self.characters)).max())
+
+    def neededTime(self, index):
+        # time to switch from the previous state (or the initial state) to the state of the given entry
+        return self.flapCount(index - 1, index) * self.flapTime
+
+    def slack(self, index):
+        # time reserve before the entry, negative if the switch to the previous entry is not completed by its time key
+        # (rounded to microseconds such that sums of time keys and flap times are not rejected by rounding errors)
+        if index == 0:
+            return 0 # the first switch may start at any time
+        return round(self.keyTimes[index] - self.keyTimes[index - 1] - self.minimumGap(index), 6)
+
+    def conflicts(self, tolerance=DUPLICATE_TOLERANCE):
+        # single forward pass over all entries: (index, kind, value) for time keys too close to the previous one
+        # (kind "duplicate", value: time difference) and for switches which cannot be completed in time (kind "time", value: slack)
+        result = []
+        for i in range(len(self.entries)):
+            if i > 0 and round(self.keyTimes[i] - self.keyTimes[i-1], 6) < tolerance:
+                result.append((i, "duplicate", self.keyTimes[i] - self.keyTimes[i-1]))
+                continue
+            slack = self.slack(i)
+            if slack < 0:
+                result.append((i, "time", slack))
+        return result
+
+    def minimumGap(self, index):
+        # shortest feasible time between the time keys of the previous entry and the given one: the switch to the
+        # previous entry starts at its time key and has to be completed before the next one starts
+        return max(self.neededTime(index - 1), DUPLICATE_TOLERANCE)
+
+    def followingTime(self, index, keyTime, hold=0., fps=None):
+        # earliest time key after the entry with the given index placed at keyTime, with fps on the first frame after the
+        # end of the switch as the planner rounds it (start and duration are rounded to frames separately)
+        earliest = keyTime + max(self.neededTime(index) + hold, DUPLICATE_TOLERANCE)
+        if fps is None:
+            return earliest
+        endFrame = np.rint(fps * keyTime) + np.rint(fps * (self.neededTime(index) + hold))
+        return float(max(endFrame, np.ceil(round(fps * earliest, 6)))) / fps
+
+    def earliestTime(self, entry, replaceIndex=None, fps=None):
+        # earliest feasible time key of the entry without changing its position relative to the other entries
+        candidate = self.copy()
+        if replaceIndex is not None:
+            candidate.remove(replaceIndex)
+        index = candidate.insert(entry)
+        if index == 0:
+            return 0. # displayed from the beginning
+        return candidate.followingTime(index - 1, candidate.keyTimes[index - 1], fps=fps)
+
+    def retime(self, compact=False, hold=0., fps=None):
+        # new time keys of all entries in a single forward pass: infeasible entries are moved to their earliest
+        # feasible time (plus the hold time), with compact all entries are moved as early as possible
+        times = []
+        for i in range(len(self.entries)):
+            keyTime = self.keyTimes[i]
+            if i == 0:
+                times.append(keyTime)
+                continue
+            earliest = self.followingTime(i - 1, times[-1], hold, fps)
+            times.append(earliest if compact else max(keyTime, earliest))
+        return times
+
+    def checkEntry(self, entry, replaceIndex=None):
+        # time reserve (previous, next) if the entry were added or would replace an existing one, next: the switch to
+        # the entry has to be completed before the next entry, which switches from the new state before the one after it
+        candidate = self.copy()
+        if replaceIndex is not None:
+            candidate.remove(replaceIndex)
+        index = candidate.insert(entry)
+        slackPrev = candidate.slack(index)
+        slackNext = min([candidate.slack(i) for i in range(index + 1, min(index + 3, len(candidate.entries)))], default=0)
+        return slackPrev, slackNext
+
+
+def firstChange(entries, other, withTimes=True):
+    # index of the first entry that differs between two entry lists, the time keys are only compared if withTimes is set
+    start = 0 if withTimes else 1
+    index = 0
+    limit = min(len(entries), len(other))
+    while index < limit and entries[index][start:] == other[index][start:]:
+        index += 1
+    return index
+
+
+_timelines = {}
+
+def getTimeline(name, cellCount, characters, flapTime):
+    # one cached timeline engine per split flap collection
+    timeline = _timelines.get(name)
+    if timeline is None or not timeline.matches(cellCount, characters, flapTime):
+        timeline = Timeline(cellCount, characters, flapTime)
+        _timelines[name] = timeline
+    return timeline
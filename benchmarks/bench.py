@@ -0,0 +1,220 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Benchmarks of the text formatting, the feasibility checks, the animation planning and the
+# keyframe writing of SplitFlapApplyFrames, run outside of Blender with the bpy stand-in.
+# Requires numpy and pillow like the addon itself.
+#
+#   python benchmarks/bench.py [--cases plan,apply] [--sizes 12x1,100x100] [--keys 10,5000]
+#                              [--repeat 5] [--json result.json] [--compare baseline.json]
+#
+# Every case reports the best and mean wall time of the repetitions and the peak of the memory
+# allocated during a separate run traced by tracemalloc.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bpystub
+bpy = bpystub.install()
+
+from SplitFlapTable import control, planner, timeline as timelineModule
+
+CHARACTERS = " ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.:-"
+FLAP_TIME = 0.05
+SIZES = ((1, 12), (4, 40), (20, 50), (100, 100)) # rows x columns
+KEY_COUNTS = (10, 100, 1000, 5000)
+MAX_WORK = 2e6 # skip cases with more cells x keys (raise with --max-work, the plan of 1e7 needs several GB)
+
+
+def parseSizes(value):
+    sizes = []
+    for item in value.split(","):
+        cols, rows = item.lower().split("x")
+        sizes.append((int(rows), int(cols)))
+    return sizes
+
+
+def randomTexts(rng, count, length):
+    codes = rng.integers(0, len(CHARACTERS), size=(count, length))
+    lookup = np.array(list(CHARACTERS))
+    return ["".join(row) for row in lookup[codes]]
+
+
+def makeBoard(name, rowCount, colCount, objects=True):
+    # collection with one split flap item object per cell like SplitFlapController creates it
+    collection = bpy.data.collections.new(name)
+    collection["SplitFlapSettings.flapTime"] = FLAP_TIME
+    collection["SplitFlapSettings.characters"] = CHARACTERS
+    collection["SplitFlapSettings.rowCount"] = rowCount
+    collection["SplitFlapSettings.colCount"] = colCount
+    collection["SplitFlap"] = "SplitFlap"
+    for i in range(rowCount * colCount if objects else 0):
+        obj = bpy.data.objects.new("%s.Item%d" % (name, i))
+        obj.modifiers.append(bpystub.Modifier("SplitFlapCircle"))
+        obj["SplitFlapItem"] = True
+        collection.all_objects.append(obj)
+    return collection
+
+
+def makeScene(collection, keyCount, rng):
+    # time keys far enough apart to be feasible, random texts over the whole board
+    scene = bpystub.Scene()
+    cellCount = collection["SplitFlapSettings.rowCount"] * collection["SplitFlapSettings.colCount"]
+    step = len(CHARACTERS) * FLAP_TIME + 0.5
+    for i, text in enumerate(randomTexts(rng, keyCount, cellCount)):
+        item = scene.splitFlapAnimations.items.add()
+        item.text = text
+        item.formattedText = text
+        item.keyTime = i * step
+        item.extend = True
+        item.center = False
+        item.collectionID = collection.name
+    scene.splitFlapKeySetting.collectionID = collection.name
+    scene.splitFlapKeySetting.collection = collection
+    return scene
+
+
+def timelineEntries(scene):
+    return [(item.keyTime, item.formattedText, item.extend, item.center) for item in scene.splitFlapAnimations.items]
+
+
+# cases: functions returning (prepare, run), prepare is called before every timed run
+
+def caseFormat(rowCount, colCount, keyCount, rng):
+    # multi-line text block of up to 2048 characters with lower case and unknown characters
+    length = min(2048, rowCount * colCount)
+    words = randomTexts(rng, length // 8 + 1, 7)
+    text = "\n".join(" ".join(words[i:i+3]).lower() + "äö#" for i in range(0, len(words), 3))[:length]
+    def run():
+        for i in range(keyCount):
+            timelineModule.formatText(text, CHARACTERS, colCount)
+    return None, run
+
+
+def caseFeasibility(rowCount, colCount, keyCount, rng):
+    # full conflict sweep over a fresh timeline and the check of a new entry in the middle
+    collection = makeBoard("Feasibility%dx%dk%d" % (colCount, rowCount, keyCount), rowCount, colCount, objects=False)
+    scene = makeScene(collection, keyCount, rng)
+    entries = timelineEntries(scene)
+    newEntry = (entries[len(entries) // 2][0] + 0.3, randomTexts(rng, 1, rowCount * colCount)[0], True, False)
+    def run():
+        timeline = timelineModule.Timeline(rowCount * colCount, CHARACTERS, FLAP_TIME)
+        timeline.sync(entries)
+        timeline.conflicts()
+        timeline.checkEntry(newEntry)
+    return None, run
+
+
+def casePlan(rowCount, colCount, keyCount, rng):
+    collection = makeBoard("Plan%dx%dk%d" % (colCount, rowCount, keyCount), rowCount, colCount, objects=False)
+    scene = makeScene(collection, keyCount, rng)
+    timeline = timelineModule.Timeline(rowCount * colCount, CHARACTERS, FLAP_TIME)
+    timeline.sync(timelineEntries(scene))
+    states = timeline.states()
+    def run():
+        plan = planner.planFrames(timeline.cellCount, CHARACTERS, FLAP_TIME, 24., timeline.keyTimes, states)
+        for cell, frames, values in planner.cellKeyframes(plan):
+            pass
+    return None, run
+
+
+def caseApply(rowCount, colCount, keyCount, rng):
+    # complete SplitFlapApplyFrames run writing the keyframes of all split flap items
+    collection = makeBoard("Apply%dx%dk%d" % (colCount, rowCount, keyCount), rowCount, colCount)
+    scene = makeScene(collection, keyCount, rng)
+    context = bpystub.newContext(scene)
+    def prepare():
+        timelineModule._timelines.clear()
+    def run():
+        control.SplitFlapApplyFrames(output='KEYFRAMES', incremental=False).execute(context)
+    return prepare, run
+
+
+def caseReapply(rowCount, colCount, keyCount, rng):
+    # incremental SplitFlapApplyFrames run after changing the text of one entry in the middle
+    collection = makeBoard("Reapply%dx%dk%d" % (colCount, rowCount, keyCount), rowCount, colCount)
+    scene = makeScene(collection, keyCount, rng)
+    context = bpystub.newContext(scene)
+    control.SplitFlapApplyFrames(output='KEYFRAMES', incremental=False).execute(context)
+    item = scene.splitFlapAnimations.items[keyCount // 2]
+    texts = [item.formattedText, randomTexts(rng, 1, len(item.formattedText))[0]]
+    def prepare():
+        texts.reverse()
+        item.formattedText = texts[0]
+    def run():
+        control.SplitFlapApplyFrames(output='KEYFRAMES', incremental=True).execute(context)
+    return prepare, run
+
+
+CASES = {"format" : caseFormat, "feasibility" : caseFeasibility, "plan" : casePlan, "apply" : caseApply, "reapply" : caseReapply}
+
+
+def measure(prepare, run, repeat):
+    times = []
+    for i in range(repeat):
+        if prepare is not None:
+            prepare()
+        startTime = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - startTime)
+    if prepare is not None:
+        prepare()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), sum(times) / len(times), peak
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks of the split flap addon outside of Blender.")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma separated cases out of %s" % ", ".join(CASES))
+    parser.add_argument("--sizes", default=",".join("%dx%d" % (cols, rows) for rows, cols in SIZES), help="board sizes as <columns>x<rows>")
+    parser.add_argument("--keys", default=",".join(str(count) for count in KEY_COUNTS), help="timeline lengths")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-work", type=float, default=MAX_WORK, help="skip cases with more cells x keys")
+    parser.add_argument("--json", default=None, help="save the results to this file")
+    parser.add_argument("--compare", default=None, help="results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = {(r["case"], r["size"], r["keys"]) : r for r in json.load(f)}
+    results = []
+    print("%-12s %9s %6s %11s %11s %11s %8s" % ("case", "size", "keys", "best ms", "mean ms", "peak KiB", "ratio"))
+    for caseName in args.cases.split(","):
+        for rowCount, colCount in parseSizes(args.sizes):
+            for keyCount in [int(count) for count in args.keys.split(",")]:
+                size = "%dx%d" % (colCount, rowCount)
+                if rowCount * colCount * keyCount > args.max_work:
+                    print("%-12s %9s %6d %11s" % (caseName, size, keyCount, "skipped"))
+                    continue
+                rng = np.random.default_rng(0)
+                prepare, run = CASES[caseName](rowCount, colCount, keyCount, rng)
+                best, mean, peak = measure(prepare, run, args.repeat)
+                result = {"case" : caseName, "size" : size, "keys" : keyCount, "best" : best, "mean" : mean, "peak" : peak}
+                results.append(result)
+                reference = baseline.get((caseName, size, keyCount))
+                ratio = "%.2fx" % (reference["best"] / best) if reference is not None and best > 0 else ""
+                print("%-12s %9s %6d %11.3f %11.3f %11.1f %8s" % (caseName, size, keyCount, 1000 * best, 1000 * mean, peak / 1024, ratio))
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,323 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Lightweight stand-in for the parts of bpy (and mathutils, addon_utils, bpy_extras) the addon
+# uses, such that its code paths can be timed in an ordinary Python environment. Only the data
+# handling is imitated (custom properties, modifiers, F-curves with bulk keyframe access), nothing
+# is drawn or evaluated.
+
+import sys
+import types
+
+import numpy as np
+
+KEYFRAME_ENUMS = {
+    "interpolation" : ["CONSTANT", "LINEAR", "BEZIER", "SINE", "QUAD", "CUBIC", "QUART", "QUINT", "EXPO", "CIRC", "BACK", "BOUNCE", "ELASTIC"],
+    "handle_left_type" : ["FREE", "ALIGNED", "VECTOR", "AUTO", "AUTO_CLAMPED"],
+    "handle_right_type" : ["FREE", "ALIGNED", "VECTOR", "AUTO", "AUTO_CLAMPED"],
+}
+
+
+class StubID:
+    # data block with custom properties
+    def __init__(self, name=""):
+        self.name = name
+        self._props = {}
+
+    def __getitem__(self, key):
+        return self._props[key]
+
+    def __setitem__(self, key, value):
+        self._props[key] = value
+
+    def __delitem__(self, key):
+        del self._props[key]
+
+    def __contains__(self, key):
+        return key in self._props
+
+    def get(self, key, default=None):
+        return self._props.get(key, default)
+
+    def keys(self):
+        return self._props.keys()
+
+
+class DataCollection:
+    # bpy.data.<type>: access by name, creation of new data blocks
+    def __init__(self, factory=StubID):
+        self._items = {}
+        self._factory = factory
+
+    def new(self, name, *args, **kwargs):
+        item = self._factory(name)
+        self._items[name] = item
+        return item
+
+    def link(self, item):
+        self._items[item.name] = item
+
+    def remove(self, item):
+        self._items.pop(item.name, None)
+
+    def get(self, name, default=None):
+        return self._items.get(name, default)
+
+    def keys(self):
+        return self._items.keys()
+
+    def __getitem__(self, name):
+        return self._items[name]
+
+    def __contains__(self, name):
+        return name in self._items
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __len__(self):
+        return len(self._items)
+
+
+class Keyframe:
+    def __init__(self, points, index):
+        self.points = points
+        self.index = index
+
+
+class KeyframePoints:
+    def __init__(self):
+        self._arrays = {"co" : np.zeros(0, dtype=np.float32)}
+        for attribute in KEYFRAME_ENUMS:
+            self._arrays[attribute] = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self._arrays["interpolation"])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return Keyframe(self, index)
+
+    def add(self, count):
+        self._arrays["co"] = np.concatenate((self._arrays["co"], np.zeros(2 * count, dtype=np.float32)))
+        for attribute in KEYFRAME_ENUMS:
+            self._arrays[attribute] = np.concatenate((self._arrays[attribute], np.zeros(count, dtype=np.int32)))
+
+    def remove(self, keyframe, fast=False):
+        # like Blender, the following keyframes are moved, removing the last one is cheap
+        i = keyframe.index
+        last = i == len(self) - 1
+        for attribute, values in self._arrays.items():
+            width = 2 if attribute == "co" else 1
+            if last:
+                self._arrays[attribute] = values[:width * i]
+            else:
+                self._arrays[attribute] = np.delete(values, range(width * i, width * (i + 1)))
+
+    def foreach_get(self, attribute, values):
+        values[:] = self._arrays[attribute]
+
+    def foreach_set(self, attribute, values):
+        self._arrays[attribute][:] = values
+
+    def sort(self):
+        order = np.argsort(self._arrays["co"][0::2], kind="stable")
+        co = self._arrays["co"].reshape(-1, 2)[order]
+        self._arrays["co"] = co.ravel()
+        for attribute in KEYFRAME_ENUMS:
+            self._arrays[attribute] = self._arrays[attribute][order]
+
+
+class FCurve:
+    def __init__(self, dataPath):
+        self.data_path = dataPath
+        self.keyframe_points = KeyframePoints()
+
+    def update(self):
+        self.keyframe_points.sort()
+
+
+class FCurves(list):
+    def find(self, dataPath):
+        for fcurve in self:
+            if fcurve.data_path == dataPath:
+                return fcurve
+        return None
+
+    def new(self, dataPath):
+        fcurve = FCurve(dataPath)
+        self.append(fcurve)
+        return fcurve
+
+
+class Action(StubID):
+    def __init__(self, name=""):
+        super().__init__(name)
+        self.fcurves = FCurves()
+
+
+class AnimData:
+    def __init__(self):
+        self.action = None
+
+
+class Modifier(StubID):
+    def __init__(self, name, type='NODES'):
+        super().__init__(name)
+        self.type = type
+        self.node_group = None
+
+
+class Object(StubID):
+    def __init__(self, name=""):
+        super().__init__(name)
+        self.type = 'MESH'
+        self.modifiers = []
+        self.animation_data = None
+        self.hide_viewport = False
+        self.hide_render = False
+
+    def animation_data_create(self):
+        if self.animation_data is None:
+            self.animation_data = AnimData()
+        return self.animation_data
+
+    def animation_data_clear(self):
+        self.animation_data = None
+
+
+class Collection(StubID):
+    def __init__(self, name=""):
+        super().__init__(name)
+        self.all_objects = []
+
+
+class Namespace(types.SimpleNamespace):
+    pass
+
+
+class PropertyGroup(Namespace):
+    # registered properties and custom properties share their storage
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+
+class Items(list):
+    # CollectionProperty of property groups
+    def __init__(self, factory=PropertyGroup):
+        super().__init__()
+        self._factory = factory
+
+    def add(self):
+        item = self._factory()
+        self.append(item)
+        return item
+
+    def remove(self, index):
+        del self[index]
+
+
+class Scene(StubID):
+    def __init__(self, name="Scene"):
+        super().__init__(name)
+        self.render = Namespace(fps=24, fps_base=1.)
+        self.frame_current = 1
+        self.frame_start = 1
+        self.frame_end = 250
+        self.frame_subframe = 0.
+        self.splitFlapKeySetting = Namespace(collectionID="", collection=None)
+        self.splitFlapAnimations = Namespace(items=Items(), itemIndex=0)
+        self.splitFlapAnimationIndex = -1
+        self.objects = []
+
+    def frame_set(self, frame):
+        self.frame_current = frame
+
+
+class Operator:
+    def __init__(self, **properties):
+        self.reports = []
+        # properties not passed keep the default of their declaration
+        for cls in reversed(type(self).__mro__):
+            for key, declaration in vars(cls).get("__annotations__", {}).items():
+                if isinstance(declaration, dict) and "default" in declaration:
+                    setattr(self, key, declaration["default"])
+        for key, value in properties.items():
+            setattr(self, key, value)
+
+    def report(self, level, message):
+        self.reports.append((level, message))
+
+
+class Vector(tuple):
+    def __new__(cls, values=(0., 0., 0.)):
+        return super().__new__(cls, values)
+
+
+def _property(*args, **kwargs):
+    return kwargs
+
+
+def _enumProperty(attribute, names):
+    items = {name : Namespace(identifier=name, value=i) for i, name in enumerate(names)}
+    return Namespace(enum_items=items)
+
+
+def newContext(scene=None):
+    scene = scene if scene is not None else Scene()
+    edit = Namespace(keyframe_new_interpolation_type='BEZIER', keyframe_new_handle_type='AUTO_CLAMPED')
+    return Namespace(scene=scene, preferences=Namespace(edit=edit), view_layer=Namespace(update=lambda: None))
+
+
+def install():
+    # register the stand-in modules, must be called before the addon is imported
+    if "bpy" in sys.modules and not getattr(sys.modules["bpy"], "isStub", False):
+        raise RuntimeError("the real bpy module is already loaded")
+    bpy = types.ModuleType("bpy")
+    bpy.isStub = True
+    bpy.types = types.ModuleType("bpy.types")
+    for name in ("Panel", "UIList", "PropertyGroup", "Text", "NodeSocket", "Image", "Material"):
+        setattr(bpy.types, name, type(name, (), {}))
+    bpy.types.Operator = Operator
+    bpy.types.Collection = Collection
+    bpy.types.Object = Object
+    bpy.types.Scene = Scene
+    bpy.types.Keyframe = Namespace(bl_rna=Namespace(properties={attribute : _enumProperty(attribute, names) for attribute, names in KEYFRAME_ENUMS.items()}))
+    bpy.props = types.ModuleType("bpy.props")
+    for name in ("BoolProperty", "IntProperty", "FloatProperty", "StringProperty", "EnumProperty", "PointerProperty",
+                 "CollectionProperty", "FloatVectorProperty"):
+        setattr(bpy.props, name, _property)
+    bpy.app = types.ModuleType("bpy.app")
+    bpy.app.handlers = types.ModuleType("bpy.app.handlers")
+    bpy.app.handlers.persistent = lambda function: function
+    bpy.app.handlers.frame_change_pre = []
+    bpy.app.handlers.load_post = []
+    bpy.app.binary_path = ""
+    bpy.utils = types.ModuleType("bpy.utils")
+    bpy.utils.register_class = lambda cls: None
+    bpy.utils.unregister_class = lambda cls: None
+    bpy.path = types.ModuleType("bpy.path")
+    bpy.path.abspath = lambda path: path
+    bpy.data = Namespace(collections=DataCollection(Collection), objects=DataCollection(Object), actions=DataCollection(Action),
+                         images=DataCollection(), materials=DataCollection(), texts=DataCollection(), node_groups=DataCollection(),
+                         is_saved=True)
+    bpy.context = newContext()
+    bpyExtras = types.ModuleType("bpy_extras")
+    bpyExtras.io_utils = types.ModuleType("bpy_extras.io_utils")
+    bpyExtras.io_utils.ImportHelper = type("ImportHelper", (), {})
+    mathutils = types.ModuleType("mathutils")
+    mathutils.Vector = Vector
+    addonUtils = types.ModuleType("addon_utils")
+    addonUtils.modules = lambda: []
+    modules = {"bpy" : bpy, "bpy.types" : bpy.types, "bpy.props" : bpy.props, "bpy.app" : bpy.app, "bpy.app.handlers" : bpy.app.handlers,
+               "bpy.utils" : bpy.utils, "bpy.path" : bpy.path, "bpy_extras" : bpyExtras, "bpy_extras.io_utils" : bpyExtras.io_utils,
+               "mathutils" : mathutils, "addon_utils" : addonUtils}
+    sys.modules.update(modules)
+    return bpy
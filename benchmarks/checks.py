@@ -0,0 +1,273 @@
+# Copyright (c) 2023, Mirko Barthauer
+# All rights reserved.
+
+# This source code is licensed under the MIT-style license found in the
+# LICENSE file in the same directory of this source tree.
+
+# Behaviour checks of the timeline engine and the animation planner, run outside of Blender
+# with the bpy stand-in like the benchmarks. Every check raises an AssertionError on failure.
+#
+#   python benchmarks/checks.py [--seed 0] [--count 50]
+
+import os
+import sys
+import math
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bpystub
+bpy = bpystub.install()
+
+from SplitFlapTable import control, planner, timeline as timelineModule
+
+CHARACTERS = " ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.:-"
+FPS_VALUES = (12., 23.976, 24., 25., 30., 60.)
+
+
+def randomTimeline(rng, cellCount=None, keyCount=None, characters=CHARACTERS, unknown="#"):
+    # random texts (partly shorter than the board, with unknown characters) at random, mostly infeasible time keys
+    cellCount = cellCount if cellCount is not None else int(rng.integers(1, 30))
+    keyCount = keyCount if keyCount is not None else int(rng.integers(1, 20))
+    flapTime = float(rng.choice((0.02, 0.05, 0.1)))
+    lookup = np.array(list(characters + unknown))
+    entries = []
+    keyTimes = np.sort(rng.uniform(0., 3. * keyCount, size=keyCount))
+    if rng.random() < 0.5:
+        keyTimes[0] = 0.
+    for keyTime in keyTimes:
+        text = "".join(lookup[rng.integers(0, len(lookup), size=int(rng.integers(0, cellCount + 1)))])
+        entries.append((float(keyTime), text, bool(rng.random() < 0.5), bool(rng.random() < 0.2)))
+    result = timelineModule.Timeline(cellCount, characters, flapTime)
+    result.sync(entries)
+    return result
+
+
+def withTimes(timeline, keyTimes):
+    result = timeline.copy()
+    result.sync([(keyTime,) + entry[1:] for keyTime, entry in zip(keyTimes, timeline.entries)])
+    return result
+
+
+def assertNoOverlap(timeline, fps):
+    # every switch of a cell starts after the previous switch of the cell has ended
+    plan = planner.planFrames(timeline.cellCount, timeline.characters, timeline.flapTime, fps, timeline.keyTimes, timeline.states())
+    order = np.lexsort((plan.startFrames, plan.cells))
+    cells, startFrames, endFrames = plan.cells[order], plan.startFrames[order], plan.endFrames[order]
+    sameCell = cells[1:] == cells[:-1]
+    overlap = sameCell & (startFrames[1:] < endFrames[:-1])
+    assert not overlap.any(), "switches overlap at fps %g: cell %d starts at frame %d before %d" % (
+        fps, cells[1:][overlap][0], startFrames[1:][overlap][0], endFrames[:-1][overlap][0])
+
+
+def checkRetime(rng, count):
+    # retimed timelines have no conflicts and their switches do not overlap
+    for i in range(count):
+        timeline = randomTimeline(rng)
+        fps = float(rng.choice(FPS_VALUES))
+        for compact in (False, True):
+            for hold in (0., 0.3):
+                retimed = withTimes(timeline, timeline.retime(compact=compact, hold=hold, fps=fps))
+                assert retimed.conflicts() == [], retimed.conflicts()
+                assertNoOverlap(retimed, fps)
+
+
+def checkRetimeExample():
+    # the second switch needs the time of the first one before it starts
+    timeline = timelineModule.Timeline(4, " A-Z", 0.1)
+    timeline.sync([(0., "AAAA", True, False), (5., "ZZZZ", True, False), (10., "    ", True, False), (15., "AAAA", True, False)])
+    keyTimes = timeline.retime(compact=True)
+    assert np.allclose(keyTimes, (0., 0.1, 0.3, 0.4)), keyTimes
+    assertNoOverlap(withTimes(timeline, timeline.retime(compact=True, fps=24.)), 24.)
+
+
+def baselineKeyframes(timeline, fps):
+    # keyframes (cell -> frame -> angle) like the original SplitFlapApplyFrames operator inserted them one by one
+    characters = timeline.characters
+    maxLen = timeline.cellCount
+    lastString = characters[0] * maxLen
+    angles = [0.] * maxLen
+    keyframes = [{} for i in range(maxLen)]
+    for keyTime, formattedText, extend, center in timeline.entries:
+        if extend:
+            targetString = formattedText[:maxLen] if len(formattedText) >= maxLen else formattedText + " " * (maxLen - len(formattedText))
+        elif center:
+            textLen = len(formattedText)
+            if textLen >= maxLen:
+                targetString = formattedText[:maxLen]
+            else:
+                indent = (maxLen - textLen)//2
+                targetString = " " * indent + formattedText + " " * (maxLen - indent - textLen)
+        else:
+            targetString = "%s%s" % (formattedText[:maxLen], lastString[len(formattedText):])
+        startFrame = int(round(fps * keyTime))
+        for i in range(maxLen):
+            if lastString[i] == targetString[i]:
+                continue
+            currentIdx = characters.index(lastString[i])
+            nextIdx = characters.index(targetString[i])
+            idxDiff = nextIdx - currentIdx if nextIdx > currentIdx else nextIdx + len(characters) - currentIdx
+            if keyTime > 0.01:
+                keyframes[i][startFrame] = angles[i]
+            angles[i] += 2 * math.pi * idxDiff / len(characters)
+            keyframes[i][startFrame + int(round(fps * idxDiff * timeline.flapTime))] = angles[i]
+            lastString = lastString[:i] + targetString[i] + lastString[i + 1:]
+    return keyframes
+
+
+def checkBaseline(rng, count):
+    # the planned keyframes are the ones the original operator inserted (boards without unknown characters, the original
+    # operator let extend take precedence over center unlike its feasibility check and the timeline engine)
+    for i in range(count):
+        timeline = randomTimeline(rng, unknown="")
+        timeline.sync([(keyTime, text, extend and not center, center) for keyTime, text, extend, center in timeline.entries])
+        fps = float(rng.choice(FPS_VALUES))
+        plan = planner.planFrames(timeline.cellCount, timeline.characters, timeline.flapTime, fps, timeline.keyTimes, timeline.states())
+        expected = baselineKeyframes(timeline, fps)
+        cells, frames, values = planner.sortedKeyframes(plan)
+        for cell in range(timeline.cellCount):
+            cellFrames, cellValues = frames[cells == cell], values[cells == cell]
+            baselineFrames = np.array(sorted(expected[cell]), dtype=np.int64)
+            baselineValues = np.array([expected[cell][frame] for frame in baselineFrames])
+            assert np.array_equal(cellFrames, baselineFrames) and np.allclose(cellValues, baselineValues), "cell %d: %s != %s" % (
+                cell, (cellFrames, cellValues), (baselineFrames, baselineValues))
+
+
+def checkEarliestTime(rng, count):
+    # an entry added at or moved to its earliest time after feasible entries does not overlap with them
+    for i in range(count):
+        fps = float(rng.choice(FPS_VALUES))
+        timeline = randomTimeline(rng)
+        timeline = withTimes(timeline, timeline.retime(fps=fps))
+        entry = (timeline.keyTimes[-1] + 1., timeline.entries[0][1], bool(rng.random() < 0.5), False)
+        added = timeline.copy()
+        added.insert((added.earliestTime(entry, fps=fps),) + entry[1:])
+        assertNoOverlap(added, fps)
+        if len(timeline.entries) > 1:
+            moved = timeline.copy()
+            last = moved.entries[-1]
+            keyTime = moved.earliestTime(last, replaceIndex=len(moved.entries) - 1, fps=fps)
+            moved.remove(len(moved.entries) - 1)
+            moved.insert((keyTime,) + last[1:])
+            assertNoOverlap(moved, fps)
+
+
+def checkPositionsAt(rng, count):
+    # the characters of the preview (Timeline.positionsAt) are the ones the planned animation shows
+    for i in range(count):
+        fps = float(rng.choice(FPS_VALUES))
+        timeline = randomTimeline(rng)
+        timeline = withTimes(timeline, timeline.retime(compact=bool(rng.random() < 0.5), fps=fps))
+        plan = planner.planFrames(timeline.cellCount, timeline.characters, timeline.flapTime, fps, timeline.keyTimes, timeline.states())
+        lastFrame = int(plan.endFrames.max()) + 2 if len(plan.cells) > 0 else 2
+        for frame in np.concatenate((np.arange(0, lastFrame), rng.uniform(0., lastFrame, size=20))):
+            expected = planner.charactersAtFrame(plan, timeline.cellCount, len(timeline.characters), frame)
+            positions = timeline.positionsAt(frame / fps, fps)
+            assert np.array_equal(positions, expected), "frame %g at fps %g: %s != %s" % (frame, fps, positions, expected)
+
+
+def checkLookupAngles(rng, count):
+    # the per frame lookup of the instanced board and the LOD tiles gives the angles of all transitions
+    for i in range(count):
+        timeline = randomTimeline(rng)
+        fps = float(rng.choice(FPS_VALUES))
+        timeline = withTimes(timeline, timeline.retime(compact=bool(rng.random() < 0.5), fps=fps))
+        plan = planner.planFrames(timeline.cellCount, timeline.characters, timeline.flapTime, fps, timeline.keyTimes, timeline.states())
+        lookup = planner.frameLookup(plan)
+        lastFrame = int(plan.endFrames.max()) + 2 if len(plan.cells) > 0 else 2
+        for frame in np.concatenate((np.arange(-2, lastFrame), rng.uniform(-2., lastFrame, size=20))):
+            expected = planner.anglesAtFrame(plan, timeline.cellCount, frame)
+            angles = planner.lookupAngles(lookup, timeline.cellCount, frame)
+            assert np.allclose(angles, expected), "frame %g: %s != %s" % (frame, angles, expected)
+
+
+def randomText(rng, length):
+    lookup = np.array(list(CHARACTERS + "#"))
+    return "".join(lookup[rng.integers(0, len(lookup), size=length)])
+
+
+def curveKeys(obj):
+    fcurve = control.getFlapFCurve(obj)
+    if fcurve is None:
+        return np.zeros(0), np.zeros(0)
+    co = np.empty(2 * len(fcurve.keyframe_points), dtype=np.float32)
+    fcurve.keyframe_points.foreach_get("co", co)
+    return co[0::2], co[1::2]
+
+
+def checkReapply(rng, count):
+    # incremental applies after random edits of the animation list animate like a full apply, also after reloading the file
+    # (the keyframes of the last apply are not in memory any more)
+    for i in range(max(1, count // 10)):
+        cellCount = int(rng.integers(1, 12))
+        collection = bpy.data.collections.new("Reapply%d" % i)
+        settings = {"flapTime" : float(rng.choice((0.02, 0.05))), "characters" : CHARACTERS, "rowCount" : 1, "colCount" : cellCount}
+        for key, value in settings.items():
+            collection["SplitFlapSettings.%s" % key] = value
+        collection["SplitFlap"] = "SplitFlap"
+        for cell in range(cellCount):
+            obj = bpy.data.objects.new("%s.Item%d" % (collection.name, cell))
+            obj.modifiers.append(bpystub.Modifier("SplitFlapCircle"))
+            obj["SplitFlapItem"] = True
+            collection.all_objects.append(obj)
+        scene = bpystub.Scene()
+        scene.splitFlapKeySetting.collectionID = collection.name
+        items = scene.splitFlapAnimations.items
+        context = bpystub.newContext(scene)
+        compact = bool(rng.random() < 0.7)
+        for edit in range(30):
+            action = rng.integers(0, 4) if len(items) > 0 else 0
+            if action == 0:
+                item = items.add()
+                item.keyTime = float(rng.uniform(0., 20.))
+                item.extend, item.center, item.collectionID = bool(rng.random() < 0.5), False, collection.name
+            else:
+                item = items[int(rng.integers(0, len(items)))]
+            if action == 1:
+                item.keyTime = float(rng.uniform(0., 20.))
+            elif action == 2:
+                items.remove(items.index(item))
+            else:
+                item.formattedText = randomText(rng, int(rng.integers(0, cellCount + 1)))
+            if rng.random() < 0.2:
+                control._applied.clear()
+            operator = control.SplitFlapApplyFrames(output='KEYFRAMES', incremental=edit > 0, compact=compact)
+            operator.execute(context)
+            timeline = control.getCollectionTimeline(scene, collection)
+            plan = planner.planFrames(cellCount, CHARACTERS, timeline.flapTime, 24., timeline.keyTimes, timeline.states())
+            keys = planner.sortedKeyframes(plan)
+            keys = planner.compactKeyframes(*keys) if compact else keys
+            expected = {cell : (frames, values) for cell, frames, values in planner.splitKeyframes(*keys)}
+            for cell, obj in enumerate(collection.all_objects):
+                frames, values = curveKeys(obj)
+                expectedFrames, expectedValues = expected.get(cell, (np.zeros(0), np.zeros(0)))
+                if compact and len(frames) > 0:
+                    # keyframes the interpolation reproduces may be kept where an update starts
+                    samples = np.arange(frames[0] - 1, frames[-1] + 2)
+                    same = np.allclose(np.interp(samples, frames, values), np.interp(samples, expectedFrames, expectedValues), atol=1e-5)
+                    same &= np.isin(expectedFrames, frames).all()
+                else:
+                    same = np.array_equal(frames, expectedFrames) and np.allclose(values, expectedValues, atol=1e-5)
+                assert same, "edit %d cell %d: %s != %s" % (edit, cell, (frames, values), (expectedFrames, expectedValues))
+
+
+CHECKS = {"baseline" : checkBaseline, "retimeExample" : lambda rng, count: checkRetimeExample(), "retime" : checkRetime,
+          "earliestTime" : checkEarliestTime, "positionsAt" : checkPositionsAt, "lookupAngles" : checkLookupAngles, "reapply" : checkReapply}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Behaviour checks of the split flap addon outside of Blender.")
+    parser.add_argument("--checks", default=",".join(CHECKS), help="comma separated checks out of %s" % ", ".join(CHECKS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--count", type=int, default=50, help="number of random timelines per check")
+    args = parser.parse_args(argv)
+    for name in args.checks.split(","):
+        CHECKS[name](np.random.default_rng(args.seed), args.count)
+        print("%-16s ok" % name)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))